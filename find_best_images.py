@@ -33,10 +33,23 @@ Enhanced with:
 - Results collection into a single directory
 - Move operations with backlinks
 - Date preference configuration for quality metrics
+- Tiled matrix similarity engine for large collections
+- Approximate nearest-neighbour index mode for very large collections
+- Memory-mapped, incremental embedding store
+- Exact-duplicate pre-pass to skip redundant inference
+- Perceptual hash prefilter and hash-only mode
+- Parallel decode pipeline feeding the CLIP model
+- Reduced-resolution decoding for embeddings, hashes and region crops
+- Batched, stored region embeddings for region-based similarity
+- Streaming mode that embeds images while discovery is still running
+- Incremental updates that regroup only new, removed and modified images
+- Checkpoints and a run manifest, so interrupted runs can be resumed
+- Output planned in memory and written in parallel, with an undo journal
 """
 
 import os
 import sys
+import shutil
 import argparse
 import logging
 from datetime import datetime
@@ -68,8 +81,9 @@ def parse_arguments():
     
     # Input/Output Parameters
     input_group = parser.add_argument_group('Input/Output Parameters')
-    input_group.add_argument("-i", "--input-dirs", action='append', required=True, 
-                        help="Input directories to search for images (can be specified multiple times)")
+    input_group.add_argument("-i", "--input-dirs", action='append',
+                        help="Input directories to search for images (can be specified multiple times; "
+                             "required unless --undo is used)")
     input_group.add_argument("-o", "--output-dir", required=True,
                         help="Output directory for organized images")
     input_group.add_argument("-e", "--extensions", nargs='+', 
@@ -102,6 +116,11 @@ def parse_arguments():
                         help="Follow symbolic links during directory traversal")
     search_group.add_argument("--min-file-size", type=int, default=0,
                         help="Minimum file size to consider in KB")
+    search_group.add_argument("--validation", choices=cit.VALIDATION_MODES, default="header",
+                        help="Check image data during discovery (full) or only file signatures, leaving "
+                             "broken images to the stages that decode them (header) (default: header)")
+    search_group.add_argument("--skip-report",
+                        help="Write images skipped as unreadable, with the stage and reason, to this JSON file")
     
     # Image Comparison
     comparison_group = parser.add_argument_group('Image Comparison')
@@ -116,6 +135,30 @@ def parse_arguments():
                         help="Device to use for model inference (default: auto)")
     comparison_group.add_argument("--batch-size", type=int, default=16,
                         help="Batch size for processing images (default: 16)")
+    comparison_group.add_argument("--fast-decode", action="store_true", default=True,
+                        help="Decode images at reduced resolution near the size each stage needs (default: True)")
+    comparison_group.add_argument("--no-fast-decode", action="store_false", dest="fast_decode",
+                        help="Decode images at full resolution, e.g. to compare accuracy")
+    comparison_group.add_argument("--tile-size", type=int, default=2048,
+                        help="Rows per block when comparing embeddings; bounds memory use (default: 2048)")
+    comparison_group.add_argument("--vector-dtype", choices=cit.VECTOR_DTYPES, default="float32",
+                        help="Vector type of the similarity matrix; float16 halves and int8 quarters its memory (default: float32)")
+    comparison_group.add_argument("--rescore", action="store_true",
+                        help="With --vector-dtype float16 or int8, rescore pairs near the threshold in float32 so the groups match float32")
+    comparison_group.add_argument("--index", choices=["exact", "ann"], default="exact",
+                        help="Compare all pairs exactly, or use an approximate nearest-neighbour index (default: exact)")
+    comparison_group.add_argument("--ann-lists", type=int,
+                        help="Number of clusters in the approximate index (default: about 4 * sqrt(images))")
+    comparison_group.add_argument("--ann-probes", type=int, default=8,
+                        help="Clusters searched per image with --index ann; higher improves recall but is slower (default: 8)")
+    comparison_group.add_argument("--prefilter", choices=["none"] + cit.HASH_METHODS, default="none",
+                        help="Decide obvious pairs by perceptual hash and compare only uncertain pairs with CLIP (default: none)")
+    comparison_group.add_argument("--hash-only", action="store_true", default=False,
+                        help="Group by perceptual hash alone, without CLIP or torch (uses phash unless --prefilter is set)")
+    comparison_group.add_argument("--hash-same-distance", type=int, default=cit.DEFAULT_SAME_DISTANCE,
+                        help=f"Hash distance at or below which images are the same (default: {cit.DEFAULT_SAME_DISTANCE})")
+    comparison_group.add_argument("--hash-unrelated-distance", type=int, default=cit.DEFAULT_UNRELATED_DISTANCE,
+                        help=f"Hash distance above which images are unrelated (default: {cit.DEFAULT_UNRELATED_DISTANCE})")
     
     # Best Image Selection - Primary Metrics
     quality_group = parser.add_argument_group('Best Image Selection - Primary Metrics')
@@ -123,6 +166,9 @@ def parse_arguments():
                         default=["dimensions", "format_quality", "filesize", "modified_date"],
                         choices=["dimensions", "filesize", "resolution", "format_quality", "modified_date", "created_date"],
                         help="Primary quality metrics to use, in strict order (default: dimensions format_quality filesize modified_date)")
+    quality_group.add_argument("--margin-threshold", type=float, default=0.0,
+                        help="Relative tolerance under the best value of a primary metric that still counts as a tie, "
+                             "e.g. 0.05 for 5%% (default: 0.0, strict ties)")
     
     # Best Image Selection - Secondary Metrics
     secondary_group = parser.add_argument_group('Best Image Selection - Secondary Metrics')
@@ -186,11 +232,42 @@ def parse_arguments():
     control_group.add_argument("--dryrun", action="store_true",
                         help="Show what would be done without making changes")
     control_group.add_argument("--threads", type=int, default=os.cpu_count(),
-                        help=f"Number of threads to use (default: {os.cpu_count()})")
+                        help=f"Number of worker processes decoding images for the model (default: {os.cpu_count()})")
     control_group.add_argument("--cache", action="store_true", default=True,
                         help="Cache embeddings to speed up future runs (default: True)")
     control_group.add_argument("--no-cache", action="store_false", dest="cache",
                         help="Don't cache embeddings")
+    control_group.add_argument("--store-dtype", choices=cit.STORE_DTYPES, default="float32",
+                        help="Vector type for a new embedding store; int8 keeps one scale per vector (default: float32)")
+    control_group.add_argument("--cache-dir",
+                        help="Embedding store directory, shareable across output directories and runs (default: .embedding_store in output directory)")
+    control_group.add_argument("--content-hash", action="store_true", default=True,
+                        help="Reuse embeddings of moved, renamed and copied files by content hash (default: True)")
+    control_group.add_argument("--no-content-hash", action="store_false", dest="content_hash",
+                        help="Only reuse embeddings by path, size and modification time")
+    control_group.add_argument("--stream", action="store_true", default=False,
+                        help="Embed images while directories are still being crawled, storing embeddings as they are "
+                             "computed; skips the exact-duplicate pre-pass and the perceptual hash tier")
+    control_group.add_argument("--update", action="store_true", default=False,
+                        help="Update the output of a previous run in place: regroup only new, removed and modified "
+                             "images and rewrite only the groups that changed")
+    control_group.add_argument("--resume", action="store_true", default=False,
+                        help="Continue an interrupted run from its last checkpoint instead of starting over")
+    control_group.add_argument("--checkpoint-every", type=int, default=cit.DEFAULT_FLUSH_BATCHES,
+                        help=f"Batches between flushes of new embeddings to the store "
+                             f"(default: {cit.DEFAULT_FLUSH_BATCHES})")
+    control_group.add_argument("--output-workers", type=int, default=cit.DEFAULT_OUTPUT_WORKERS,
+                        help=f"Threads copying, linking and moving output files (default: {cit.DEFAULT_OUTPUT_WORKERS})")
+    control_group.add_argument("--plan-report",
+                        help="With --dryrun, write the planned output operations to this file as JSON lines, "
+                             "in the format of the run journal")
+    control_group.add_argument("--undo", action="store_true", default=False,
+                        help="Reverse the output operations of the last run in the output directory, using its "
+                             "journal: delete copies and links, move moved files back and remove created directories")
+    control_group.add_argument("--exact-duplicates", action="store_true", default=True,
+                        help="Collapse byte-identical files before computing embeddings (default: True)")
+    control_group.add_argument("--no-exact-duplicates", action="store_false", dest="exact_duplicates",
+                        help="Compute an embedding for every file, even exact copies")
     
     # Output and Logging
     output_group = parser.add_argument_group('Output and Logging')
@@ -221,7 +298,10 @@ def parse_arguments():
     # Version information
     parser.add_argument("--version", action="version", version=f"%(prog)s {VERSION}")
     
-    return parser.parse_args()
+    args = parser.parse_args()
+    if not args.input_dirs and not args.undo:
+        parser.error("the following arguments are required: -i/--input-dirs")
+    return args
 
 def setup_logging(verbosity, log_file=None):
     """Configure logging based on verbosity level."""
@@ -280,6 +360,482 @@ def parse_metric_weights(weights_str):
     
     return weights
 
+def report_skipped(skip_report, report_file, logger):
+    """Log the images skipped as unreadable and write the skip report if requested."""
+    skip_report.log_summary(logger)
+    if report_file:
+        try:
+            skip_report.write(report_file)
+            logger.info(f"Wrote skip report for {len(skip_report)} entries to {report_file}")
+        except Exception as e:
+            logger.warning(f"Failed to write skip report: {e}")
+
+# Options that don't change what a run computes, so a resumed run may change them
+RUNTIME_OPTIONS = {
+    "resume", "update", "dryrun", "threads", "batch_size", "device", "checkpoint_every", "stream",
+    "verbosity", "progress", "log_file", "force", "skip_existing", "skip_report", "output_workers",
+    "plan_report", "undo"
+}
+
+def get_run_settings(args, input_dirs):
+    """Options the checkpoints of a run depend on; --resume needs them unchanged."""
+    settings = {key: value for key, value in vars(args).items() if key not in RUNTIME_OPTIONS}
+    settings["input_dirs"] = input_dirs
+    return settings
+
+def get_state_settings(args, similarity_threshold, metric_weights, metric_overrides):
+    """Options the saved groups and their outputs depend on; --update needs them unchanged."""
+    return {
+        "similarity_threshold": similarity_threshold,
+        "primary_metrics": args.primary_metrics,
+        "secondary_metrics": args.secondary_metrics,
+        "metric_weights": metric_weights,
+        "date_preference": args.date_preference,
+        "metric_overrides": metric_overrides,
+        "naming_pattern": args.naming_pattern,
+        "file_handling": args.file_handling,
+        "copy_best": args.copy_best,
+        "suffix": args.suffix,
+        "handle_long_paths": args.handle_long_paths,
+        "max_path_length": args.max_path_length,
+        "include_singletons": args.include_singletons,
+        "singletons_subdir": args.singletons_subdir,
+        "collision_strategy": args.collision_strategy,
+        "create_backlinks": args.create_backlinks
+    }
+
+def create_outputs(groups, output_dir, args, metric_weights, metric_overrides, skip_report, logger,
+                   outputs=None, journal=None):
+    """Probe the grouped images and create the output structure for a list of groups."""
+    # A dry run writes its plan in the journal format
+    report = None
+    if args.dryrun and args.plan_report and journal is None:
+        if os.path.exists(args.plan_report):
+            os.remove(args.plan_report)
+        report = journal = cit.OutputJournal(args.plan_report)
+    
+    # Probe every grouped image once; best-image selection and naming read from this table
+    metadata = None
+    if cit.NUMPY_AVAILABLE:
+        metadata = cit.MetadataTable.probe(
+            [path for group in groups if len(group) > 1 for path in group],
+            num_workers=args.threads,
+            show_progress=args.progress and cit.TQDM_AVAILABLE,
+            skip_report=skip_report
+        )
+    
+    results = cit.create_output_structure(
+        groups,
+        output_dir,
+        primary_metrics=args.primary_metrics,
+        secondary_metrics=args.secondary_metrics,
+        metric_weights=metric_weights,
+        date_preference=args.date_preference,
+        metric_overrides=metric_overrides,
+        margin_threshold=args.margin_threshold,
+        naming_pattern=args.naming_pattern,
+        file_handling=args.file_handling,
+        copy_best=args.copy_best,
+        suffix=args.suffix,
+        handle_long_paths=args.handle_long_paths,
+        max_path_length=args.max_path_length,
+        include_singletons=args.include_singletons,
+        singletons_subdir=args.singletons_subdir,
+        collision_strategy=args.collision_strategy,
+        dryrun=args.dryrun,
+        create_backlinks=args.create_backlinks,
+        logger=logger,
+        show_progress=args.progress and cit.TQDM_AVAILABLE,
+        metadata=metadata,
+        outputs=outputs,
+        journal=journal,
+        num_workers=args.output_workers
+    )
+    
+    if report is not None:
+        report.close()
+        logger.info(f"Wrote {len(report.entries)} planned output operations to {args.plan_report}")
+    return results
+
+def undo_run(output_dir, run_dir, state_dir, dryrun, logger):
+    """
+    Reverse the output operations journaled by the last run in an output directory.
+    
+    Returns:
+        Exit code
+    """
+    journal = cit.RunManifest(run_dir, logger=logger).journal() if os.path.isdir(run_dir) else None
+    if journal is None or not journal.entries:
+        logger.error(f"No run journal to undo in {output_dir}")
+        return 1
+    
+    logger.info(f"Undoing {len(journal.entries)} journaled operations in {output_dir}")
+    undone, failed = journal.undo(dryrun=dryrun, logger=logger)
+    if dryrun:
+        logger.info("This was a dry run. No files were actually created or modified.")
+        return 0
+    
+    logger.info(f"Undid {undone} operations; {failed} could not be undone")
+    if failed:
+        logger.warning(f"Kept the journal in {run_dir} so the remaining operations can be retried")
+        return 1
+    
+    # The checkpoints and grouping state describe outputs that no longer exist
+    for directory in (run_dir, state_dir):
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)
+    return 0
+
+def update_groups(state, state_dir, all_images, store, output_dir, args, similarity_threshold,
+                  metric_weights, metric_overrides, skip_report, logger):
+    """
+    Update the output of a previous run from its grouping state.
+    
+    Only new and modified images are embedded and compared, and only the
+    groups that gained or lost members are rewritten in the output directory.
+    
+    Returns:
+        Exit code
+    """
+    added, removed = state.diff(all_images)
+    logger.info(f"Since the last run: {len(added)} new or modified images, "
+                f"{len(removed)} removed or modified images")
+    if not added and not removed:
+        logger.info("No changes since the last run; output is up to date")
+        report_skipped(skip_report, args.skip_report, logger)
+        return 0
+    
+    # Embed only the new and modified images, reusing stored embeddings
+    embeddings = {}
+    images_to_process = added
+    if store is not None:
+        try:
+            embeddings, images_to_process = store.get_many(added)
+            if not args.dryrun:
+                store.save_aliases()
+        except Exception as e:
+            logger.warning(f"Error reading embedding store: {e}")
+            embeddings = {}
+            images_to_process = added
+    
+    logger.info(f"Computing embeddings for {len(images_to_process)} images")
+    if images_to_process:
+        try:
+            model, processor, device = cit.load_clip_model(device=args.device)
+            logger.info(f"Loaded CLIP model on device: {device}")
+            
+            new_embeddings = cit.compute_embeddings_batch(
+                images_to_process,
+                model,
+                processor,
+                device,
+                batch_size=args.batch_size,
+                show_progress=args.progress and cit.TQDM_AVAILABLE,
+                num_workers=args.threads,
+                fast_decode=args.fast_decode,
+                skip_report=skip_report
+            )
+            embeddings.update(new_embeddings)
+            
+            if store is not None and not args.dryrun:
+                try:
+                    store.append(new_embeddings)
+                except Exception as e:
+                    logger.warning(f"Failed to update embedding store: {e}")
+        except Exception as e:
+            logger.error(f"Error computing embeddings: {e}")
+            return 1
+    
+    # Compare the added images against the saved vectors and regroup what changed
+    try:
+        groups, affected, stale_outputs = state.update(embeddings, removed, similarity_threshold,
+                                                       tile_size=args.tile_size)
+    except Exception as e:
+        logger.error(f"Error updating groups: {e}")
+        return 1
+    
+    # Replace the outputs of the changed groups only
+    try:
+        removed_count = cit.remove_outputs(stale_outputs, dryrun=args.dryrun, logger=logger)
+        group_outputs = {}
+        results = create_outputs([groups[idx] for idx in affected], output_dir, args, metric_weights,
+                                 metric_overrides, skip_report, logger, outputs=group_outputs)
+    except Exception as e:
+        logger.error(f"Error updating output structure: {e}")
+        return 1
+    
+    if not args.dryrun:
+        state.set_group_outputs({affected[idx]: paths for idx, paths in group_outputs.items()})
+        try:
+            state.save(state_dir)
+        except Exception as e:
+            logger.warning(f"Failed to save grouping state: {e}")
+    
+    if args.collect_results:
+        logger.warning("--collect-results is not updated incrementally; run without --update to rebuild the collection")
+    
+    logger.info(f"Summary:")
+    logger.info(f"- Images added or modified: {len(added)}")
+    logger.info(f"- Images removed or modified: {len(removed)}")
+    logger.info(f"- Groups rewritten: {len(affected)} of {len(groups)}")
+    logger.info(f"- Stale output paths removed: {removed_count}")
+    logger.info(f"- Output directories created: {len(results)}")
+    if cit.copy_stats:
+        logger.info(f"- Files copied by method: {cit.copy_stats.summary()}")
+    if skip_report:
+        logger.info(f"- Images skipped as unreadable: {len(skip_report.paths())}")
+    
+    report_skipped(skip_report, args.skip_report, logger)
+    
+    if args.dryrun:
+        logger.info("This was a dry run. No files were actually created or modified.")
+    return 0
+
+def compute_groups(all_images, args, store, similarity_threshold, skip_report, logger,
+                   streamed_embeddings=None, model=None, processor=None, device=None):
+    """
+    Group the discovered images: collapse exact duplicates, run the perceptual
+    hash tier, compute embeddings and compare them.
+    
+    Returns:
+        tuple: (similar_groups, embeddings, duplicates), or None if a stage failed
+    """
+    # Collapse byte-identical files so each is embedded only once
+    duplicates = {}
+    unique_images = all_images
+    if args.exact_duplicates and not args.stream:
+        try:
+            duplicates = cit.find_exact_duplicates(
+                all_images,
+                logger=logger,
+                show_progress=args.progress and cit.TQDM_AVAILABLE
+            )
+            collapsed = {path for dups in duplicates.values() for path in dups}
+            unique_images = [img for img in all_images if img not in collapsed]
+            if collapsed:
+                logger.info(f"Exact-duplicate pre-pass skipped inference for {len(collapsed)} of "
+                            f"{len(all_images)} images ({100.0 * len(collapsed) / len(all_images):.1f}%)")
+        except Exception as e:
+            logger.warning(f"Error finding exact duplicates: {e}")
+            duplicates = {}
+            unique_images = all_images
+    
+    # Perceptual hash tier: decide obvious pairs by hash, leaving only uncertain pairs for CLIP
+    hash_method = args.prefilter
+    if args.hash_only and hash_method == "none":
+        hash_method = "phash"
+    
+    grouping_images = None
+    same_pairs = None
+    uncertain_pairs = None
+    embedding_targets = unique_images
+    if hash_method != "none":
+        try:
+            perceptual_hashes = {}
+            images_to_hash = unique_images
+            if store is not None:
+                perceptual_hashes, images_to_hash = store.get_perceptual_hashes(unique_images, hash_method)
+            
+            new_hashes = cit.compute_perceptual_hashes(
+                images_to_hash,
+                method=hash_method,
+                show_progress=args.progress and cit.TQDM_AVAILABLE,
+                fast_decode=args.fast_decode,
+                skip_report=skip_report
+            )
+            perceptual_hashes.update(new_hashes)
+            if store is not None and not args.dryrun:
+                try:
+                    store.append_perceptual_hashes(new_hashes, hash_method)
+                except Exception as e:
+                    logger.warning(f"Failed to store perceptual hashes: {e}")
+            
+            same_pairs, uncertain_pairs = cit.classify_hash_pairs(
+                perceptual_hashes,
+                same_distance=args.hash_same_distance,
+                unrelated_distance=args.hash_unrelated_distance,
+                logger=logger
+            )
+            if args.hash_only:
+                uncertain_pairs = []
+            
+            # Only images in an uncertain pair need an embedding
+            grouping_images = [img for img in unique_images if img in perceptual_hashes]
+            uncertain_images = set() if args.hash_only else uncertain_pairs.images
+            embedding_targets = [img for img in grouping_images if img in uncertain_images]
+            logger.info(f"Perceptual hash tier left {len(embedding_targets)} of {len(grouping_images)} "
+                        f"images for CLIP")
+        except Exception as e:
+            logger.error(f"Error computing perceptual hashes: {e}")
+            return None
+    
+    # Determine which images need embedding computation
+    cached_embeddings = {}
+    images_to_process = embedding_targets
+    if streamed_embeddings is not None:
+        cached_embeddings = streamed_embeddings
+        images_to_process = []
+    elif store is not None:
+        try:
+            cached_embeddings, images_to_process = store.get_many(embedding_targets)
+            if not args.dryrun:
+                store.save_aliases()
+        except Exception as e:
+            logger.warning(f"Error reading embedding store: {e}")
+            cached_embeddings = {}
+            images_to_process = embedding_targets
+    
+    logger.info(f"Computing embeddings for {len(images_to_process)} images")
+    
+    # Skip embedding computation if no new images
+    if not images_to_process:
+        embeddings = cached_embeddings
+        logger.info("No new images to process, using cached embeddings")
+    else:
+        # Load models for embedding calculation
+        try:
+            model, processor, device = cit.load_clip_model(device=args.device)
+            logger.info(f"Loaded CLIP model on device: {device}")
+            
+            # Compute embeddings
+            new_embeddings = cit.compute_embeddings_batch(
+                images_to_process,
+                model,
+                processor,
+                device,
+                batch_size=args.batch_size,
+                show_progress=args.progress and cit.TQDM_AVAILABLE,
+                num_workers=args.threads,
+                fast_decode=args.fast_decode,
+                skip_report=skip_report,
+                store=store if not args.dryrun else None,
+                flush_batches=args.checkpoint_every
+            )
+            
+            # Combine cached and new embeddings
+            embeddings = {**cached_embeddings, **new_embeddings}
+                
+        except Exception as e:
+            logger.error(f"Error computing embeddings: {e}")
+            return None
+    
+    # Embed the regions of each image once, reusing stored region embeddings
+    region_embeddings = None
+    region_types = cit.get_region_types(args.check_regions)
+    if region_types and not args.hash_only:
+        region_embeddings = {region_type: {} for region_type in region_types}
+        region_stores = {}
+        region_targets = list(embeddings.keys())
+        missing_regions = set(region_targets)
+        
+        if store is not None:
+            try:
+                missing_regions = set()
+                for region_type in region_types:
+                    region_stores[region_type] = store.region_store(region_type)
+                    if region_stores[region_type].stale_rows > len(region_stores[region_type]) and not args.dryrun:
+                        region_stores[region_type].compact()
+                    cached, missing = region_stores[region_type].get_many(region_targets)
+                    if not args.dryrun:
+                        region_stores[region_type].save_aliases()
+                    region_embeddings[region_type].update(cached)
+                    missing_regions.update(missing)
+            except Exception as e:
+                logger.warning(f"Error reading region embeddings from store: {e}")
+                region_stores = {}
+                missing_regions = set(region_targets)
+        
+        if missing_regions:
+            try:
+                if model is None:
+                    model, processor, device = cit.load_clip_model(device=args.device)
+                    logger.info(f"Loaded CLIP model on device: {device}")
+                
+                new_region_embeddings = cit.compute_region_embeddings_batch(
+                    [img for img in region_targets if img in missing_regions],
+                    model,
+                    processor,
+                    device,
+                    regions=args.check_regions,
+                    batch_size=args.batch_size,
+                    show_progress=args.progress and cit.TQDM_AVAILABLE,
+                    num_workers=args.threads,
+                    fast_decode=args.fast_decode,
+                    skip_report=skip_report,
+                    stores=region_stores if not args.dryrun else None,
+                    flush_batches=args.checkpoint_every
+                )
+            except Exception as e:
+                logger.error(f"Error computing region embeddings: {e}")
+                return None
+            
+            # Stored region embeddings take precedence over recomputed ones
+            for region_type in region_types:
+                region_embeddings[region_type] = {**new_region_embeddings[region_type],
+                                                  **region_embeddings[region_type]}
+    
+    # Group similar images, using region checking if requested
+    try:
+        # Pairs decided or left uncertain by the perceptual hash tier, if used
+        pair_options = {
+            "image_paths": grouping_images,
+            "candidate_pairs": uncertain_pairs,
+            "linked_pairs": same_pairs
+        }
+        
+        if args.hash_only:
+            if args.check_regions > 0:
+                logger.warning("--check-regions is not used with --hash-only")
+            similar_groups = cit.group_similar_images(
+                embeddings,
+                similarity_threshold=similarity_threshold,
+                similarity_preset=args.similarity_preset,
+                logger=logger,
+                show_progress=args.progress and cit.TQDM_AVAILABLE,
+                **pair_options
+            )
+        elif args.check_regions > 0:
+            logger.info(f"Using region-based similarity with {args.check_regions} regions")
+            
+            similar_groups = cit.group_similar_images(
+                embeddings,
+                similarity_threshold=similarity_threshold,
+                similarity_preset=args.similarity_preset,
+                use_regions=args.check_regions,
+                region_embeddings=region_embeddings,
+                logger=logger,
+                show_progress=args.progress and cit.TQDM_AVAILABLE,
+                tile_size=args.tile_size,
+                index=args.index,
+                fast_decode=args.fast_decode,
+                vector_dtype=args.vector_dtype,
+                rescore=args.rescore,
+                **pair_options
+            )
+        else:
+            similar_groups = cit.group_similar_images(
+                embeddings,
+                similarity_threshold=similarity_threshold,
+                similarity_preset=args.similarity_preset,
+                logger=logger,
+                show_progress=args.progress and cit.TQDM_AVAILABLE,
+                tile_size=args.tile_size,
+                index=args.index,
+                ann_lists=args.ann_lists,
+                ann_probes=args.ann_probes,
+                vector_dtype=args.vector_dtype,
+                rescore=args.rescore,
+                **pair_options
+            )
+    except Exception as e:
+        logger.error(f"Error grouping similar images: {e}")
+        return None
+    
+    # Put the collapsed exact duplicates back into their groups
+    cit.restore_duplicates(similar_groups, duplicates)
+    
+    return similar_groups, embeddings, duplicates
+
 def main():
     """Main entry point for the script."""
     start_time = time.time()
@@ -289,14 +845,41 @@ def main():
     logger = setup_logging(args.verbosity, args.log_file)
     logger.info(f"Starting find_best_images.py version {VERSION}")
     
-    # Check for required dependencies
+    # Check for required dependencies (hash-only mode does not need torch)
     missing_deps = cit.check_dependencies()
+    if args.hash_only and not cit.NUMPY_AVAILABLE:
+        missing_deps.append("numpy")
     if missing_deps:
         print("Error: Missing required dependencies:")
         for dep in missing_deps:
             print(f"  - {dep}")
         print("\nPlease install the missing dependencies and try again.")
-        print("You can install them with: pip install pillow torch transformers tqdm")
+        if args.hash_only:
+            print("You can install them with: pip install pillow numpy tqdm")
+        else:
+            print("You can install them with: pip install pillow torch transformers tqdm")
+        return 1
+    
+    if args.stream and args.hash_only:
+        logger.error("--stream computes embeddings for every image and cannot be combined with --hash-only")
+        return 1
+    if args.stream and args.prefilter != "none":
+        logger.warning("--prefilter is not used with --stream")
+        args.prefilter = "none"
+    
+    # Incremental updates compare whole-image embeddings, like the grouping they update
+    state_conflicts = [option for option, used in (
+        ("--hash-only", args.hash_only),
+        ("--prefilter", args.prefilter != "none"),
+        ("--check-regions", args.check_regions > 0),
+        ("--file-handling move", args.file_handling == "move")
+    ) if used]
+    if args.update and (state_conflicts or args.stream):
+        logger.error(f"--update cannot be combined with {', '.join(state_conflicts or ['--stream'])}")
+        return 1
+    
+    if args.margin_threshold < 0:
+        logger.error("--margin-threshold must not be negative")
         return 1
     
     # Handle legacy single quality_metric argument
@@ -330,13 +913,22 @@ def main():
     
     # Output directory
     output_dir = os.path.abspath(args.output_dir)
-    if os.path.exists(output_dir) and not args.force and not args.skip_existing:
+    state_dir = os.path.join(output_dir, ".grouping_state")
+    run_dir = os.path.join(output_dir, ".run")
+    
+    if args.undo:
+        return undo_run(output_dir, run_dir, state_dir, args.dryrun, logger)
+    
+    if (os.path.exists(output_dir) and not args.force and not args.skip_existing
+            and not args.update and not args.resume):
         logger.error(f"Output directory {output_dir} already exists. Use --force to overwrite or --skip-existing to skip.")
         return 1
     
-    # Set up cache file
-    cache_file = os.path.join(output_dir, ".embedding_cache.pkl")
-    
+    # Set up embedding store location
+    if args.cache_dir:
+        store_dir = os.path.abspath(args.cache_dir)
+    else:
+        store_dir = os.path.join(output_dir, ".embedding_store")
     # Process input directories
     # Flatten list if input_dirs contains nested lists
     all_input_dirs = []
@@ -373,33 +965,8 @@ def main():
     else:
         extensions = cit.DEFAULT_EXTENSIONS
     
-    # Find all images with pattern filtering
-    try:
-        all_images = cit.find_images(
-            input_dirs=input_dirs,
-            exclude_dirs=args.exclude_dirs,
-            recursive=args.recursive,
-            follow_symlinks=args.follow_symlinks,
-            min_file_size=args.min_file_size,
-            extensions=extensions,
-            logger=logger,
-            show_progress=args.progress and cit.TQDM_AVAILABLE,
-            include_dirs_pattern=args.include_dirs_pattern,
-            include_files_pattern=args.include_files_pattern,
-            exclude_dirs_pattern=args.exclude_dirs_pattern,
-            exclude_files_pattern=args.exclude_files_pattern,
-            pattern_mode=args.pattern_mode
-        )
-    except Exception as e:
-        logger.error(f"Error finding images: {e}")
-        return 1
-    
-    if not all_images:
-        logger.error("No valid images found!")
-        return 1
-    
-    # Create output directory if it doesn't exist yet (needed for cache file)
-    if args.cache and not os.path.exists(output_dir) and not args.dryrun:
+    # Create output directory if it doesn't exist yet (needed for embedding store and checkpoints)
+    if not os.path.exists(output_dir) and not args.dryrun:
         try:
             os.makedirs(output_dir, exist_ok=True)
             logger.debug(f"Created output directory: {output_dir}")
@@ -407,133 +974,235 @@ def main():
             logger.error(f"Failed to create output directory: {e}")
             return 1
     
-    # Load cache if enabled
-    cached_embeddings = {}
+    # Open the embedding store if enabled
+    store = None
     if args.cache:
         try:
-            cached_embeddings = cit.load_cache(cache_file, logger=logger)
+            store = cit.EmbeddingStore(store_dir, dtype=args.store_dtype, content_hash=args.content_hash,
+                                       fast_decode=args.fast_decode, logger=logger)
+            if store.stale_rows > len(store) and not args.dryrun:
+                store.compact()
         except Exception as e:
-            logger.warning(f"Error loading cache: {e}")
-            cached_embeddings = {}
+            logger.warning(f"Error loading embedding store: {e}")
+            store = None
     
-    # Determine which images need embedding computation
-    images_to_process = [img for img in all_images if img not in cached_embeddings]
-    logger.info(f"Computing embeddings for {len(images_to_process)} images")
+    # Checkpoint progress so an interrupted run can continue with --resume
+    manifest = None
+    if args.resume and args.update:
+        logger.warning("--resume is not used with --update")
+    elif not args.dryrun:
+        run_settings = get_run_settings(args, input_dirs)
+        try:
+            manifest = cit.RunManifest.load(run_dir, logger=logger) if args.resume else None
+            if manifest is not None and manifest.reached("complete"):
+                logger.info("The previous run completed; starting a new run")
+                manifest = None
+            elif manifest is not None and not manifest.matches(run_settings):
+                logger.warning("Options changed since the interrupted run; starting a new run")
+                manifest = None
+            elif args.resume and manifest is None:
+                logger.warning(f"No checkpoint to resume from in {output_dir}; starting a new run")
+            
+            if manifest is None:
+                manifest = cit.RunManifest(run_dir, logger=logger)
+                manifest.start(run_settings)
+            else:
+                logger.info(f"Resuming interrupted run (last completed stage: {manifest.stage})")
+        except Exception as e:
+            logger.warning(f"Failed to set up run checkpoints: {e}")
+            manifest = None
     
-    # Skip embedding computation if no new images
-    if not images_to_process:
-        embeddings = cached_embeddings
-        logger.info("No new images to process, using cached embeddings")
-    else:
-        # Load models for embedding calculation
+    # Images that fail validation or decoding are recorded instead of failing the run
+    skip_report = cit.SkipReport()
+    
+    # Find all images with pattern filtering; with --stream, embed them as the crawl finds them
+    model = processor = device = None
+    streamed_embeddings = None
+    resumed_images = None
+    if manifest is not None:
+        try:
+            resumed_images = manifest.load_images()
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable image checkpoint: {e}")
+    
+    if resumed_images is not None:
+        all_images = resumed_images
+        logger.info(f"Resuming with {len(all_images)} images from checkpoint")
+    elif args.stream:
         try:
             model, processor, device = cit.load_clip_model(device=args.device)
             logger.info(f"Loaded CLIP model on device: {device}")
             
-            # Compute embeddings
-            new_embeddings = cit.compute_embeddings_batch(
-                images_to_process,
+            image_iter = cit.iter_images(
+                input_dirs=input_dirs,
+                exclude_dirs=args.exclude_dirs,
+                recursive=args.recursive,
+                follow_symlinks=args.follow_symlinks,
+                min_file_size=args.min_file_size,
+                extensions=extensions,
+                logger=logger,
+                include_dirs_pattern=args.include_dirs_pattern,
+                include_files_pattern=args.include_files_pattern,
+                exclude_dirs_pattern=args.exclude_dirs_pattern,
+                exclude_files_pattern=args.exclude_files_pattern,
+                pattern_mode=args.pattern_mode,
+                validation=args.validation,
+                skip_report=skip_report
+            )
+            all_images, streamed_embeddings = cit.stream_embeddings(
+                image_iter,
                 model,
                 processor,
                 device,
+                store=store,
+                update_store=not args.dryrun,
                 batch_size=args.batch_size,
-                show_progress=args.progress and cit.TQDM_AVAILABLE
+                show_progress=args.progress and cit.TQDM_AVAILABLE,
+                num_workers=args.threads,
+                fast_decode=args.fast_decode,
+                skip_report=skip_report
             )
-            
-            # Combine cached and new embeddings
-            embeddings = {**cached_embeddings, **new_embeddings}
-            
-            # Save updated cache
-            if args.cache and not args.dryrun:
-                cache_success = cit.save_cache(embeddings, cache_file, logger=logger)
-                if not cache_success:
-                    logger.warning("Failed to save embedding cache")
-                
+            logger.info(f"Found {len(all_images)} valid images")
         except Exception as e:
-            logger.error(f"Error computing embeddings: {e}")
+            logger.error(f"Error streaming images: {e}")
             return 1
-    
-    # Group similar images, using region checking if requested
-    try:
-        # Determine similarity threshold - use preset if specified, otherwise use direct value
-        similarity_threshold = args.similarity_threshold
-        
-        if args.similarity_preset:
-            preset_threshold = cit.get_similarity_threshold(preset=args.similarity_preset)
-            if preset_threshold != similarity_threshold:
-                logger.info(f"Using similarity preset '{args.similarity_preset}' with threshold {preset_threshold}")
-                similarity_threshold = preset_threshold
-        
-        if args.check_regions > 0:
-            logger.info(f"Using region-based similarity with {args.check_regions} regions")
-            
-            similar_groups = cit.group_similar_images(
-                embeddings,
-                similarity_threshold=similarity_threshold,
-                similarity_preset=args.similarity_preset,
-                use_regions=args.check_regions,
-                model=model if args.check_regions > 0 else None,
-                processor=processor if args.check_regions > 0 else None,
-                device=device if args.check_regions > 0 else None,
-                logger=logger,
-                show_progress=args.progress and cit.TQDM_AVAILABLE
-            )
-        else:
-            similar_groups = cit.group_similar_images(
-                embeddings,
-                similarity_threshold=similarity_threshold,
-                similarity_preset=args.similarity_preset,
+    else:
+        try:
+            all_images = cit.find_images(
+                input_dirs=input_dirs,
+                exclude_dirs=args.exclude_dirs,
+                recursive=args.recursive,
+                follow_symlinks=args.follow_symlinks,
+                min_file_size=args.min_file_size,
+                extensions=extensions,
                 logger=logger,
-                show_progress=args.progress and cit.TQDM_AVAILABLE
+                show_progress=args.progress and cit.TQDM_AVAILABLE,
+                include_dirs_pattern=args.include_dirs_pattern,
+                include_files_pattern=args.include_files_pattern,
+                exclude_dirs_pattern=args.exclude_dirs_pattern,
+                exclude_files_pattern=args.exclude_files_pattern,
+                pattern_mode=args.pattern_mode,
+                validation=args.validation,
+                skip_report=skip_report
             )
-    except Exception as e:
-        logger.error(f"Error grouping similar images: {e}")
+        except Exception as e:
+            logger.error(f"Error finding images: {e}")
+            return 1
+    
+    if not all_images:
+        logger.error("No valid images found!")
         return 1
     
+    if manifest is not None and resumed_images is None:
+        try:
+            manifest.save_images(all_images)
+        except Exception as e:
+            logger.warning(f"Failed to checkpoint discovered images: {e}")
+    
+    # Determine similarity threshold - use preset if specified, otherwise use direct value
+    similarity_threshold = args.similarity_threshold
+    if args.similarity_preset:
+        preset_threshold = cit.get_similarity_threshold(preset=args.similarity_preset)
+        if preset_threshold != similarity_threshold:
+            logger.info(f"Using similarity preset '{args.similarity_preset}' with threshold {preset_threshold}")
+            similarity_threshold = preset_threshold
+    
+    # Update the previous run in place when its grouping state is still valid
+    state_settings = get_state_settings(args, similarity_threshold, metric_weights, metric_overrides)
+    if args.update:
+        state = cit.GroupingState.load(state_dir, logger=logger) if cit.NUMPY_AVAILABLE else None
+        if state is None:
+            logger.warning(f"No grouping state in {output_dir}; grouping all images")
+        elif not state.matches(state_settings):
+            logger.warning("Grouping or output options changed since the last run; regrouping all images")
+            cit.remove_outputs([path for paths in state.outputs.values() for path in paths],
+                               dryrun=args.dryrun, logger=logger)
+        else:
+            return update_groups(state, state_dir, all_images, store, output_dir, args, similarity_threshold,
+                                 metric_weights, metric_overrides, skip_report, logger)
+    
+    # Group the images, or continue with the groups of an interrupted run
+    similar_groups = None
+    embeddings = {}
+    duplicates = {}
+    if manifest is not None:
+        try:
+            similar_groups = manifest.load_groups()
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable group checkpoint: {e}")
+    
+    # The grouping state lets the next run use --update; its outputs are added once they exist
+    state = None
+    save_state = args.cache and not args.dryrun and not state_conflicts and cit.NUMPY_AVAILABLE
+    
+    if similar_groups is not None:
+        logger.info(f"Resuming with {len(similar_groups)} groups from checkpoint")
+        if save_state:
+            state = cit.GroupingState.load(state_dir, logger=logger)
+            if state is None or not state.matches(state_settings) or state.groups() != similar_groups:
+                logger.warning("No grouping state matches the resumed groups; the next --update will regroup all images")
+                state = None
+    else:
+        grouped = compute_groups(all_images, args, store, similarity_threshold, skip_report, logger,
+                                 streamed_embeddings=streamed_embeddings, model=model, processor=processor,
+                                 device=device)
+        if grouped is None:
+            return 1
+        similar_groups, embeddings, duplicates = grouped
+        
+        # Save the grouping state before the group checkpoint, so it is never the older of the two
+        if save_state:
+            try:
+                state_embeddings = dict(embeddings)
+                for path, copies in duplicates.items():
+                    if path in embeddings:
+                        state_embeddings.update((copy, embeddings[path]) for copy in copies)
+                state = cit.GroupingState.from_groups(similar_groups, state_embeddings, settings=state_settings,
+                                                      logger=logger)
+                state.save(state_dir)
+            except Exception as e:
+                logger.warning(f"Failed to save grouping state: {e}")
+                state = None
+        
+        if manifest is not None:
+            try:
+                manifest.save_groups(similar_groups)
+            except Exception as e:
+                logger.warning(f"Failed to checkpoint groups: {e}")
+    
     if not similar_groups:
         logger.info("No groups of images found.")
+        report_skipped(skip_report, args.skip_report, logger)
         return 0
     
-    # Create output directory structure
+    # Create output directory structure, skipping operations journaled by an interrupted run
+    group_outputs = {}
     try:
-        # Reset filename registry to ensure clean state
-        cit.reset_filename_registry()
-        
-        results = cit.create_output_structure(
-            similar_groups,
-            output_dir,
-            primary_metrics=args.primary_metrics,
-            secondary_metrics=args.secondary_metrics,
-            metric_weights=metric_weights,
-            date_preference=args.date_preference,
-            metric_overrides=metric_overrides,
-            naming_pattern=args.naming_pattern,
-            file_handling=args.file_handling,
-            copy_best=args.copy_best,
-            suffix=args.suffix,
-            handle_long_paths=args.handle_long_paths,
-            max_path_length=args.max_path_length,
-            include_singletons=args.include_singletons,
-            singletons_subdir=args.singletons_subdir,
-            collision_strategy=args.collision_strategy,
-            dryrun=args.dryrun,
-            create_backlinks=args.create_backlinks,
-            logger=logger,
-            show_progress=args.progress and cit.TQDM_AVAILABLE
-        )
+        journal = manifest.journal() if manifest is not None else None
+        if journal:
+            logger.info(f"Skipping {len(journal)} output operations completed before the interruption")
+        results = create_outputs(similar_groups, output_dir, args, metric_weights, metric_overrides,
+                                 skip_report, logger, outputs=group_outputs, journal=journal)
+        if journal is not None:
+            journal.close()
     except Exception as e:
         logger.error(f"Error creating output structure: {e}")
         return 1
     
+    # Record the outputs in the grouping state so the next run can use --update
+    if state is not None:
+        try:
+            state.set_group_outputs(group_outputs)
+            state.save(state_dir)
+        except Exception as e:
+            logger.warning(f"Failed to save grouping state: {e}")
+    
     # Collect results if requested
     if args.collect_results and not args.dryrun and results:
         try:
             collection_dir = args.collection_dir if args.collection_dir else os.path.join(output_dir, "best_collection")
             logger.info(f"Collecting best images into {collection_dir}")
             
-            # Reset filename registry for collection to ensure clean state
-            cit.reset_filename_registry()
-            
             collected = cit.collect_best_images(
                 output_dir,
                 collection_dir,
@@ -557,11 +1226,25 @@ def main():
     
     logger.info(f"Summary:")
     logger.info(f"- Total images processed: {len(all_images)}")
+    if duplicates:
+        logger.info(f"- Exact duplicates collapsed before embedding: {sum(len(d) for d in duplicates.values())}")
     logger.info(f"- Groups with multiple images: {len(multi_image_groups)}")
     if args.include_singletons:
         logger.info(f"- Singleton images: {len(singleton_groups)}")
     logger.info(f"- Output directories created: {len(results)}")
+    if cit.copy_stats:
+        logger.info(f"- Files copied by method: {cit.copy_stats.summary()}")
     logger.info(f"- Total candidate images in groups: {sum(result['total_candidates'] for result in results)}")
+    if skip_report:
+        logger.info(f"- Images skipped as unreadable: {len(skip_report.paths())}")
+    
+    report_skipped(skip_report, args.skip_report, logger)
+    
+    if manifest is not None:
+        try:
+            manifest.set_stage("complete")
+        except Exception as e:
+            logger.warning(f"Failed to update run manifest: {e}")
     
     if args.dryrun:
         logger.info("This was a dry run. No files were actually created or modified.")
@@ -576,7 +1259,7 @@ if __name__ == "__main__":
     try:
         sys.exit(main())
     except KeyboardInterrupt:
-        print("\nOperation cancelled by user.")
+        print("\nOperation cancelled by user. Run again with --resume to continue from the last checkpoint.")
         sys.exit(130)
     except Exception as e:
         logging.exception("Unexpected error occurred.")
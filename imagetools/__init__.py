@@ -53,6 +53,13 @@ try:
 except ImportError:
     TQDM_AVAILABLE = False
 
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
 # Constants defined centrally
 DEFAULT_EXTENSIONS = ['.bmp', '.jpg', '.jpeg', '.png', '.webp', '.gif', '.tiff', '.tif', '.jp2', '.heif', '.heic']
 
@@ -78,7 +85,10 @@ from imagetools.similarity_tools import SIMILARITY_PRESETS
 from imagetools.core_imagetools import (
     check_dependencies,
     is_valid_image,
+    has_image_signature,
     find_images,
+    iter_images,
+    VALIDATION_MODES,
     get_image_dimensions,
     get_image_resolution
 )
@@ -88,15 +98,136 @@ from imagetools.similarity_tools import (
     load_clip_model,
     compute_embedding,
     compute_embeddings_batch,
+    compute_region_embeddings_batch,
+    stream_embeddings,
+    DEFAULT_FLUSH_BATCHES,
     extract_image_region,
     compute_region_similarity,
     cosine_similarity,
+    embedding_to_numpy,
+    build_embedding_matrix,
+    build_region_matrix,
+    score_pairs,
+    rescore_pairs,
+    iter_similar_pairs,
+    iter_query_pairs,
+    DisjointSet,
     group_similar_images,
     save_cache,
     load_cache,
     get_similarity_threshold
 )
 
+# Directory crawling
+from imagetools.directory_crawler import (
+    PathTrie,
+    crawl_directory,
+    iter_crawl_directory,
+    iter_in_background,
+    DEFAULT_CRAWL_WORKERS
+)
+
+# Pattern matching
+from imagetools.pattern_set import PatternSet
+
+# Approximate nearest-neighbour index
+from imagetools.ann_index import (
+    IVFIndex,
+    DEFAULT_ANN_PROBES
+)
+
+# Compact vectors
+from imagetools.compact_vectors import (
+    VECTOR_DTYPES,
+    CompactMatrix,
+    quantize_int8,
+    dequantize_int8
+)
+
+# Decode pipeline
+from imagetools.decode_pipeline import (
+    REGION_TYPES,
+    get_region_types,
+    crop_image_regions,
+    open_image,
+    reduce_image,
+    get_preprocess_config,
+    preprocess_image,
+    iter_preprocessed_batches
+)
+
+# Content hashing
+from imagetools.file_hashing import (
+    hash_file,
+    hash_file_edges,
+    get_hash_algorithm,
+    find_exact_duplicates,
+    restore_duplicates
+)
+
+# Perceptual hashing
+from imagetools.perceptual_hash import (
+    HASH_METHODS,
+    DEFAULT_SAME_DISTANCE,
+    DEFAULT_UNRELATED_DISTANCE,
+    hash_image,
+    compute_perceptual_hash,
+    compute_perceptual_hashes,
+    hamming_distance,
+    BKTree,
+    UncertainPairs,
+    classify_hash_pairs
+)
+
+# Skip report
+from imagetools.skip_report import SkipReport
+
+# Embedding store
+from imagetools.embedding_store import (
+    STORE_DTYPES,
+    EmbeddingStore,
+    get_file_key
+)
+
+# Grouping state
+from imagetools.grouping_state import GroupingState
+
+# Run manifest
+from imagetools.run_manifest import (
+    RunManifest,
+    OutputJournal
+)
+
+# Image headers
+from imagetools.image_header import (
+    read_header_size,
+    read_image_size,
+    iter_jpeg_segments
+)
+
+# EXIF queries
+from imagetools.exif_query import (
+    ExifPredicate,
+    parse_exif_predicates,
+    exif_matches,
+    read_exif,
+    normalize_date
+)
+
+# Image index
+from imagetools.image_index import (
+    INDEXED_EXIF_TAGS,
+    ImageIndex,
+    read_exif_tags
+)
+
+# Image metadata
+from imagetools.image_metadata import (
+    METADATA_DTYPE,
+    probe_image,
+    MetadataTable
+)
+
 # Quality metrics
 from imagetools.quality_metrics import (
     get_image_filesize,
@@ -106,10 +237,23 @@ from imagetools.quality_metrics import (
     find_best_image,
     find_best_image_weighted,
     find_best_image_hybrid,
+    build_metric_matrix,
+    select_best_images,
+    find_best_images_batch,
     get_metric_overrides,
     DEFAULT_METRIC_WEIGHTS
 )
 
+# Copy engine
+from imagetools.copy_engine import (
+    COPY_METHODS,
+    CopyStats,
+    copy_stats,
+    copy_file,
+    available_methods,
+    reset_copy_stats
+)
+
 # File operations
 from imagetools.file_operations import (
     create_safe_path,
@@ -118,14 +262,23 @@ from imagetools.file_operations import (
     handle_duplicate,
     is_symbolic_link,
     get_target_of_link,
+    CollisionIndex,
     get_unique_path,
     reset_filename_registry
 )
 
+# Output planning
+from imagetools.output_plan import (
+    OutputPlan,
+    execute_plan,
+    DEFAULT_OUTPUT_WORKERS
+)
+
 # Directory structure
 from imagetools.directory_structure import (
     create_output_structure,
     handle_singletons,
+    remove_outputs,
     collect_best_images
 )
 
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2025 Dustin Darcy <ScarcityHypothesis.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+ann_index.py
+
+Approximate nearest-neighbour index over normalized CLIP embeddings.
+
+The index is an inverted file (IVF): embeddings are clustered with spherical
+k-means, each embedding is stored in the list of its nearest centroid, and a
+range query only compares an embedding against the lists of its n_probe
+nearest centroids. Raising n_probe improves recall at the cost of speed.
+"""
+
+import math
+
+from imagetools import NUMPY_AVAILABLE, np
+from imagetools import TQDM_AVAILABLE, tqdm
+
+# Global constants
+DEFAULT_ANN_PROBES = 8         # Lists searched per query (recall/speed knob)
+KMEANS_ITERATIONS = 10         # Training iterations for the coarse quantizer
+KMEANS_SAMPLES_PER_LIST = 64   # Training sample size per list
+ASSIGN_CHUNK_SIZE = 8192       # Rows per block when assigning to centroids
+
+def default_list_count(num_vectors):
+    """Pick a number of inverted lists for a collection size (about 4 * sqrt(n))."""
+    return max(1, min(num_vectors, int(4 * math.sqrt(num_vectors))))
+
+class IVFIndex:
+    """
+    Inverted-file index supporting thresholded range queries.
+
+    Args:
+        n_lists: Number of inverted lists (default: about 4 * sqrt(n))
+        n_probe: Number of nearest lists searched for each query
+        seed: Random seed for centroid initialization
+    """
+    def __init__(self, n_lists=None, n_probe=DEFAULT_ANN_PROBES, seed=0):
+        if not NUMPY_AVAILABLE:
+            raise ImportError("numpy is required for the approximate nearest-neighbour index")
+
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.seed = seed
+        self.centroids = None
+        self.matrix = None
+        self.lists = []
+        self.candidates_checked = 0
+
+    def _nearest_lists(self, vectors, count):
+        """Return the indices of the count nearest centroids for each vector."""
+        scores = vectors @ self.centroids.T
+        if count >= scores.shape[1]:
+            return np.argsort(-scores, axis=1)
+        return np.argpartition(-scores, count - 1, axis=1)[:, :count]
+
+    def train(self, matrix):
+        """Fit centroids with spherical k-means on a sample of the matrix."""
+        num_vectors = matrix.shape[0]
+        n_lists = self.n_lists or default_list_count(num_vectors)
+        n_lists = max(1, min(n_lists, num_vectors))
+        rng = np.random.default_rng(self.seed)
+
+        sample_size = min(num_vectors, n_lists * KMEANS_SAMPLES_PER_LIST)
+        sample = matrix[rng.choice(num_vectors, size=sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, size=n_lists, replace=False)].copy()
+
+        for _ in range(KMEANS_ITERATIONS):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+
+            # Keep the previous centroid for lists that received no members
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            empty = norms[:, 0] == 0
+            sums[empty] = centroids[empty]
+            norms[empty] = 1.0
+            centroids = sums / norms
+
+        self.centroids = centroids.astype(np.float32)
+        self.n_lists = n_lists
+        return self
+
+    def add(self, matrix):
+        """Assign every row of a normalized matrix to its nearest list."""
+        if self.centroids is None:
+            self.train(matrix)
+
+        self.matrix = matrix
+        assignment = np.empty(matrix.shape[0], dtype=np.int64)
+        for start in range(0, matrix.shape[0], ASSIGN_CHUNK_SIZE):
+            block = matrix[start:start + ASSIGN_CHUNK_SIZE]
+            assignment[start:start + block.shape[0]] = np.argmax(block @ self.centroids.T, axis=1)
+
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(self.n_lists + 1))
+        self.lists = [order[bounds[k]:bounds[k + 1]] for k in range(self.n_lists)]
+        return self
+
+    def iter_similar_pairs(self, threshold, tile_size=2048, show_progress=False):
+        """
+        Find pairs of indexed rows whose similarity meets a threshold.
+
+        Each row is compared only against the members of its n_probe nearest
+        lists, and only against members with a higher row index. A row belongs
+        to exactly one list, so every pair is scored at most once and
+        candidates_checked never exceeds the number of exhaustive pairs.
+
+        Yields:
+            Tuples of numpy arrays (rows, cols, similarities) with rows < cols
+        """
+        matrix = self.matrix
+        n_probe = max(1, min(self.n_probe, self.n_lists))
+        self.candidates_checked = 0
+
+        # Invert the probe assignment: which queries visit each list
+        probes = np.empty((matrix.shape[0], n_probe), dtype=np.int64)
+        for start in range(0, matrix.shape[0], ASSIGN_CHUNK_SIZE):
+            block = matrix[start:start + ASSIGN_CHUNK_SIZE]
+            probes[start:start + block.shape[0]] = self._nearest_lists(block, n_probe)
+
+        flat_lists = probes.reshape(-1)
+        flat_queries = np.repeat(np.arange(matrix.shape[0]), n_probe)
+        order = np.argsort(flat_lists, kind="stable")
+        bounds = np.searchsorted(flat_lists[order], np.arange(self.n_lists + 1))
+
+        list_ids = range(self.n_lists)
+        if show_progress and TQDM_AVAILABLE:
+            iterator = tqdm(list_ids, desc="Searching index")
+        else:
+            iterator = list_ids
+
+        for list_id in iterator:
+            members = self.lists[list_id]
+            queries = flat_queries[order[bounds[list_id]:bounds[list_id + 1]]]
+            if members.size == 0 or queries.size == 0:
+                continue
+
+            # Members and queries are in ascending row order
+            member_vectors = matrix[members]
+            for start in range(0, queries.size, tile_size):
+                query_ids = queries[start:start + tile_size]
+
+                # Skip self and mirror products: only members above the lowest query can pair
+                first = np.searchsorted(members, query_ids[0], side="right")
+                if first == members.size:
+                    continue
+                upper = members[None, first:] > query_ids[:, None]
+                self.candidates_checked += int(np.count_nonzero(upper))
+
+                sims = matrix[query_ids] @ member_vectors[first:].T
+                rows, cols = np.nonzero(upper & (sims >= threshold))
+                if rows.size:
+                    yield query_ids[rows], members[first + cols], sims[rows, cols]
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2025 Dustin Darcy <ScarcityHypothesis.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+compact_vectors.py
+
+Embedding matrices stored as float16, or as int8 with one scale per row.
+
+A CompactMatrix keeps its rows at half (float16) or a quarter (int8) of the
+float32 size and hands out float32 rows on indexing, so the similarity engine
+reads it tile by tile like a plain matrix. numpy has no BLAS kernels for
+float16 or integer products, so tiles are widened to float32 before they are
+multiplied; the savings are in memory and in the bytes read per tile.
+
+int8 rows are quantized symmetrically: scale = max(|x|) / 127 and
+code = round(x / scale), so each row keeps its own dynamic range. Every row
+written records the L2 norm of its quantization error, which bounds how far a
+similarity computed from compact rows can be from the float32 one.
+"""
+
+from imagetools import NUMPY_AVAILABLE, np
+
+# Global constants
+VECTOR_DTYPES = ["float32", "float16", "int8"]
+INT8_LEVELS = 127  # Symmetric range, so -128 is never used
+ROUNDING_SLACK = 1e-5  # Allowance for float32 rounding in tile products
+
+def quantize_int8(matrix):
+    """
+    Quantize rows to int8 with a per-row scale.
+
+    Returns:
+        tuple: (codes, scales) with codes of shape (n, d) and scales of shape (n,)
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    scales = np.abs(matrix).max(axis=1) / INT8_LEVELS
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(matrix / scales[:, None]), -INT8_LEVELS, INT8_LEVELS).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+def dequantize_int8(codes, scales):
+    """Expand int8 codes back to float32 rows."""
+    return codes.astype(np.float32) * np.asarray(scales, dtype=np.float32)[..., None]
+
+class CompactMatrix:
+    """
+    Row-indexable matrix stored as float16 or per-row scaled int8.
+
+    Indexing with an integer, a slice or an index array returns float32
+    rows; assigning float32 rows stores them in the compact form.
+
+    Args:
+        codes: Stored rows, float16 or int8 (may be a memory map)
+        scales: Per-row float32 scales for int8 codes, None for float16
+    """
+    def __init__(self, codes, scales=None):
+        if not NUMPY_AVAILABLE:
+            raise ImportError("numpy is required for compact vectors")
+        if codes.dtype == np.int8 and scales is None:
+            raise ValueError("int8 vectors need per-row scales")
+
+        self.codes = codes
+        self.scales = scales
+        self.max_error = 0.0
+
+    @classmethod
+    def empty(cls, num_rows, dim, dtype):
+        """Allocate a matrix of num_rows rows to be filled by assignment."""
+        if dtype == "float16":
+            return cls(np.zeros((num_rows, dim), dtype=np.float16))
+        if dtype == "int8":
+            return cls(np.zeros((num_rows, dim), dtype=np.int8), np.ones(num_rows, dtype=np.float32))
+        raise ValueError(f"Unknown compact vector dtype: {dtype}")
+
+    @classmethod
+    def from_matrix(cls, matrix, dtype):
+        """Store a float32 matrix in compact form."""
+        matrix = np.asarray(matrix, dtype=np.float32)
+        compact = cls.empty(matrix.shape[0], matrix.shape[1], dtype)
+        compact[:] = matrix
+        return compact
+
+    @property
+    def dtype(self):
+        """Name of the storage type, "float16" or "int8"."""
+        return self.codes.dtype.name
+
+    @property
+    def shape(self):
+        return self.codes.shape
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    def __getitem__(self, index):
+        if self.scales is None:
+            return self.codes[index].astype(np.float32)
+        return dequantize_int8(self.codes[index], self.scales[index])
+
+    def __setitem__(self, index, values):
+        values = np.asarray(values, dtype=np.float32)
+        if self.scales is None:
+            self.codes[index] = values
+        else:
+            codes, scales = quantize_int8(values)
+            self.codes[index] = codes.reshape(self.codes[index].shape)
+            self.scales[index] = scales.reshape(self.scales[index].shape)
+        error = np.linalg.norm(values.reshape(-1, self.shape[1]) - self[index].reshape(-1, self.shape[1]), axis=1)
+        if error.size:
+            self.max_error = max(self.max_error, float(error.max()))
+
+    def rescore_margin(self):
+        """
+        Largest difference between a compact and a float32 similarity of two rows.
+
+        For unit rows a and b stored with errors e_a and e_b, the similarity
+        changes by at most |e_a| + |e_b| + |e_a| * |e_b|.
+        """
+        return 2 * self.max_error + self.max_error ** 2 + ROUNDING_SLACK
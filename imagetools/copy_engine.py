@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2025 Dustin Darcy <ScarcityHypothesis.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+copy_engine.py
+
+File copies that avoid moving data through user space where possible.
+
+copy_file tries, in order:
+- reflink: a FICLONE ioctl shares the source's blocks copy-on-write
+  (Btrfs, XFS, bcachefs, ZFS 2.2+), so the copy takes no time and no space
+- copy_file_range: the kernel copies within or between filesystems, and
+  NFS and SMB servers can copy server-side
+- sendfile: an in-kernel copy without server-side offload
+- buffered: a plain read/write copy, which works everywhere
+
+A method that fails with an "unsupported" error is not tried again for the
+same pair of filesystems. Every copy is counted per method in copy_stats,
+so a run can report how its copies were made.
+"""
+
+import os
+import errno
+import shutil
+import logging
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Global constants
+FICLONE = 0x40049409  # _IOW(0x94, 9, int) from linux/fs.h
+COPY_METHODS = ["reflink", "copy_file_range", "sendfile", "buffered"]
+COPY_CHUNK_SIZE = 1 << 30  # Bytes per copy_file_range/sendfile call
+BUFFER_SIZE = 1 << 20
+
+# Errors meaning a method cannot work for this pair of files, rather than an I/O failure
+UNSUPPORTED_ERRORS = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY,
+                      errno.EBADF, errno.EPERM, errno.ENOTSUP}
+
+class CopyStats:
+    """Thread-safe count of files and bytes copied by each method."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.files = {}
+        self.bytes = {}
+
+    def record(self, method, size):
+        with self._lock:
+            self.files[method] = self.files.get(method, 0) + 1
+            self.bytes[method] = self.bytes.get(method, 0) + size
+
+    def reset(self):
+        with self._lock:
+            self.files = {}
+            self.bytes = {}
+
+    def __len__(self):
+        return sum(self.files.values())
+
+    def summary(self):
+        """Describe the copies per method, e.g. "reflink: 12 files (3.4 MB)"."""
+        parts = []
+        for method in COPY_METHODS:
+            if method in self.files:
+                parts.append(f"{method}: {self.files[method]} files ({self.bytes[method] / 1e6:.1f} MB)")
+        return ", ".join(parts) if parts else "no files copied"
+
+# Copies made through copy_file, for the end-of-run report
+copy_stats = CopyStats()
+
+# (source device, destination device, method) combinations known not to work
+_unsupported = set()
+_unsupported_lock = threading.Lock()
+
+def _reflink(src_fd, dst_fd, size):
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+def _copy_file_range(src_fd, dst_fd, size):
+    copied = 0
+    while copied < size:
+        count = os.copy_file_range(src_fd, dst_fd, min(COPY_CHUNK_SIZE, size - copied))
+        if count == 0:
+            if copied == 0:
+                # Some filesystems report nothing to copy instead of failing
+                raise OSError(errno.ENOTSUP, "copy_file_range copied nothing")
+            break
+        copied += count
+
+def _sendfile(src_fd, dst_fd, size):
+    copied = 0
+    while copied < size:
+        count = os.sendfile(dst_fd, src_fd, copied, min(COPY_CHUNK_SIZE, size - copied))
+        if count == 0:
+            if copied == 0:
+                # Some filesystems report nothing to copy instead of failing
+                raise OSError(errno.ENOTSUP, "sendfile copied nothing")
+            break
+        copied += count
+
+def _buffered(src_fd, dst_fd, size):
+    while True:
+        chunk = os.read(src_fd, BUFFER_SIZE)
+        if not chunk:
+            break
+        view = memoryview(chunk)
+        while view:
+            view = view[os.write(dst_fd, view):]
+
+_METHOD_FUNCTIONS = {
+    "reflink": _reflink if fcntl is not None else None,
+    "copy_file_range": _copy_file_range if hasattr(os, "copy_file_range") else None,
+    "sendfile": _sendfile if hasattr(os, "sendfile") and os.name == "posix" else None,
+    "buffered": _buffered,
+}
+
+def available_methods():
+    """Copy methods this platform supports, in the order they are tried."""
+    return [method for method in COPY_METHODS if _METHOD_FUNCTIONS[method] is not None]
+
+def copy_file(source, destination, methods=None, preserve_metadata=True):
+    """
+    Copy a file with the cheapest method that works, like shutil.copy2.
+
+    Args:
+        source: File to copy
+        destination: Path of the copy; an existing file is replaced
+        methods: Methods to try, in order (default: all available)
+        preserve_metadata: Copy permission bits and timestamps as well
+
+    Returns:
+        Name of the method that made the copy
+    """
+    if methods is None:
+        methods = available_methods()
+    if os.path.isdir(destination):
+        destination = os.path.join(destination, os.path.basename(source))
+    if os.path.exists(destination) and os.path.samefile(source, destination):
+        raise shutil.SameFileError(f"{source} and {destination} are the same file")
+
+    src_fd = os.open(source, os.O_RDONLY | getattr(os, "O_BINARY", 0))
+    try:
+        src_stat = os.fstat(src_fd)
+        dst_fd = os.open(destination, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o666)
+        try:
+            devices = (src_stat.st_dev, os.fstat(dst_fd).st_dev)
+            used = None
+            for method in methods:
+                function = _METHOD_FUNCTIONS.get(method)
+                if function is None or devices + (method,) in _unsupported:
+                    continue
+                try:
+                    function(src_fd, dst_fd, src_stat.st_size)
+                    used = method
+                    break
+                except OSError as e:
+                    if e.errno not in UNSUPPORTED_ERRORS:
+                        raise
+                    with _unsupported_lock:
+                        _unsupported.add(devices + (method,))
+                    # Start the next method from scratch
+                    os.ftruncate(dst_fd, 0)
+                    os.lseek(src_fd, 0, os.SEEK_SET)
+                    os.lseek(dst_fd, 0, os.SEEK_SET)
+            if used is None:
+                raise OSError(errno.ENOTSUP, f"No copy method worked for {source}")
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+
+    if preserve_metadata:
+        shutil.copystat(source, destination)
+
+    copy_stats.record(used, src_stat.st_size)
+    logging.debug(f"Copied {source} to {destination} ({used})")
+    return used
+
+def reset_copy_stats():
+    """Reset the per-method copy counts."""
+    copy_stats.reset()
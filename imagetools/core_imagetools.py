@@ -25,13 +25,15 @@ Updates include:
 - Pattern matching for include/exclude directories and files
 - Support for glob and regex patterns
 - Enhanced file discovery with pattern filtering
+- Parallel os.scandir crawling with trie-based directory exclusion
+- Header-only validation by file signature
+- Compiled pattern sets shared with imgsrch.py
+- Streaming image discovery for pipelined runs
 """
 
 import os
 import sys
 import logging
-import re
-import fnmatch
 from pathlib import Path
 import platform
 
@@ -52,9 +54,32 @@ from imagetools import (
 from imagetools import TQDM_AVAILABLE, tqdm
     # Don't print anything here; let the main script handle it
 
+from .directory_crawler import (
+    crawl_directory, iter_crawl_directory, iter_in_background,
+    DEFAULT_CRAWL_WORKERS, DEFAULT_QUEUE_SIZE
+)
+from .pattern_set import PatternSet
+
 # Global constants
 # DEFAULT_EXTENSIONS = ['.bmp', '.jpg', '.jpeg', '.png', '.webp', '.gif', '.tiff', '.tif', '.jp2', '.heif', '.heic']
 MAX_PATH_LENGTH = 250  # Default max path length to avoid OS limits
+VALIDATION_MODES = ["full", "header"]
+SIGNATURE_BYTES = 32   # Bytes read for header-only validation
+
+# File signatures as (offset, magic bytes); any match is accepted whatever the extension
+IMAGE_SIGNATURES = [
+    (0, b'\xff\xd8\xff'),                       # JPEG
+    (0, b'\x89PNG\r\n\x1a\n'),                   # PNG
+    (0, b'GIF87a'),                             # GIF
+    (0, b'GIF89a'),
+    (0, b'BM'),                                 # BMP
+    (8, b'WEBP'),                               # WebP (after the RIFF header)
+    (0, b'II*\x00'),                             # TIFF, little-endian
+    (0, b'MM\x00*'),                             # TIFF, big-endian
+    (0, b'\x00\x00\x00\x0cjP  \r\n\x87\n'),       # JPEG 2000
+    (0, b'\xff\x4f\xff\x51'),                     # JPEG 2000 codestream
+]
+HEIF_BRANDS = {b'heic', b'heix', b'heim', b'heis', b'hevc', b'hevx', b'mif1', b'msf1', b'avif'}
 
 # File format quality rankings (higher number = better quality)
 # FILE_FORMAT_QUALITY = {
@@ -80,63 +105,29 @@ def check_dependencies():
     return missing
 
 # -----------------------------
-# Pattern Matching Functions
+# Image Discovery and Validation
 # -----------------------------
-def matches_pattern(item, pattern, pattern_mode="glob"):
-    """
-    Check if an item matches a pattern.
+def has_image_signature(file_path):
+    """Check whether a file starts with the signature of a known image format."""
+    with open(file_path, 'rb') as f:
+        header = f.read(SIGNATURE_BYTES)
     
-    Args:
-        item: The string to check
-        pattern: The pattern to match against
-        pattern_mode: "glob" or "regex"
-        
-    Returns:
-        True if item matches pattern, False otherwise
-    """
-    if not pattern:
-        return False
-        
-    try:
-        if pattern_mode == "glob":
-            return fnmatch.fnmatch(item, pattern)
-        elif pattern_mode == "regex":
-            return bool(re.search(pattern, item))
-        else:
-            # Default to glob
-            return fnmatch.fnmatch(item, pattern)
-    except Exception as e:
-        logging.warning(f"Error matching pattern '{pattern}' with mode '{pattern_mode}': {e}")
-        return False
+    if any(header[offset:offset + len(magic)] == magic for offset, magic in IMAGE_SIGNATURES):
+        return True
+    # HEIF/AVIF: an ISO media "ftyp" box with an image brand
+    return header[4:8] == b'ftyp' and header[8:12] in HEIF_BRANDS
 
-def check_patterns(item, include_patterns=None, exclude_patterns=None, pattern_mode="glob"):
-    """
-    Check if an item matches any include patterns and doesn't match any exclude patterns.
-    
-    Args:
-        item: The string to check
-        include_patterns: List of patterns to include
-        exclude_patterns: List of patterns to exclude
-        pattern_mode: "glob" or "regex"
-        
-    Returns:
-        True if item should be included, False otherwise
+def is_valid_image(file_path, min_file_size=0, extensions=None, file_size=None, validation="full"):
     """
-    # If no include patterns, include everything by default
-    # If include patterns exist, at least one must match
-    include_match = not include_patterns or any(matches_pattern(item, p, pattern_mode) for p in include_patterns)
+    Check if the file is a valid image based on extension and file size.
     
-    # If exclude patterns exist, none must match
-    exclude_match = exclude_patterns and any(matches_pattern(item, p, pattern_mode) for p in exclude_patterns)
+    With validation="full" the image data is checked with Image.verify. With
+    validation="header" only the file signature is read; broken image data is
+    found later, by the stage that decodes the image.
     
-    # Include if it matches include patterns and doesn't match exclude patterns
-    return include_match and not exclude_match
-
-# -----------------------------
-# Image Discovery and Validation
-# -----------------------------
-def is_valid_image(file_path, min_file_size=0, extensions=None):
-    """Check if the file is a valid image based on extension and file size."""
+    file_size may be passed when already known (e.g. from an os.DirEntry) to
+    avoid another stat call.
+    """
     if not PILLOW_AVAILABLE:
         raise ImportError("PIL/Pillow is required for image processing")
         
@@ -149,21 +140,74 @@ def is_valid_image(file_path, min_file_size=0, extensions=None):
     file_ext = os.path.splitext(file_path)[1].lower()
     if file_ext not in extensions:
         return False
-    if min_file_size > 0 and os.path.getsize(file_path) < min_file_size * 1024:
-        return False
+    if min_file_size > 0:
+        if file_size is None:
+            file_size = os.path.getsize(file_path)
+        if file_size < min_file_size * 1024:
+            return False
     try:
+        if validation == "header":
+            return has_image_signature(file_path)
         with Image.open(file_path) as img:
             img.verify()
         return True
     except Exception:
         return False
 
+def _build_image_filter(patterns, extensions, min_file_size, validation, skip_report):
+    """Return a crawl_directory file filter accepting valid images with matching names."""
+    if extensions is None:
+        extensions = DEFAULT_EXTENSIONS
+
+    # Normalize extensions once instead of for every file
+    extensions = [ext.lower() if ext.startswith('.') else f'.{ext.lower()}' for ext in extensions]
+    extension_set = set(extensions)
+
+    def file_filter(entry):
+        # Check file against patterns and extension before touching the file
+        if not patterns.match_file(entry.name):
+            return False
+        if os.path.splitext(entry.name)[1].lower() not in extension_set:
+            return False
+        # Reuse the stat data cached by scandir
+        if min_file_size > 0 and entry.stat().st_size < min_file_size * 1024:
+            return False
+        if is_valid_image(entry.path, extensions=extensions, validation=validation):
+            return True
+        if skip_report is not None:
+            skip_report.add(entry.path, "discovery", f"failed {validation} validation")
+        return False
+
+    return file_filter
+
+def _iter_input_dirs(input_dirs, logger):
+    """Yield the absolute paths of the input directories that exist."""
+    # Ensure input_dirs is a list
+    if isinstance(input_dirs, str):
+        input_dirs = [input_dirs]
+    total_dirs = len(input_dirs)
+    
+    for dir_idx, input_dir in enumerate(input_dirs):
+        input_dir = os.path.abspath(input_dir)
+        logger.info(f"Scanning directory [{dir_idx+1}/{total_dirs}]: {input_dir}")
+        
+        if not os.path.exists(input_dir):
+            logger.warning(f"Input directory does not exist: {input_dir}")
+            continue
+            
+        if not os.path.isdir(input_dir):
+            logger.warning(f"Not a directory: {input_dir}")
+            continue
+        
+        yield input_dir
+
 def find_images(input_dirs, exclude_dirs=None, recursive=True, follow_symlinks=False,
                 min_file_size=0, extensions=None, logger=None, show_progress=True,
                 include_dirs_pattern=None, include_files_pattern=None,
                 exclude_dirs_pattern=None, exclude_files_pattern=None,
                 include_pattern=None, exclude_pattern=None,
-                max_depth=None, pattern_mode="glob"):
+                max_depth=None, pattern_mode="glob", num_workers=None,
+                validation="full", skip_report=None, patterns=None):
     """
     Traverse directories to find valid images with pattern filtering.
     
@@ -184,6 +228,10 @@ def find_images(input_dirs, exclude_dirs=None, recursive=True, follow_symlinks=F
         exclude_pattern: List of patterns to exclude both dirs and files
         max_depth: Maximum directory depth to search (None = unlimited)
         pattern_mode: "glob" or "regex"
+        num_workers: Directory listings in flight (default: DEFAULT_CRAWL_WORKERS)
+        validation: "full" to verify image data, "header" to check file signatures only
+        skip_report: Optional SkipReport recording image files that failed validation
+        patterns: Prebuilt PatternSet used instead of the pattern and exclude_dirs arguments
         
     Returns:
         List of valid image paths
@@ -193,83 +241,82 @@ def find_images(input_dirs, exclude_dirs=None, recursive=True, follow_symlinks=F
         
     if logger is None:
         logger = logging.getLogger("core_imagetools")
-    if exclude_dirs is None:
-        exclude_dirs = []
-    exclude_dirs = [os.path.abspath(d) for d in exclude_dirs]
-    if extensions is None:
-        extensions = DEFAULT_EXTENSIONS
+    if patterns is None:
+        patterns = PatternSet(
+            include_dirs=include_dirs_pattern,
+            exclude_dirs=exclude_dirs_pattern,
+            include_files=include_files_pattern,
+            exclude_files=exclude_files_pattern,
+            include_pattern=include_pattern,
+            exclude_pattern=exclude_pattern,
+            exclude_paths=exclude_dirs,
+            pattern_mode=pattern_mode
+        )
+    file_filter = _build_image_filter(patterns, extensions, min_file_size, validation, skip_report)
 
     all_images = []
-    total_dirs = len(input_dirs)
-    
-    # Ensure input_dirs is a list
-    if isinstance(input_dirs, str):
-        input_dirs = [input_dirs]
-    
-    for dir_idx, input_dir in enumerate(input_dirs):
-        input_dir = os.path.abspath(input_dir)
-        logger.info(f"Scanning directory [{dir_idx+1}/{total_dirs}]: {input_dir}")
-        
-        if not os.path.exists(input_dir):
-            logger.warning(f"Input directory does not exist: {input_dir}")
-            continue
-            
-        if not os.path.isdir(input_dir):
-            logger.warning(f"Not a directory: {input_dir}")
-            continue
-        
-        # Process walk parameters based on Python version
-        walk_kwargs = {}
-        if recursive and follow_symlinks:
-            walk_kwargs['followlinks'] = True
-            
-        for root, dirs, files in os.walk(input_dir, **walk_kwargs):
-            # Calculate current depth for max_depth filtering
-            rel_path = os.path.relpath(root, input_dir)
-            current_depth = 0 if rel_path == '.' else rel_path.count(os.sep) + 1
-            
-            # Check max depth
-            if max_depth is not None and current_depth >= max_depth:
-                dirs.clear()  # Don't descend further
-            
-            # Check if the current directory should be excluded
-            if any(os.path.abspath(root).startswith(ed) for ed in exclude_dirs):
-                logger.debug(f"Skipping excluded directory: {root}")
-                continue
-            
-            # Check directory against patterns
-            dir_name = os.path.basename(root)
-            if not check_patterns(dir_name, include_dirs_pattern, exclude_dirs_pattern, pattern_mode):
-                logger.debug(f"Skipping directory {root} due to pattern filtering")
-                continue
-                
-            if recursive:
-                # Filter out excluded directories in-place
-                dirs[:] = [d for d in dirs if 
-                          (not any(os.path.abspath(os.path.join(root, d)).startswith(ed) for ed in exclude_dirs) and
-                           check_patterns(d, include_dirs_pattern, exclude_dirs_pattern, pattern_mode))]
-            
-            valid_images = []
-            for file in files:
-                # Check file against patterns
-                if not check_patterns(file, include_files_pattern, exclude_files_pattern, pattern_mode):
-                    continue
-                    
-                file_path = os.path.join(root, file)
-                try:
-                    if is_valid_image(file_path, min_file_size, extensions):
-                        valid_images.append(file_path)
-                except Exception as e:
-                    logger.debug(f"Error processing {file_path}: {e}")
-            
-            all_images.extend(valid_images)
-            
-            if not recursive:
-                break  # Don't process subdirectories if not recursive
+    for input_dir in _iter_input_dirs(input_dirs, logger):
+        all_images.extend(crawl_directory(
+            input_dir,
+            exclude_trie=patterns.exclude_trie(),
+            dir_filter=patterns.match_dir,
+            file_filter=file_filter,
+            recursive=recursive,
+            follow_symlinks=follow_symlinks,
+            max_depth=max_depth,
+            num_workers=num_workers if num_workers is not None else DEFAULT_CRAWL_WORKERS,
+            logger=logger
+        ))
     
     logger.info(f"Found {len(all_images)} valid images")
     return all_images
 
+def iter_images(input_dirs, exclude_dirs=None, recursive=True, follow_symlinks=False,
+                min_file_size=0, extensions=None, logger=None,
+                include_dirs_pattern=None, include_files_pattern=None,
+                exclude_dirs_pattern=None, exclude_files_pattern=None,
+                max_depth=None, pattern_mode="glob", num_workers=None,
+                validation="full", skip_report=None, patterns=None, max_queued=DEFAULT_QUEUE_SIZE):
+    """
+    Yield valid images while the directories are still being crawled.
+    
+    The crawl runs in a background thread up to max_queued images ahead of
+    the caller, so later stages can start on the first images right away.
+    Images come in the order directory listings complete. Takes the same
+    filtering arguments as find_images.
+    """
+    if not PILLOW_AVAILABLE:
+        raise ImportError("PIL/Pillow is required for image processing")
+        
+    if logger is None:
+        logger = logging.getLogger("core_imagetools")
+    if patterns is None:
+        patterns = PatternSet(
+            include_dirs=include_dirs_pattern,
+            exclude_dirs=exclude_dirs_pattern,
+            include_files=include_files_pattern,
+            exclude_files=exclude_files_pattern,
+            exclude_paths=exclude_dirs,
+            pattern_mode=pattern_mode
+        )
+    file_filter = _build_image_filter(patterns, extensions, min_file_size, validation, skip_report)
+
+    def crawl():
+        for input_dir in _iter_input_dirs(input_dirs, logger):
+            yield from iter_crawl_directory(
+                input_dir,
+                exclude_trie=patterns.exclude_trie(),
+                dir_filter=patterns.match_dir,
+                file_filter=file_filter,
+                recursive=recursive,
+                follow_symlinks=follow_symlinks,
+                max_depth=max_depth,
+                num_workers=num_workers if num_workers is not None else DEFAULT_CRAWL_WORKERS,
+                logger=logger
+            )
+
+    yield from iter_in_background(crawl(), max_queued)
+
 def get_image_dimensions(image_path):
     """Return the width and height of the image."""
     if not PILLOW_AVAILABLE:
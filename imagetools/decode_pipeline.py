@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2025 Dustin Darcy <ScarcityHypothesis.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+decode_pipeline.py
+
+Producer/consumer pipeline that keeps the CLIP model busy.
+
+Worker processes open, decode, resize, crop and normalize whole batches of
+images into ready-to-use float32 arrays, while the caller runs inference on
+the batches already finished. At most a fixed number of batches is in flight,
+so memory stays bounded however many images there are.
+
+Preprocessing mirrors the CLIP image processor (shortest-edge bicubic resize,
+center crop, rescale and per-channel normalization) using only Pillow and
+numpy, so worker processes never need torch.
+
+Stages that only need a small image can decode at reduced resolution: JPEGs
+are scaled down during decoding with draft() and other formats are shrunk by
+an integer factor with reduce(), stopping short of the size the stage needs.
+
+For region checks, each image is decoded once and all of its region crops are
+preprocessed from memory in the same pass.
+"""
+
+import math
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from imagetools import (
+    PILLOW_AVAILABLE,
+    Image
+)
+from imagetools import NUMPY_AVAILABLE, np
+
+# Global constants
+CLIP_IMAGE_SIZE = 224
+CLIP_IMAGE_MEAN = [0.48145466, 0.4578275, 0.40821073]
+CLIP_IMAGE_STD = [0.26862954, 0.26130258, 0.27577711]
+PREFETCH_BATCHES_PER_WORKER = 2  # Batches in flight per worker process
+REGION_TYPES = ["center", "top_left", "top_right", "bottom_left", "bottom_right"]
+DEFAULT_REGION_SIZE = 512        # Region side in original pixels
+
+def reduce_image(img, min_size, mode="RGB", fast_decode=True):
+    """
+    Decode an opened image, at reduced resolution when fast decoding is enabled.
+
+    Args:
+        img: PIL Image returned by Image.open (not yet loaded)
+        min_size: Smallest acceptable (width, height), or an int for both
+        mode: Mode the caller converts to; lets JPEG decode straight to it
+        fast_decode: Decode at full resolution when False
+
+    Returns:
+        Loaded PIL Image at least min_size in each dimension, unless the
+        original is smaller. May be a new image; the caller closes both.
+    """
+    if not fast_decode or not min_size:
+        img.load()
+        return img
+
+    if isinstance(min_size, int):
+        min_size = (min_size, min_size)
+
+    # JPEG: DCT scaling by 1/2, 1/4 or 1/8 while decoding; a no-op for other formats
+    img.draft(mode, min_size)
+    img.load()
+
+    factor = min(img.width // min_size[0], img.height // min_size[1])
+    if factor >= 2:
+        try:
+            return img.reduce(factor)
+        except ValueError:
+            pass  # Modes without reduce() support are used as decoded
+    return img
+
+def open_image(image_path, min_size=None, mode="RGB", fast_decode=True):
+    """
+    Open and decode an image file, at reduced resolution when only a small copy is needed.
+
+    Args:
+        image_path: Path to the image
+        min_size: Smallest acceptable (width, height), or an int for both
+        mode: Mode the returned image is converted to
+        fast_decode: Decode at full resolution when False
+
+    Returns:
+        PIL Image in the requested mode
+    """
+    with Image.open(image_path) as img:
+        decoded = reduce_image(img, min_size, mode, fast_decode)
+        if decoded.mode == mode:
+            return decoded.copy() if decoded is img else decoded
+        return decoded.convert(mode)
+
+def get_region_min_size(image_size, region_size, target_size=None):
+    """
+    Smallest decode size at which a region of region_size original pixels still
+    covers target_size pixels (default: the CLIP input size).
+    """
+    target_size = target_size or CLIP_IMAGE_SIZE
+    scale = min(1.0, target_size / max(1, region_size))
+    return (math.ceil(image_size[0] * scale), math.ceil(image_size[1] * scale))
+
+def get_region_types(regions):
+    """
+    Region types checked for a --check-regions count. A count of 0 or 1 uses
+    the whole image only.
+    """
+    if regions <= 1:
+        return []
+    return REGION_TYPES[:regions]
+
+def get_region_box(width, height, region_type, size=DEFAULT_REGION_SIZE):
+    """Return the crop box of a region in an image of the given dimensions."""
+    # Ensure size fits within the image
+    size = min(size, width, height)
+
+    if region_type == "top_left":
+        return (0, 0, size, size)
+    elif region_type == "top_right":
+        return (width - size, 0, width, size)
+    elif region_type == "bottom_left":
+        return (0, height - size, size, height)
+    elif region_type == "bottom_right":
+        return (width - size, height - size, width, height)
+    else:
+        # Center region (also the default)
+        left = (width - size) // 2
+        top = (height - size) // 2
+        return (left, top, left + size, top + size)
+
+def crop_image_regions(img, region_types, size=DEFAULT_REGION_SIZE, fast_decode=True):
+    """
+    Crop several regions from one opened image, decoding it only once.
+
+    Regions are given in original pixels. With fast_decode, the image is
+    decoded only as large as needed for each region to still cover the model
+    input size, so crops may be smaller than size.
+
+    Args:
+        img: PIL Image returned by Image.open (not yet loaded)
+        region_types: List of region names from REGION_TYPES
+        size: Region side in original pixels
+        fast_decode: Decode at full resolution when False
+
+    Returns:
+        List of PIL Images, one per region type
+    """
+    width, height = img.size
+    decoded = reduce_image(img, get_region_min_size(img.size, min(size, width, height)),
+                           fast_decode=fast_decode)
+
+    # Map each box onto the decoded image, which may be reduced
+    scale_x = decoded.width / width
+    scale_y = decoded.height / height
+    crops = []
+    for region_type in region_types:
+        box = get_region_box(width, height, region_type, size)
+        crops.append(decoded.crop((round(box[0] * scale_x), round(box[1] * scale_y),
+                                   round(box[2] * scale_x), round(box[3] * scale_y))))
+    return crops
+
+def get_preprocess_config(processor=None, fast_decode=True, region_types=None):
+    """
+    Extract the preprocessing parameters of a CLIP processor as a plain dictionary.
+
+    The dictionary is cheap to send to worker processes. Values missing from
+    the processor fall back to the standard CLIP settings.
+
+    Args:
+        processor: CLIP processor, or None for the standard CLIP settings
+        fast_decode: Decode images at reduced resolution near the model input size
+        region_types: Produce these region crops of each image instead of the whole image
+    """
+    image_processor = getattr(processor, "image_processor", processor)
+
+    size = getattr(image_processor, "size", None) or {}
+    crop_size = getattr(image_processor, "crop_size", None) or {}
+    if isinstance(size, int):
+        size = {"shortest_edge": size}
+    if isinstance(crop_size, int):
+        crop_size = {"height": crop_size, "width": crop_size}
+
+    return {
+        "shortest_edge": size.get("shortest_edge", CLIP_IMAGE_SIZE),
+        "crop_height": crop_size.get("height", CLIP_IMAGE_SIZE),
+        "crop_width": crop_size.get("width", CLIP_IMAGE_SIZE),
+        "rescale_factor": getattr(image_processor, "rescale_factor", 1 / 255),
+        "image_mean": list(getattr(image_processor, "image_mean", None) or CLIP_IMAGE_MEAN),
+        "image_std": list(getattr(image_processor, "image_std", None) or CLIP_IMAGE_STD),
+        "fast_decode": fast_decode,
+        "region_types": list(region_types or [])
+    }
+
+def preprocess_image(img, config):
+    """
+    Turn a PIL image into a normalized channels-first float32 array.
+
+    Args:
+        img: PIL Image
+        config: Dictionary from get_preprocess_config
+
+    Returns:
+        numpy array of shape (3, crop_height, crop_width)
+    """
+    img = img.convert("RGB")
+
+    # Resize so the shortest edge matches, keeping the aspect ratio
+    width, height = img.size
+    shortest_edge = config["shortest_edge"]
+    if width <= height:
+        new_size = (shortest_edge, int(shortest_edge * height / width))
+    else:
+        new_size = (int(shortest_edge * width / height), shortest_edge)
+    img = img.resize(new_size, Image.Resampling.BICUBIC)
+
+    # Center crop
+    crop_height = config["crop_height"]
+    crop_width = config["crop_width"]
+    left = int((new_size[0] - crop_width) / 2)
+    top = int((new_size[1] - crop_height) / 2)
+    img = img.crop((left, top, left + crop_width, top + crop_height))
+
+    pixels = np.asarray(img, dtype=np.float32) * config["rescale_factor"]
+    pixels = (pixels - np.asarray(config["image_mean"], dtype=np.float32)) / \
+             np.asarray(config["image_std"], dtype=np.float32)
+    return np.ascontiguousarray(pixels.transpose(2, 0, 1))
+
+def preprocess_batch(image_paths, config):
+    """
+    Decode and preprocess a batch of images. Runs inside worker processes.
+
+    Returns:
+        tuple: (paths, pixel_values, failures) where pixel_values stacks the
+        images that loaded (None if none did) and failures is a list of
+        (path, error message) tuples. With region types in the config,
+        pixel_values holds one row per region, image by image.
+    """
+    paths = []
+    arrays = []
+    failures = []
+    region_types = config.get("region_types")
+    fast_decode = config.get("fast_decode", True)
+    for image_path in image_paths:
+        try:
+            if region_types:
+                with Image.open(image_path) as img:
+                    regions = crop_image_regions(img, region_types, fast_decode=fast_decode)
+                region_arrays = [preprocess_image(region, config) for region in regions]
+                arrays.extend(region_arrays)
+            else:
+                with open_image(image_path, min_size=config["shortest_edge"], fast_decode=fast_decode) as img:
+                    arrays.append(preprocess_image(img, config))
+            paths.append(image_path)
+        except Exception as e:
+            failures.append((image_path, str(e)))
+
+    pixel_values = np.stack(arrays) if arrays else None
+    return paths, pixel_values, failures
+
+def iter_batches(image_paths, batch_size):
+    """Split a list or any iterable of paths into lists of batch_size, lazily."""
+    iterator = iter(image_paths)
+    while True:
+        batch = list(itertools.islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+def iter_preprocessed_batches(image_paths, config, batch_size=16, num_workers=1, prefetch_batches=None):
+    """
+    Yield preprocessed batches in input order.
+
+    With more than one worker, batches are decoded by a process pool while the
+    caller consumes earlier ones; at most prefetch_batches batches are queued
+    or in progress at any time. With one worker everything runs in-process.
+
+    image_paths may be a generator, e.g. from a crawl still in progress; a
+    batch is submitted as soon as enough paths have arrived.
+
+    Args:
+        image_paths: List or iterable of image paths
+        config: Dictionary from get_preprocess_config
+        batch_size: Images per batch
+        num_workers: Number of worker processes
+        prefetch_batches: Maximum batches in flight (default: 2 per worker)
+
+    Yields:
+        Tuples from preprocess_batch
+    """
+    if not PILLOW_AVAILABLE or not NUMPY_AVAILABLE:
+        raise ImportError("PIL/Pillow and numpy are required for image preprocessing")
+
+    batches = iter_batches(image_paths, batch_size)
+    if hasattr(image_paths, "__len__"):
+        num_workers = min(num_workers or 1, math.ceil(len(image_paths) / batch_size))
+    num_workers = max(1, num_workers or 1)
+
+    if num_workers == 1:
+        for batch in batches:
+            yield preprocess_batch(batch, config)
+        return
+
+    if prefetch_batches is None:
+        prefetch_batches = PREFETCH_BATCHES_PER_WORKER * num_workers
+    prefetch_batches = max(1, prefetch_batches)
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        pending = deque()
+        remaining = batches
+
+        # Fill the queue, then submit one new batch for every batch consumed
+        for batch in remaining:
+            pending.append(executor.submit(preprocess_batch, batch, config))
+            if len(pending) >= prefetch_batches:
+                break
+
+        try:
+            while pending:
+                result = pending.popleft().result()
+                next_batch = next(remaining, None)
+                if next_batch is not None:
+                    pending.append(executor.submit(preprocess_batch, next_batch, config))
+                yield result
+        finally:
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2025 Dustin Darcy <ScarcityHypothesis.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+directory_crawler.py
+
+Parallel directory crawler built on os.scandir.
+
+Each directory is listed by one os.scandir call in a worker thread, and its
+subdirectories are queued as new tasks, so many listings are in flight at
+once. This hides the per-request latency of network shares. File filters get
+the DirEntry, so cached stat data is used instead of separate stat calls.
+Excluded directories are looked up in a trie of path components, one step
+per directory level, instead of comparing every path against every exclusion.
+
+Results come back in the same top-down order os.walk would produce, however
+the listings complete. For streaming, iter_crawl_directory yields files as
+soon as their directory has been listed instead, and iter_in_background
+keeps a crawl running ahead of a slower consumer.
+"""
+
+import os
+import queue
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Global constants
+DEFAULT_CRAWL_WORKERS = 8    # Listings in flight; crawling waits on I/O, not CPU
+DEFAULT_QUEUE_SIZE = 4096    # Items a background iterator may run ahead
+
+def split_path(path):
+    """Split an absolute, case-normalized path into its components."""
+    drive, rest = os.path.splitdrive(os.path.normcase(os.path.abspath(path)))
+    parts = [part for part in rest.split(os.sep) if part]
+    return [drive + os.sep] + parts
+
+class PathTrie:
+    """
+    Trie of path components for directory-prefix lookups.
+
+    A node is a dictionary mapping component names to child nodes; a node
+    that ends an added path holds the key None.
+    """
+    def __init__(self, paths=None):
+        self.root = {}
+        for path in paths or []:
+            self.add(path)
+
+    def add(self, path):
+        """Add a directory; it and everything below it will match."""
+        node = self.root
+        for part in split_path(path):
+            node = node.setdefault(part, {})
+        node[None] = True
+
+    def find(self, path):
+        """
+        Look up a path.
+
+        Returns:
+            tuple: (matched, node) where matched is True if the path or one of
+            its parents was added, and node is the trie node of the path (None
+            when no added path lies below it) to pass to child()
+        """
+        node = self.root
+        for part in split_path(path):
+            node = node.get(part)
+            if node is None:
+                return False, None
+            if None in node:
+                return True, node
+        return False, node
+
+    @staticmethod
+    def child(node, name):
+        """
+        Step from a directory's node to one of its subdirectories.
+
+        Returns:
+            tuple: (matched, node) as for find()
+        """
+        if node is None:
+            return False, None
+        node = node.get(os.path.normcase(name))
+        if node is None:
+            return False, None
+        return None in node, node
+
+def _scan_directory(path, depth, node, passed, dir_filter, file_filter, descend,
+                    follow_symlinks, max_depth, logger):
+    """
+    List one directory. Runs inside worker threads.
+
+    Returns:
+        tuple: (files, subdirs) with the accepted file paths and the
+        (path, depth, trie node, passed) tasks of subdirectories to crawl
+    """
+    files = []
+    subdirs = []
+    descend = descend and (max_depth is None or depth < max_depth)
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+
+                if is_dir:
+                    if not descend or (not follow_symlinks and entry.is_symlink()):
+                        continue
+                    excluded, child_node = PathTrie.child(node, entry.name)
+                    if excluded:
+                        logger.debug(f"Skipping excluded directory: {entry.path}")
+                        continue
+                    # Below a directory that failed the patterns, subdirectories
+                    # are visited and checked by their own name
+                    child_passed = dir_filter is None or dir_filter(entry.name)
+                    if passed and not child_passed:
+                        logger.debug(f"Skipping directory {entry.path} due to pattern filtering")
+                        continue
+                    subdirs.append((entry.path, depth + 1, child_node, child_passed))
+                elif passed:
+                    try:
+                        if file_filter is None or file_filter(entry):
+                            files.append(entry.path)
+                    except Exception as e:
+                        logger.debug(f"Error processing {entry.path}: {e}")
+    except OSError as e:
+        logger.warning(f"Error scanning directory {path}: {e}")
+    return files, subdirs
+
+def _iter_listings(root, exclude_trie, dir_filter, file_filter, recursive, follow_symlinks,
+                   max_depth, num_workers, logger):
+    """Yield (path, files, subdirs) for each crawled directory as its listing completes."""
+    root = os.path.abspath(root)
+    excluded, node = exclude_trie.find(root) if exclude_trie else (False, None)
+    if excluded:
+        logger.debug(f"Skipping excluded directory: {root}")
+        return
+
+    passed = dir_filter is None or dir_filter(os.path.basename(root))
+    if not passed:
+        logger.debug(f"Skipping directory {root} due to pattern filtering")
+
+    def scan(task):
+        path, depth, task_node, task_passed = task
+        return _scan_directory(path, depth, task_node, task_passed, dir_filter, file_filter,
+                               recursive, follow_symlinks, max_depth, logger)
+
+    root_task = (root, 0, node, passed)
+    if num_workers is None or num_workers <= 1:
+        tasks = [root_task]
+        while tasks:
+            task = tasks.pop()
+            files, subdirs = scan(task)
+            yield task[0], files, subdirs
+            tasks.extend(subdirs)
+        return
+
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        pending = {executor.submit(scan, root_task): root}
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = pending.pop(future)
+                    files, subdirs = future.result()
+                    for task in subdirs:
+                        pending[executor.submit(scan, task)] = task[0]
+                    yield path, files, subdirs
+        finally:
+            for future in pending:
+                future.cancel()
+
+def crawl_directory(root, exclude_trie=None, dir_filter=None, file_filter=None, recursive=True,
+                    follow_symlinks=False, max_depth=None, num_workers=DEFAULT_CRAWL_WORKERS,
+                    logger=None):
+    """
+    Find the files below a directory, listing directories in parallel.
+
+    Args:
+        root: Directory to crawl
+        exclude_trie: PathTrie of directories to skip entirely
+        dir_filter: Function called with a directory name; False skips the
+            directory's files and, below the root, the directory itself
+        file_filter: Function called with each file's os.DirEntry; False skips the file
+        recursive: Whether to descend into subdirectories
+        follow_symlinks: Whether to descend into symlinked directories
+        max_depth: Maximum directory depth to descend into (None = unlimited)
+        num_workers: Number of directory listings in flight
+        logger: Logger instance
+
+    Returns:
+        List of accepted file paths in os.walk top-down order
+    """
+    if logger is None:
+        logger = logging.getLogger("directory_crawler")
+
+    listings = {}
+    for path, files, subdirs in _iter_listings(root, exclude_trie, dir_filter, file_filter, recursive,
+                                               follow_symlinks, max_depth, num_workers, logger):
+        listings[path] = (files, subdirs)
+    if not listings:
+        return []
+
+    # Reassemble in top-down order: a directory's files, then each subdirectory in listing order
+    results = []
+    stack = [os.path.abspath(root)]
+    while stack:
+        files, subdirs = listings.pop(stack.pop())
+        results.extend(files)
+        stack.extend(task[0] for task in reversed(subdirs))
+    return results
+
+def iter_crawl_directory(root, exclude_trie=None, dir_filter=None, file_filter=None, recursive=True,
+                         follow_symlinks=False, max_depth=None, num_workers=DEFAULT_CRAWL_WORKERS,
+                         logger=None):
+    """
+    Yield the files below a directory as soon as their directory is listed.
+
+    Takes the same arguments as crawl_directory. Files come in the order the
+    listings complete, not in os.walk order.
+    """
+    if logger is None:
+        logger = logging.getLogger("directory_crawler")
+
+    for _, files, _ in _iter_listings(root, exclude_trie, dir_filter, file_filter, recursive,
+                                      follow_symlinks, max_depth, num_workers, logger):
+        yield from files
+
+def iter_in_background(iterable, max_items=DEFAULT_QUEUE_SIZE):
+    """
+    Consume an iterable in a background thread, yielding its items in order.
+
+    The producer runs up to max_items ahead of the consumer, so a crawl keeps
+    going while the caller is busy, and memory stays bounded. Exceptions from
+    the producer are raised in the consumer.
+    """
+    items = queue.Queue(maxsize=max(1, max_items))
+    done = object()
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                while not stop.is_set():
+                    try:
+                        items.put((item, None), timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            items.put((done, None))
+        except BaseException as e:
+            items.put((done, e))
+
+    thread = threading.Thread(target=produce, name="iter_in_background", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is done:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        # Let the producer exit if the consumer stops early
+        stop.set()
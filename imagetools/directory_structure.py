@@ -26,39 +26,54 @@ Updates include:
 - Enhanced collision handling with multiple strategies
 - Date preference configuration for quality metrics
 - Improved logging and error handling
+- Journaled output operations for resumable runs
+- Output planned in memory, then written by a thread pool
 """
 
 import os
 import sys
 import logging
-import shutil
 from pathlib import Path
 
 from imagetools import TQDM_AVAILABLE, tqdm
+from imagetools import NUMPY_AVAILABLE
 
 # Import from our modules
 from .core_imagetools import get_image_dimensions
-from .quality_metrics import find_best_image_hybrid, get_metric_overrides
+from .quality_metrics import find_best_image_hybrid, find_best_images_batch, get_metric_overrides
+from .image_metadata import MetadataTable
 from .file_operations import (
-    create_safe_path, write_metadata_file, handle_duplicate, 
-    create_symlink, reset_filename_registry
+    create_safe_path, write_metadata_file, handle_duplicate, CollisionIndex
 )
+from .output_plan import OutputPlan, execute_plan, DEFAULT_OUTPUT_WORKERS
 
 # -----------------------------
 # Output Directory Structure
 # -----------------------------
+def _plan_long_path(plan, path, max_path_length, info, group=None):
+    """Shorten a path that is too long, planning the metadata file that records its original name."""
+    safe_path, metadata_path = create_safe_path(path, max_path_length)
+    if metadata_path:
+        plan.add_metadata(metadata_path, path, info, group=group)
+    return safe_path
+
 def create_output_structure(similar_groups, output_dir, primary_metrics=None, secondary_metrics=None,
-                           metric_weights=None, date_preference="newest", metric_overrides=None, 
-                           naming_pattern="{filename}_{width}x{height}_candidates",
+                           metric_weights=None, date_preference="newest", metric_overrides=None,
+                           margin_threshold=0.0, naming_pattern="{filename}_{width}x{height}_candidates",
                            file_handling="symlink", copy_best=False, suffix="_candidates",
                            handle_long_paths=True, max_path_length=250,
                            include_singletons=True, singletons_subdir="_singletons_",
                            collision_strategy="hierarchical", dryrun=False, create_backlinks=False,
-                           logger=None, show_progress=True):
+                           logger=None, show_progress=True, metadata=None, outputs=None, journal=None,
+                           num_workers=DEFAULT_OUTPUT_WORKERS):
     """
     Create directories for each group.
     For each group, create a main folder for the best image and a candidate subfolder for all images.
     
+    Every destination and name collision is planned in memory first; the
+    directories are then created in one pass and the files are placed by a
+    pool of worker threads.
+    
     Args:
         similar_groups: List of image groups (each group is a set of image paths)
         output_dir: Base output directory
@@ -67,6 +82,9 @@ def create_output_structure(similar_groups, output_dir, primary_metrics=None, se
         metric_weights: Dictionary mapping metrics to their weights (for secondary metrics)
         date_preference: Preference for date metrics ("newest" or "oldest")
         metric_overrides: Dictionary of per-metric preference overrides
+        margin_threshold: Relative tolerance under the group best that still counts as
+            a tie on a primary metric; 0.0 keeps strict ties. The per-group
+            selection used without numpy always keeps strict ties
         naming_pattern: Pattern for output directory names
         file_handling: How to handle files - "symlink", "copy", or "move"
         copy_best: Always copy best image, regardless of file_handling mode
@@ -80,12 +98,23 @@ def create_output_structure(similar_groups, output_dir, primary_metrics=None, se
         create_backlinks: Create symlinks back to original locations when moving files
         logger: Logger instance
         show_progress: Whether to show progress bar
+        metadata: MetadataTable of the grouped images; probed here when None
+        outputs: Optional dictionary filled with the files and directories
+            created for each group, keyed by group index
+        journal: Optional OutputJournal; completed operations are recorded and
+            operations already recorded are skipped. In a dry run the planned
+            operations are recorded instead
+        num_workers: File operations run in parallel
         
     Returns:
         List of dictionaries with information about created groups
     """
     if logger is None:
         logger = logging.getLogger("directory_structure")
+
+    # Read each grouped image's metadata once instead of once per metric
+    if metadata is None and NUMPY_AVAILABLE:
+        metadata = MetadataTable.probe([path for group in similar_groups if len(group) > 1 for path in group])
     
     # Create output directory if it doesn't exist and we're not in dry run mode
     if not dryrun:
@@ -102,15 +131,45 @@ def create_output_structure(similar_groups, output_dir, primary_metrics=None, se
     elif metric_overrides is None:
         metric_overrides = {}
     
-    results = []
+    # Select the best image of every group in one vectorized pass
+    best_images = {}
+    if metadata is not None:
+        multi_groups = [idx for idx, group in enumerate(similar_groups) if len(group) > 1]
+        try:
+            winners = find_best_images_batch(
+                [similar_groups[idx] for idx in multi_groups],
+                primary_metrics=primary_metrics,
+                secondary_metrics=secondary_metrics,
+                metric_weights=metric_weights,
+                date_preference=date_preference,
+                metric_overrides=metric_overrides,
+                margin_threshold=margin_threshold,
+                metadata=metadata
+            )
+            best_images = dict(zip(multi_groups, winners))
+        except Exception as e:
+            logger.warning(f"Batch best-image selection failed, selecting per group: {e}")
+    
+    # Always copy best image if copy_best is True, otherwise use file_handling mode
+    if copy_best or file_handling == "copy":
+        best_mode = "copy"
+    elif file_handling == "move":
+        best_mode = "move"
+    else:  # symlink is the default
+        best_mode = "symlink"
+    candidate_mode = file_handling if file_handling in ("copy", "move") else "symlink"
+    
+    plan = OutputPlan(collision_strategy, journal, CollisionIndex(output_dir))
+    planned_groups = []
     singletons = []
+    singleton_groups = {}
     
     # Setup progress bar if available and requested
     if show_progress and TQDM_AVAILABLE:
-        iterator = tqdm(similar_groups, desc="Creating output structure")
+        iterator = tqdm(similar_groups, desc="Planning output structure")
     else:
         iterator = similar_groups
-        logger.info(f"Creating output structure for {len(similar_groups)} groups...")
+        logger.info(f"Planning output structure for {len(similar_groups)} groups...")
     
     for group_idx, image_group in enumerate(iterator):
         # Skip processing for single-image groups if not including singletons
@@ -121,18 +180,20 @@ def create_output_structure(similar_groups, output_dir, primary_metrics=None, se
         if len(image_group) == 1 and include_singletons:
             singleton_path = next(iter(image_group))
             singletons.append(singleton_path)
+            singleton_groups[singleton_path] = group_idx
             continue
         
         # Find the best image in the group using hybrid approach
         try:
-            best_image = find_best_image_hybrid(
+            best_image = best_images.get(group_idx) or find_best_image_hybrid(
                 image_group, 
                 primary_metrics=primary_metrics,
                 secondary_metrics=secondary_metrics,
                 metric_weights=metric_weights,
                 date_preference=date_preference,
                 metric_overrides=metric_overrides,
-                logger=logger if logger.isEnabledFor(logging.DEBUG) else None
+                logger=logger if logger.isEnabledFor(logging.DEBUG) else None,
+                metadata=metadata
             )
         except Exception as e:
             logger.error(f"Error finding best image for group {group_idx}: {e}")
@@ -144,7 +205,10 @@ def create_output_structure(similar_groups, output_dir, primary_metrics=None, se
         
         # Get filename and dimensions for naming
         best_filename = os.path.splitext(os.path.basename(best_image))[0]
-        width, height = get_image_dimensions(best_image)
+        if metadata is not None and best_image in metadata:
+            width, height = metadata.get_dimensions(best_image)
+        else:
+            width, height = get_image_dimensions(best_image)
         
         # Create directory name
         dir_name = naming_pattern.format(
@@ -154,185 +218,189 @@ def create_output_structure(similar_groups, output_dir, primary_metrics=None, se
         )
         
         # Handle long paths if requested
+        group_start = len(plan.operations)
         group_dir = os.path.join(output_dir, dir_name)
         if handle_long_paths and len(group_dir) > max_path_length:
-            safe_dir, metadata_path = create_safe_path(group_dir, max_path_length)
-            
-            # Write metadata if path was shortened and not in dry run
-            if metadata_path and not dryrun:
-                write_metadata_file(metadata_path, group_dir, {
-                    "Original name": dir_name,
-                    "Best image": best_image,
-                    "Image dimensions": f"{width}x{height}"
-                })
-            
-            group_dir = safe_dir
+            group_dir = _plan_long_path(plan, group_dir, max_path_length, {
+                "Original name": dir_name,
+                "Best image": best_image,
+                "Image dimensions": f"{width}x{height}"
+            }, group=group_idx)
         
         # Create candidates directory
         candidates_dir = os.path.join(group_dir, f"{best_filename}{suffix}")
         
         # Handle long paths for candidates directory
         if handle_long_paths and len(candidates_dir) > max_path_length:
-            safe_dir, metadata_path = create_safe_path(candidates_dir, max_path_length)
-            
-            # Write metadata if path was shortened and not in dry run
-            if metadata_path and not dryrun:
-                write_metadata_file(metadata_path, candidates_dir, {
-                    "Original name": f"{best_filename}{suffix}",
-                    "Parent group": dir_name
-                })
-            
-            candidates_dir = safe_dir
+            candidates_dir = _plan_long_path(plan, candidates_dir, max_path_length, {
+                "Original name": f"{best_filename}{suffix}",
+                "Parent group": dir_name
+            }, group=group_idx)
         
         # Log what we're doing
         logger.info(f"Processing group {group_idx+1}: {os.path.basename(group_dir)}")
-        
-        if not dryrun:
-            # Create directories
-            try:
-                os.makedirs(group_dir, exist_ok=True)
-                os.makedirs(candidates_dir, exist_ok=True)
-                logger.debug(f"Created directories: {group_dir} and {candidates_dir}")
-            except Exception as e:
-                logger.error(f"Failed to create directories: {e}")
-                continue
+        plan.add_directory(group_dir)
+        plan.add_directory(candidates_dir)
         
         # Handle the best image
         best_image_dest = os.path.join(group_dir, os.path.basename(best_image))
         
         # Handle long paths for best image destination
         if handle_long_paths and len(best_image_dest) > max_path_length:
-            safe_path, metadata_path = create_safe_path(best_image_dest, max_path_length)
-            
-            # Write metadata if path was shortened and not in dry run
-            if metadata_path and not dryrun:
-                write_metadata_file(metadata_path, best_image_dest, {
-                    "Original filename": os.path.basename(best_image),
-                    "Source path": best_image
-                })
-            
-            best_image_dest = safe_path
+            best_image_dest = _plan_long_path(plan, best_image_dest, max_path_length, {
+                "Original filename": os.path.basename(best_image),
+                "Source path": best_image
+            }, group=group_idx)
         
-        if not dryrun:
-            try:
-                # Always copy best image if copy_best is True, otherwise use file_handling mode
-                if copy_best:
-                    actual_dest = handle_duplicate(best_image, best_image_dest, "copy", False, collision_strategy)
-                    logger.debug(f"Copied best image to {actual_dest}")
-                elif file_handling == "copy":
-                    actual_dest = handle_duplicate(best_image, best_image_dest, "copy", False, collision_strategy)
-                    logger.debug(f"Copied best image to {actual_dest}")
-                elif file_handling == "move":
-                    actual_dest = handle_duplicate(best_image, best_image_dest, "move", create_backlinks, collision_strategy)
-                    logger.debug(f"Moved best image to {actual_dest}")
-                    # Note: backlinks are created by handle_duplicate if requested
-                else:  # symlink is the default
-                    actual_dest = handle_duplicate(best_image, best_image_dest, "symlink", False, collision_strategy)
-                    logger.debug(f"Created symlink for best image at {actual_dest}")
-                
-                # Update best_image_dest with the actual destination (which might have changed due to collision)
-                best_image_dest = actual_dest
-            except Exception as e:
-                logger.error(f"Failed to handle best image {best_image}: {e}")
-                continue
+        best_operation = plan.add_file(best_image, best_image_dest, best_mode, create_backlinks,
+                                       group=group_idx, role="best")
         
         # Process all images in the group (including best) for candidates directory
-        candidate_count = 0
         for image_path in image_group:
             candidate_dest = os.path.join(candidates_dir, os.path.basename(image_path))
             
             # Handle long paths for candidate destination
             if handle_long_paths and len(candidate_dest) > max_path_length:
-                safe_path, metadata_path = create_safe_path(candidate_dest, max_path_length)
-                
-                # Write metadata if path was shortened and not in dry run
-                if metadata_path and not dryrun:
-                    write_metadata_file(metadata_path, candidate_dest, {
-                        "Original filename": os.path.basename(image_path),
-                        "Source path": image_path
-                    })
-                
-                candidate_dest = safe_path
+                candidate_dest = _plan_long_path(plan, candidate_dest, max_path_length, {
+                    "Original filename": os.path.basename(image_path),
+                    "Source path": image_path
+                }, group=group_idx)
             
-            if not dryrun:
-                try:
-                    if file_handling == "copy":
-                        actual_dest = handle_duplicate(image_path, candidate_dest, "copy", False, collision_strategy)
-                        logger.debug(f"Copied candidate to {actual_dest}")
-                    elif file_handling == "move":
-                        actual_dest = handle_duplicate(image_path, candidate_dest, "move", create_backlinks, collision_strategy)
-                        logger.debug(f"Moved candidate to {actual_dest}")
-                        # Note: backlinks are created by handle_duplicate if requested
-                    else:  # symlink is the default
-                        actual_dest = handle_duplicate(image_path, candidate_dest, "symlink", False, collision_strategy)
-                        logger.debug(f"Created symlink for candidate at {actual_dest}")
-                    candidate_count += 1
-                except Exception as e:
-                    logger.error(f"Failed to process candidate {image_path}: {e}")
+            plan.add_file(image_path, candidate_dest, candidate_mode, create_backlinks,
+                          group=group_idx, role="candidate")
+        
+        planned_groups.append((group_idx, best_image, best_operation, group_start, len(plan.operations),
+                               candidates_dir, group_dir))
+    
+    # Handle singleton images if requested
+    singleton_operations = {}
+    if include_singletons and singletons:
+        singleton_operations = _plan_singletons(
+            plan,
+            singletons,
+            output_dir,
+            singletons_subdir,
+            file_handling,
+            create_backlinks,
+            handle_long_paths,
+            max_path_length
+        )
+    
+    execute_plan(plan, dryrun=dryrun, num_workers=num_workers, show_progress=show_progress, logger=logger)
+    
+    results = []
+    for group_idx, best_image, best_operation, start, end, candidates_dir, group_dir in planned_groups:
+        if "error" in best_operation:
+            logger.error(f"Failed to handle best image {best_image}: {best_operation['error']}")
+            continue
+        
+        # Files first, then the directories that hold them, innermost first
+        group_operations = plan.operations[start:end]
+        if outputs is not None and not dryrun:
+            outputs[group_idx] = ([operation["actual"] for operation in group_operations if "actual" in operation]
+                                  + [candidates_dir, group_dir])
         
         # Add to results
         results.append({
             "best_image": best_image,
-            "best_image_dest": best_image_dest,
+            "best_image_dest": best_operation["actual"],
             "candidates_dir": candidates_dir,
-            "total_candidates": candidate_count
+            "total_candidates": sum(1 for operation in group_operations
+                                    if operation["role"] == "candidate" and "actual" in operation)
         })
     
-    # Handle singleton images if requested
-    if include_singletons and singletons:
-        handle_singletons(
-            singletons, 
-            output_dir, 
-            singletons_subdir, 
-            file_handling, 
-            create_backlinks, 
-            handle_long_paths, 
-            max_path_length, 
-            collision_strategy,
-            dryrun, 
-            logger
-        )
+    if singleton_operations:
+        logger.info(f"Processed {len(singletons)} singleton images")
+        if outputs is not None and not dryrun:
+            for singleton_path, operation in singleton_operations.items():
+                if "actual" in operation:
+                    outputs[singleton_groups[singleton_path]] = [operation["actual"]]
     
     return results
 
+def _plan_singletons(plan, singletons, output_dir, singletons_subdir, file_handling,
+                     create_backlinks, handle_long_paths, max_path_length):
+    """
+    Plan the placement of singleton images.
+    
+    Returns:
+        Dictionary mapping each singleton to its planned operation
+    """
+    singletons_dir = os.path.join(output_dir, singletons_subdir)
+    plan.add_directory(singletons_dir)
+    
+    operations = {}
+    for singleton_path in singletons:
+        singleton_dest = os.path.join(singletons_dir, os.path.basename(singleton_path))
+        
+        # Handle long paths for singleton destination
+        if handle_long_paths and len(singleton_dest) > max_path_length:
+            singleton_dest = _plan_long_path(plan, singleton_dest, max_path_length, {
+                "Original filename": os.path.basename(singleton_path),
+                "Source path": singleton_path
+            })
+        
+        operations[singleton_path] = plan.add_file(singleton_path, singleton_dest, file_handling,
+                                                   create_backlinks, role="singleton")
+    return operations
+
 def handle_singletons(singletons, output_dir, singletons_subdir, file_handling,
                      create_backlinks, handle_long_paths, max_path_length,
-                     collision_strategy, dryrun, logger):
-    """Handle singleton images (with no duplicates)."""
+                     collision_strategy, dryrun, logger, journal=None, num_workers=DEFAULT_OUTPUT_WORKERS):
+    """
+    Handle singleton images (with no duplicates).
+    
+    Returns:
+        Dictionary mapping each handled singleton to its destination
+    """
     if not singletons:
-        return
-        
-    singletons_dir = os.path.join(output_dir, singletons_subdir)
+        return {}
     
-    if not dryrun:
+    plan = OutputPlan(collision_strategy, journal, CollisionIndex(output_dir))
+    operations = _plan_singletons(plan, singletons, output_dir, singletons_subdir, file_handling,
+                                  create_backlinks, handle_long_paths, max_path_length)
+    execute_plan(plan, dryrun=dryrun, num_workers=num_workers, logger=logger)
+    logger.info(f"Processed {len(singletons)} singleton images")
+    
+    if dryrun:
+        return {}
+    return {path: operation["actual"] for path, operation in operations.items() if "actual" in operation}
+
+def remove_outputs(output_paths, dryrun=False, logger=None):
+    """
+    Remove the output files and directories of groups that are being replaced.
+    
+    Files and symlinks are deleted (symlinks are not followed). Directories are
+    removed only once empty, so a directory shared with another group survives.
+    
+    Args:
+        output_paths: Paths recorded by create_output_structure, files before
+            the directories that hold them
+        dryrun: Only log what would be removed
+        logger: Logger instance
+    
+    Returns:
+        Number of paths removed
+    """
+    if logger is None:
+        logger = logging.getLogger("directory_structure")
+    
+    removed = 0
+    for path in output_paths:
+        if dryrun:
+            logger.info(f"Would remove {path}")
+            continue
         try:
-            os.makedirs(singletons_dir, exist_ok=True)
-            logger.info(f"Created singletons directory: {singletons_dir}")
-            
-            for singleton_path in singletons:
-                singleton_dest = os.path.join(singletons_dir, os.path.basename(singleton_path))
-                
-                # Handle long paths for singleton destination
-                if handle_long_paths and len(singleton_dest) > max_path_length:
-                    safe_path, metadata_path = create_safe_path(singleton_dest, max_path_length)
-                    
-                    # Write metadata if path was shortened
-                    if metadata_path:
-                        write_metadata_file(metadata_path, singleton_dest, {
-                            "Original filename": os.path.basename(singleton_path),
-                            "Source path": singleton_path
-                        })
-                    
-                    singleton_dest = safe_path
-                
-                try:
-                    handle_duplicate(singleton_path, singleton_dest, file_handling, create_backlinks, collision_strategy)
-                except Exception as e:
-                    logger.error(f"Failed to process singleton {singleton_path}: {e}")
-            
-            logger.info(f"Processed {len(singletons)} singleton images")
-        except Exception as e:
-            logger.error(f"Failed to process singleton images: {e}")
+            if os.path.islink(path) or os.path.isfile(path):
+                os.remove(path)
+            elif os.path.isdir(path):
+                os.rmdir(path)
+            else:
+                continue
+            removed += 1
+        except OSError as e:
+            logger.debug(f"Kept {path}: {e}")
+    return removed
 
 def collect_best_images(base_dir, output_dir, mode="copy", handle_long_paths=True, 
                        max_path_length=250, include_singletons=True,
@@ -373,6 +441,7 @@ def collect_best_images(base_dir, output_dir, mode="copy", handle_long_paths=Tru
     logger.info(f"Found {len(group_dirs)} group directories to collect from")
     
     collected_count = 0
+    collision_index = CollisionIndex(output_dir)
     
     # Process each group directory to find the best image
     for group_dir in group_dirs:
@@ -409,7 +478,7 @@ def collect_best_images(base_dir, output_dir, mode="copy", handle_long_paths=Tru
         # Handle the file according to the specified mode
         try:
             actual_dest = handle_duplicate(src_path, dest_path, mode=mode, create_backlink=create_backlinks, 
-                                           collision_strategy=collision_strategy)
+                                           collision_strategy=collision_strategy, collision_index=collision_index)
             collected_count += 1
             logger.debug(f"Collected {src_path} to {actual_dest}")
         except Exception as e:
@@ -447,7 +516,7 @@ def collect_best_images(base_dir, output_dir, mode="copy", handle_long_paths=Tru
                 # Handle the file according to the specified mode
                 try:
                     actual_dest = handle_duplicate(src_path, dest_path, mode=mode, create_backlink=create_backlinks,
-                                                  collision_strategy=collision_strategy)
+                                                  collision_strategy=collision_strategy, collision_index=collision_index)
                     collected_count += 1
                     logger.debug(f"Collected singleton {src_path} to {actual_dest}")
                 except Exception as e:
@@ -0,0 +1,533 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2025 Dustin Darcy <ScarcityHypothesis.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+embedding_store.py
+
+Persistent, incremental storage for image embeddings.
+
+Vectors live in one contiguous binary file that is memory-mapped on load, so
+opening a store with a million embeddings does not unpickle anything. A side
+index in JSON lines maps each path to its row, together with the file size and
+modification time used to detect edited files. Both files are append-only; a
+modified image gets a new row and the old one becomes stale until compact().
+
+When content hashing is enabled, each entry also records a hash of the file
+bytes. A path that is new or changed is looked up by that hash before it is
+embedded, so moved, renamed and copied files reuse the stored vector, and
+byte-identical files share a single row.
+
+Perceptual hashes are kept alongside the embeddings in their own side file,
+keyed the same way, so they can be reused without any embedding being stored.
+Region embeddings for --check-regions live in one nested store per region
+type under regions/.
+
+Vectors are stored as float32, float16, or int8 with one float32 scale per
+row (see compact_vectors); int8 rows are dequantized when they are read.
+
+Fast decoding changes the pixels the models and hashes see, so a store only
+holds values from one decode mode. Opening it in the other mode starts a new
+store in its place: vector rows are overwritten and each side file is
+rewritten on its first write.
+
+Store layout:
+    meta.json        - vector dimension, dtype, decode mode and row count
+    vectors.bin      - rows of raw vectors, one per stored embedding
+    scales.bin       - float32 scale of each row, for int8 stores only
+    index.jsonl      - one JSON object per entry: path, size, mtime_ns, hash, row
+    perceptual.jsonl - one JSON object per hash: path, size, mtime_ns, method, value
+    regions/<type>/  - nested store of region embeddings for one region type
+"""
+
+import os
+import json
+import logging
+
+from imagetools import NUMPY_AVAILABLE, np
+from .similarity_tools import embedding_to_numpy
+from .compact_vectors import VECTOR_DTYPES, CompactMatrix, quantize_int8
+from .file_hashing import hash_file
+
+# Global constants
+STORE_VERSION = 1
+STORE_DTYPES = VECTOR_DTYPES
+META_FILENAME = "meta.json"
+VECTORS_FILENAME = "vectors.bin"
+SCALES_FILENAME = "scales.bin"
+INDEX_FILENAME = "index.jsonl"
+PERCEPTUAL_FILENAME = "perceptual.jsonl"
+REGIONS_DIRNAME = "regions"
+
+def get_file_key(file_path, stat_result=None):
+    """Return the (size, mtime_ns) pair used to detect modified files."""
+    if stat_result is None:
+        stat_result = os.stat(file_path)
+    return stat_result.st_size, stat_result.st_mtime_ns
+
+class EmbeddingStore:
+    """
+    Memory-mapped embedding store keyed by (path, size, mtime_ns) and content hash.
+    
+    Args:
+        store_dir: Directory holding the store files (created on first write)
+        dtype: On-disk vector type for a new store ("float32", "float16" or "int8")
+        content_hash: Look up new or changed files by a hash of their bytes
+        fast_decode: Whether the embeddings come from reduced-resolution decoding
+        logger: Logger instance
+    """
+    def __init__(self, store_dir, dtype="float32", content_hash=True, fast_decode=True, logger=None):
+        if not NUMPY_AVAILABLE:
+            raise ImportError("numpy is required for the embedding store")
+        if dtype not in STORE_DTYPES:
+            raise ValueError(f"Unknown embedding store dtype: {dtype}")
+        
+        self.store_dir = store_dir
+        self.logger = logger or logging.getLogger("embedding_store")
+        self.dtype = dtype
+        self.content_hash = content_hash
+        self.fast_decode = fast_decode
+        self.dim = None
+        self.rows = 0
+        self.entries = {}
+        self.hash_rows = {}
+        self.hash_hits = 0
+        self.pending_aliases = {}
+        self._hashes = {}
+        self._vectors = None
+        self._perceptual = None
+        self._replaced_files = set()
+        
+        self._load()
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def __contains__(self, path):
+        return path in self.entries
+    
+    @property
+    def stale_rows(self):
+        """Number of rows no longer referenced by the index."""
+        return self.rows - len({entry["row"] for entry in self.entries.values()})
+    
+    def _path(self, filename):
+        return os.path.join(self.store_dir, filename)
+    
+    def _load(self):
+        """Read metadata and the side index; vectors are mapped lazily."""
+        meta_path = self._path(META_FILENAME)
+        if not os.path.exists(meta_path):
+            return
+        
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except Exception as e:
+            self.logger.warning(f"Ignoring unreadable embedding store metadata {meta_path}: {e}")
+            return
+        
+        if meta.get("version") != STORE_VERSION:
+            self.logger.warning(f"Ignoring embedding store with unsupported version {meta.get('version')}")
+            return
+        
+        # Stores written before the decode mode was recorded used fast decoding, the default
+        stored_fast_decode = meta.get("fast_decode", True)
+        if stored_fast_decode != self.fast_decode:
+            self.logger.warning(f"Embedding store {self.store_dir} holds embeddings from "
+                                f"{'fast' if stored_fast_decode else 'full'} decoding; "
+                                f"replacing it with a store for {'fast' if self.fast_decode else 'full'} decoding")
+            self._replaced_files = {INDEX_FILENAME, PERCEPTUAL_FILENAME}
+            return
+        
+        if meta.get("dtype") != self.dtype:
+            self.logger.info(f"Using existing embedding store dtype {meta.get('dtype')} instead of {self.dtype}")
+        self.dtype = meta["dtype"]
+        self.dim = meta["dim"]
+        
+        # Rows beyond the end of the vector file were never fully written
+        vectors_path = self._path(VECTORS_FILENAME)
+        row_bytes = self.dim * np.dtype(self.dtype).itemsize
+        available_rows = os.path.getsize(vectors_path) // row_bytes if os.path.exists(vectors_path) else 0
+        if self.dtype == "int8":
+            scales_path = self._path(SCALES_FILENAME)
+            scale_rows = os.path.getsize(scales_path) // 4 if os.path.exists(scales_path) else 0
+            available_rows = min(available_rows, scale_rows)
+        
+        index_path = self._path(INDEX_FILENAME)
+        if os.path.exists(index_path):
+            with open(index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Partially written line from an interrupted run
+                    if entry["row"] < available_rows:
+                        self.entries[entry["path"]] = entry
+                        self.rows = max(self.rows, entry["row"] + 1)
+                        if entry.get("hash"):
+                            self.hash_rows[entry["hash"]] = entry["row"]
+        
+        self.logger.info(f"Loaded embedding store with {len(self.entries)} embeddings from {self.store_dir}")
+    
+    def _write_meta(self):
+        os.makedirs(self.store_dir, exist_ok=True)
+        meta = {"version": STORE_VERSION, "dim": self.dim, "dtype": self.dtype,
+                "fast_decode": self.fast_decode, "rows": self.rows}
+        temp_path = self._path(META_FILENAME + ".tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(temp_path, self._path(META_FILENAME))
+    
+    @property
+    def vectors(self):
+        """
+        Read-only memory map of all stored rows (remapped after appends).
+        
+        An int8 store is wrapped in a CompactMatrix, so rows read from it are
+        dequantized float32 vectors.
+        """
+        if self._vectors is None and self.rows:
+            self._vectors = np.memmap(self._path(VECTORS_FILENAME), dtype=self.dtype,
+                                      mode='r', shape=(self.rows, self.dim))
+            if self.dtype == "int8":
+                scales = np.memmap(self._path(SCALES_FILENAME), dtype=np.float32, mode='r', shape=(self.rows,))
+                self._vectors = CompactMatrix(self._vectors, scales)
+        return self._vectors
+    
+    def _append_rows(self, filename, data, row_bytes):
+        """Append rows to one of the vector files, dropping rows from an interrupted write."""
+        path = self._path(filename)
+        expected_bytes = self.rows * row_bytes
+        with open(path, 'ab') as f:
+            if os.path.getsize(path) > expected_bytes:
+                f.truncate(expected_bytes)
+            f.write(data)
+    
+    def _get_hash(self, path, file_key):
+        """Hash a file once per run, rehashing if its (size, mtime_ns) key changes."""
+        cache_key = (path, file_key)
+        if cache_key not in self._hashes:
+            self._hashes[cache_key] = hash_file(path)
+        return self._hashes[cache_key]
+    
+    def _write_entries(self, entries):
+        """Record index entries in memory and append them to the index file."""
+        os.makedirs(self.store_dir, exist_ok=True)
+        with self._open_side_file(INDEX_FILENAME) as f:
+            for entry in entries:
+                self.entries[entry["path"]] = entry
+                if entry.get("hash"):
+                    self.hash_rows[entry["hash"]] = entry["row"]
+                f.write(json.dumps(entry) + "\n")
+    
+    def _open_side_file(self, filename):
+        """Open a side file for appending, or for rewriting on the first write to a replaced store."""
+        mode = 'w' if filename in self._replaced_files else 'a'
+        self._replaced_files.discard(filename)
+        return open(self._path(filename), mode, encoding='utf-8')
+    
+    def lookup(self, path, stat_result=None):
+        """
+        Return the stored vector for a path, or None if missing or stale.
+        
+        A path whose (size, mtime_ns) key does not match is looked up by
+        content hash when hashing is enabled. A hash hit is queued in
+        pending_aliases and written to the index only by save_aliases or
+        append, so lookups never modify the store.
+        
+        Args:
+            path: Image path
+            stat_result: Optional os.stat() result to avoid another stat call
+        """
+        row, alias = self.lookup_row(path, stat_result)
+        if alias is not None:
+            self.pending_aliases[path] = alias
+            self.hash_hits += 1
+        return None if row is None else self.vectors[row]
+    
+    def lookup_row(self, path, stat_result=None):
+        """
+        Find the row of the stored vector for a path without modifying the store.
+        
+        Returns:
+            tuple: (row, alias) where row is None if the path is missing or stale,
+            and alias is the index entry that records a content hash hit (else None)
+        """
+        try:
+            size, mtime_ns = get_file_key(path, stat_result)
+        except OSError:
+            return None, None
+        
+        entry = self.entries.get(path)
+        if entry is not None and entry["size"] == size and entry["mtime_ns"] == mtime_ns:
+            return entry["row"], None
+        
+        if not self.content_hash or not self.hash_rows:
+            return None, None
+        
+        content_hash = self._get_hash(path, (size, mtime_ns))
+        row = self.hash_rows.get(content_hash)
+        if row is None:
+            return None, None
+        return row, {"path": path, "size": size, "mtime_ns": mtime_ns, "hash": content_hash, "row": row}
+    
+    def save_aliases(self, aliases=None):
+        """
+        Write content hash hits to the index so later runs find the paths directly.
+        
+        Args:
+            aliases: Index entries from lookup_row (default: the aliases queued by lookup)
+        
+        Returns:
+            Number of aliases written
+        """
+        if aliases is None:
+            aliases = list(self.pending_aliases.values())
+            self.pending_aliases = {}
+        if aliases:
+            self._write_entries(aliases)
+        return len(aliases)
+    
+    def get_many(self, paths):
+        """
+        Split paths into stored embeddings and paths that still need computing.
+        
+        Returns:
+            tuple: (embeddings, missing) where embeddings maps path to vector
+        """
+        embeddings = {}
+        missing = []
+        self.hash_hits = 0
+        for path in paths:
+            vector = self.lookup(path)
+            if vector is None:
+                missing.append(path)
+            else:
+                embeddings[path] = vector
+        
+        self.logger.info(f"Embedding store: {len(embeddings)} reusable "
+                         f"({self.hash_hits} by content hash), {len(missing)} to compute")
+        return embeddings, missing
+    
+    def append(self, embeddings):
+        """
+        Append new embeddings to the store, along with any queued aliases.
+        
+        Args:
+            embeddings: Dictionary mapping image paths to embeddings
+        
+        Returns:
+            Number of embeddings written
+        """
+        if not embeddings:
+            self.save_aliases()
+            return 0
+        
+        paths = []
+        keys = []
+        for path in embeddings:
+            try:
+                keys.append(get_file_key(path))
+                paths.append(path)
+            except OSError as e:
+                self.logger.warning(f"Not storing embedding for {path}: {e}")
+        
+        if not paths:
+            self.save_aliases()
+            return 0
+        
+        hashes = [self._get_hash(path, key) if self.content_hash else None for path, key in zip(paths, keys)]
+        
+        # Byte-identical files share the row of the first copy stored
+        entries = []
+        new_paths = []
+        pending_rows = {}
+        for path, (size, mtime_ns), content_hash in zip(paths, keys, hashes):
+            entry = {"path": path, "size": size, "mtime_ns": mtime_ns}
+            if content_hash:
+                entry["hash"] = content_hash
+                row = self.hash_rows.get(content_hash, pending_rows.get(content_hash))
+                if row is not None:
+                    entries.append(dict(entry, row=row))
+                    continue
+                pending_rows[content_hash] = self.rows + len(new_paths)
+            entries.append(dict(entry, row=self.rows + len(new_paths)))
+            new_paths.append(path)
+        
+        if new_paths:
+            block = np.stack([embedding_to_numpy(embeddings[path]) for path in new_paths])
+            scales = None
+            if self.dtype == "int8":
+                block, scales = quantize_int8(block)
+            else:
+                block = block.astype(self.dtype)
+            if self.dim is None:
+                self.dim = block.shape[1]
+            elif block.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {block.shape[1]} does not match store dimension {self.dim}")
+            
+            os.makedirs(self.store_dir, exist_ok=True)
+            
+            # Vectors first, index second: an interrupted write leaves only unreferenced rows
+            self._vectors = None
+            self._append_rows(VECTORS_FILENAME, block.tobytes(), self.dim * block.itemsize)
+            if scales is not None:
+                self._append_rows(SCALES_FILENAME, scales.tobytes(), scales.itemsize)
+            
+            self.rows += len(new_paths)
+            self._write_meta()
+        
+        aliases = [alias for path, alias in self.pending_aliases.items() if path not in embeddings]
+        self.pending_aliases = {}
+        self._write_entries(aliases + entries)
+        return len(entries)
+    
+    def region_store(self, region_type):
+        """
+        Return the nested store holding region embeddings of one region type.
+        
+        The nested store shares this store's settings and its per-run content
+        hash cache, so each file is hashed at most once.
+        """
+        store = EmbeddingStore(os.path.join(self.store_dir, REGIONS_DIRNAME, region_type), dtype=self.dtype,
+                               content_hash=self.content_hash, fast_decode=self.fast_decode,
+                               logger=self.logger)
+        store._hashes = self._hashes
+        return store
+    
+    def _load_perceptual(self):
+        """Read the perceptual hash side file on first use."""
+        if self._perceptual is not None:
+            return self._perceptual
+        
+        self._perceptual = {}
+        perceptual_path = self._path(PERCEPTUAL_FILENAME)
+        if os.path.exists(perceptual_path) and PERCEPTUAL_FILENAME not in self._replaced_files:
+            with open(perceptual_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Partially written line from an interrupted run
+                    self._perceptual[(entry["path"], entry["method"])] = entry
+        return self._perceptual
+    
+    def get_perceptual_hashes(self, paths, method):
+        """
+        Split paths into stored perceptual hashes and paths that still need hashing.
+        
+        Args:
+            paths: Image paths
+            method: Perceptual hash method ("ahash", "dhash" or "phash")
+        
+        Returns:
+            tuple: (hashes, missing) where hashes maps path to an integer hash
+        """
+        perceptual = self._load_perceptual()
+        hashes = {}
+        missing = []
+        for path in paths:
+            entry = perceptual.get((path, method))
+            try:
+                size, mtime_ns = get_file_key(path)
+            except OSError:
+                entry = None
+            if entry is not None and entry["size"] == size and entry["mtime_ns"] == mtime_ns:
+                hashes[path] = int(entry["value"], 16)
+            else:
+                missing.append(path)
+        
+        self.logger.info(f"Embedding store: {len(hashes)} reusable {method} hashes, {len(missing)} to compute")
+        return hashes, missing
+    
+    def append_perceptual_hashes(self, hashes, method):
+        """
+        Append perceptual hashes to the store.
+        
+        Args:
+            hashes: Dictionary mapping image paths to integer hashes
+            method: Perceptual hash method the values were computed with
+        
+        Returns:
+            Number of hashes written
+        """
+        perceptual = self._load_perceptual()
+        written = 0
+        os.makedirs(self.store_dir, exist_ok=True)
+        with self._open_side_file(PERCEPTUAL_FILENAME) as f:
+            for path, value in hashes.items():
+                try:
+                    size, mtime_ns = get_file_key(path)
+                except OSError as e:
+                    self.logger.warning(f"Not storing perceptual hash for {path}: {e}")
+                    continue
+                entry = {"path": path, "size": size, "mtime_ns": mtime_ns,
+                         "method": method, "value": format(value, "016x")}
+                perceptual[(path, method)] = entry
+                f.write(json.dumps(entry) + "\n")
+                written += 1
+        return written
+    
+    def compact(self):
+        """Rewrite the store without stale rows."""
+        if not self.stale_rows:
+            return 0
+        
+        removed = self.stale_rows
+        vectors = self.vectors
+        scales = None
+        if isinstance(vectors, CompactMatrix):
+            vectors, scales = vectors.codes, vectors.scales
+        
+        # Renumber live rows in order, keeping shared rows shared
+        new_rows = {}
+        for entry in self.entries.values():
+            new_rows.setdefault(entry["row"], len(new_rows))
+        
+        temp_vectors = self._path(VECTORS_FILENAME + ".tmp")
+        temp_index = self._path(INDEX_FILENAME + ".tmp")
+        with open(temp_vectors, 'wb') as vf, open(temp_index, 'w', encoding='utf-8') as jf:
+            for old_row in new_rows:
+                vf.write(np.ascontiguousarray(vectors[old_row]).tobytes())
+            if scales is not None:
+                temp_scales = self._path(SCALES_FILENAME + ".tmp")
+                np.asarray(scales[list(new_rows)], dtype=np.float32).tofile(temp_scales)
+            for path, entry in self.entries.items():
+                entry = dict(entry, row=new_rows[entry["row"]])
+                jf.write(json.dumps(entry) + "\n")
+                self.entries[path] = entry
+        
+        self.hash_rows = {entry["hash"]: entry["row"] for entry in self.entries.values() if entry.get("hash")}
+        self._vectors = None
+        del vectors, scales
+        os.replace(temp_vectors, self._path(VECTORS_FILENAME))
+        if self.dtype == "int8":
+            os.replace(temp_scales, self._path(SCALES_FILENAME))
+        os.replace(temp_index, self._path(INDEX_FILENAME))
+        self.rows = len(new_rows)
+        self._write_meta()
+        
+        # Drop superseded perceptual hash lines as well
+        if os.path.exists(self._path(PERCEPTUAL_FILENAME)):
+            temp_perceptual = self._path(PERCEPTUAL_FILENAME + ".tmp")
+            with open(temp_perceptual, 'w', encoding='utf-8') as f:
+                for entry in self._load_perceptual().values():
+                    f.write(json.dumps(entry) + "\n")
+            os.replace(temp_perceptual, self._path(PERCEPTUAL_FILENAME))
+        
+        self.logger.info(f"Compacted embedding store, removed {removed} stale rows")
+        return removed
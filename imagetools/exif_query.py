@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2025 Dustin Darcy <ScarcityHypothesis.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+exif_query.py
+
+EXIF reading and filtering without decoding images.
+
+For JPEG files only the APP1 "Exif" segment is read: the reader seeks from
+segment to segment and stops at the first frame or scan header, so neither
+the pixel data nor unrelated segments are touched. The TIFF structure inside
+is parsed by PIL.Image.Exif, and tag ids are mapped to names through
+PIL.ExifTags. Other formats fall back to Image.open, which only parses the
+header.
+
+Predicates select images by tag value:
+    Model             - the tag is present
+    Model=*Canon*     - glob match, case-insensitive (= without wildcards is equality)
+    Model!=*Canon*    - negated match
+    ISO<=400          - numeric comparison (rationals such as 1/250 are accepted)
+    DateTimeOriginal>2020-01-01 - date comparison; EXIF dates are normalized to YYYY-MM-DD HH:MM:SS
+                  and compared only to the precision given, so 2020-01-01 means the whole day
+"""
+
+import re
+import difflib
+import fnmatch
+
+from imagetools import PILLOW_AVAILABLE
+from .image_header import iter_jpeg_segments, JPEG_SOF_MARKERS, JPEG_SOS_MARKER
+
+if PILLOW_AVAILABLE:
+    from PIL import Image, ExifTags
+
+# Global constants
+EXIF_IFD_TAG = 0x8769  # Pointer to the Exif sub-IFD holding DateTimeOriginal, ISO and exposure
+JPEG_APP1_MARKER = 0xE1  # Application segment holding EXIF (or XMP)
+
+# Short names accepted for tags whose EXIF names are long
+TAG_ALIASES = {
+    "ISO": "ISOSpeedRatings",
+    "Camera": "Model",
+    "Lens": "LensModel",
+    "Date": "DateTimeOriginal",
+}
+
+PREDICATE_OPERATORS = ["<=", ">=", "!=", "=", "<", ">"]
+PREDICATE_PATTERN = re.compile(r'^\s*([A-Za-z][A-Za-z0-9]*)\s*(?:(<=|>=|!=|=|<|>)\s*(.*?))?\s*$')
+DATE_PATTERN = re.compile(r'^(\d{4})[:\-/.](\d{2})[:\-/.](\d{2})(?:[ T](\d{2}):(\d{2})(?::(\d{2}))?)?$')
+
+def _jpeg_app1(f):
+    """Read the payload of the Exif APP1 segment of a JPEG, or None."""
+    for marker, length in iter_jpeg_segments(f):
+        # EXIF comes before the image data; stop at the first frame or scan header
+        if marker in JPEG_SOF_MARKERS or marker == JPEG_SOS_MARKER:
+            return None
+        if marker == JPEG_APP1_MARKER:
+            payload = f.read(length)
+            if payload.startswith(b'Exif\x00\x00'):
+                return payload
+    return None
+
+def load_exif(image_path):
+    """
+    Load an image's EXIF without decoding it.
+
+    Returns:
+        PIL.Image.Exif, or None if the image has no EXIF
+    """
+    with open(image_path, 'rb') as f:
+        if f.read(3) == b'\xff\xd8\xff':
+            data = _jpeg_app1(f)
+            if data is None:
+                return None
+            exif = Image.Exif()
+            exif.load(data)
+            return exif
+
+    # Image.open only parses the header; pixel data is never decoded
+    with Image.open(image_path) as img:
+        return img.getexif() or None
+
+def read_exif(image_path, tags=None):
+    """
+    Read an image's EXIF tags by name, from the main IFD and the Exif sub-IFD.
+
+    Args:
+        image_path: Path to the image
+        tags: Optional collection of tag names to keep (default: all)
+
+    Returns:
+        Dictionary mapping PIL.ExifTags names to raw values; empty without EXIF
+    """
+    if not PILLOW_AVAILABLE:
+        return {}
+    exif = load_exif(image_path)
+    if not exif:
+        return {}
+
+    entries = list(exif.items())
+    try:
+        entries.extend(exif.get_ifd(EXIF_IFD_TAG).items())
+    except Exception:
+        pass  # No Exif sub-IFD
+
+    values = {}
+    for tag_id, value in entries:
+        name = ExifTags.TAGS.get(tag_id)
+        if name is not None and name != "ExifOffset" and (tags is None or name in tags):
+            values[name] = value
+    return values
+
+def normalize_date(text):
+    """Rewrite a date such as 2020:01:31 12:00:00 as 2020-01-31 12:00:00, or return None."""
+    match = DATE_PATTERN.match(text)
+    if not match:
+        return None
+    year, month, day, hour, minute, second = match.groups()
+    date = f"{year}-{month}-{day}"
+    if hour is not None:
+        date += f" {hour}:{minute}:{second or '00'}"
+    return date
+
+def parse_number(text):
+    """Parse a number or a rational such as 1/250, or return None."""
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    numerator, slash, denominator = text.partition("/")
+    if slash:
+        try:
+            return float(numerator) / float(denominator)
+        except (ValueError, ZeroDivisionError):
+            return None
+    return None
+
+def exif_value(value):
+    """
+    Convert an EXIF value to a (text, number) pair for comparisons.
+
+    Rationals become floats, byte strings are decoded, dates are normalized,
+    and sequences such as ISOSpeedRatings (1600,) keep their first item.
+    """
+    if isinstance(value, (tuple, list)):
+        if not value:
+            return None, None
+        value = value[0]
+    if isinstance(value, bytes):
+        value = value.decode("utf-8", errors="replace")
+    if isinstance(value, str):
+        text = value.strip("\x00 ").strip()
+        date = normalize_date(text)
+        if date is not None:
+            return date, None
+        return text, parse_number(text)
+    try:
+        number = float(value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return str(value), None
+    return str(value), number
+
+def resolve_tag(name):
+    """
+    Map a tag name or alias to its PIL.ExifTags name.
+
+    Raises:
+        ValueError: If the name is not a known EXIF tag
+    """
+    name = TAG_ALIASES.get(name, name)
+    known = set(ExifTags.TAGS.values()) if PILLOW_AVAILABLE else set()
+    if name in known:
+        return name
+    lowered = {tag.lower(): tag for tag in known}
+    if name.lower() in lowered:
+        return lowered[name.lower()]
+    suggestions = difflib.get_close_matches(name, known, n=3)
+    hint = f"; did you mean {', '.join(suggestions)}?" if suggestions else ""
+    raise ValueError(f"Unknown EXIF tag: {name}{hint}")
+
+class ExifPredicate:
+    """
+    One condition on an EXIF tag, parsed from text such as "ISO<=400".
+
+    Attributes:
+        tag: PIL.ExifTags name of the tag
+        operator: One of PREDICATE_OPERATORS, or None for "the tag is present"
+        value: Comparison value as given
+        kind: "exists", "number", "date" or "text"
+    """
+    def __init__(self, text):
+        match = PREDICATE_PATTERN.match(text)
+        if not match or (match.group(2) and not match.group(3)):
+            raise ValueError(f"Invalid EXIF predicate: {text!r} (expected e.g. Model=*Canon*, ISO<=400)")
+        self.text = text
+        self.tag = resolve_tag(match.group(1))
+        self.operator = match.group(2)
+        self.value = match.group(3)
+
+        if self.operator is None:
+            self.kind = "exists"
+        elif normalize_date(self.value) is not None:
+            self.kind = "date"
+            self.value = normalize_date(self.value)
+        elif parse_number(self.value) is not None:
+            self.kind = "number"
+        else:
+            self.kind = "text"
+            if self.operator not in ("=", "!="):
+                raise ValueError(f"EXIF predicate {text!r} compares text; only = and != are supported")
+
+    def __repr__(self):
+        return f"ExifPredicate({self.text!r})"
+
+    def _holds(self, exif):
+        """Check the predicate with != read as =."""
+        if self.tag not in exif:
+            return False
+        if self.kind == "exists":
+            return True
+
+        text, number = exif_value(exif[self.tag])
+        if text is None:
+            return False
+        operator = "=" if self.operator == "!=" else self.operator
+        if self.kind == "number":
+            return number is not None and self._compare(operator, number, parse_number(self.value))
+        if self.kind == "date":
+            # Compare only as much of the timestamp as the predicate gives, so a date matches the whole day
+            date = normalize_date(text)
+            return date is not None and self._compare(operator, date[:len(self.value)], self.value)
+        return fnmatch.fnmatchcase(text.lower(), self.value.lower())
+
+    @staticmethod
+    def _compare(operator, left, right):
+        return ((operator == "=" and left == right) or (operator == "<" and left < right) or
+                (operator == ">" and left > right) or (operator == "<=" and left <= right) or
+                (operator == ">=" and left >= right))
+
+    def matches(self, exif):
+        """Check the predicate against a dictionary from read_exif; an absent tag differs from any value."""
+        holds = self._holds(exif)
+        return not holds if self.operator == "!=" else holds
+
+    def sql(self, path_column="images.path"):
+        """
+        Express the predicate as an SQL condition on an image index.
+
+        Returns:
+            tuple: (condition, parameters)
+        """
+        condition = f"SELECT 1 FROM exif WHERE exif.path = {path_column} AND exif.tag = ?"
+        params = [self.tag]
+        operator = "=" if self.operator == "!=" else self.operator
+        if self.kind == "number":
+            condition += f" AND exif.num {operator} ?"
+            params.append(parse_number(self.value))
+        elif self.kind == "date":
+            condition += f" AND substr(exif.text, 1, ?) {operator} ?"
+            params.extend([len(self.value), self.value])
+        elif self.kind == "text":
+            # fnmatch-style wildcards are GLOB wildcards; lower() makes the match case-insensitive
+            condition += " AND lower(exif.text) GLOB ?"
+            params.append(self.value.lower())
+        negate = "NOT " if self.operator == "!=" else ""
+        return f"{negate}EXISTS ({condition})", params
+
+def parse_exif_predicates(texts):
+    """
+    Parse predicate strings into ExifPredicate objects.
+
+    Raises:
+        ValueError: If a predicate is malformed or names an unknown tag
+    """
+    return [ExifPredicate(text) for text in texts or []]
+
+def exif_matches(exif, predicates, require_exif=False):
+    """Check that an image's EXIF satisfies every predicate."""
+    if require_exif and not exif:
+        return False
+    return all(predicate.matches(exif) for predicate in predicates)
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2025 Dustin Darcy <ScarcityHypothesis.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+file_hashing.py
+
+Fast content hashing of image files.
+
+Uses xxhash when it is installed and falls back to BLAKE2b from the standard
+library otherwise. Hashes are prefixed with the algorithm name so that values
+produced by different algorithms never compare equal.
+
+Also provides an exact-duplicate pre-pass that narrows candidates by file
+size, then by a hash of the first and last blocks, and only then by a full
+content hash, so most files are never read in full.
+"""
+
+import os
+import hashlib
+import logging
+
+from imagetools import TQDM_AVAILABLE, tqdm
+
+try:
+    import xxhash
+    XXHASH_AVAILABLE = True
+except ImportError:
+    XXHASH_AVAILABLE = False
+
+# Global constants
+HASH_CHUNK_SIZE = 1024 * 1024  # Bytes read per chunk when hashing whole files
+EDGE_BLOCK_SIZE = 64 * 1024    # Bytes read from each end for partial hashes
+
+def get_hash_algorithm():
+    """Return the name of the content hash algorithm in use."""
+    return "xxh3_128" if XXHASH_AVAILABLE else "blake2b"
+
+def _new_hasher():
+    if XXHASH_AVAILABLE:
+        return xxhash.xxh3_128()
+    return hashlib.blake2b(digest_size=16)
+
+def hash_file(file_path, chunk_size=HASH_CHUNK_SIZE):
+    """
+    Hash the full contents of a file by streaming it in chunks.
+    
+    Args:
+        file_path: Path to the file
+        chunk_size: Bytes read per chunk
+    
+    Returns:
+        Hash string of the form "algorithm:hexdigest", or None on error
+    """
+    hasher = _new_hasher()
+    try:
+        with open(file_path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                hasher.update(chunk)
+    except OSError as e:
+        logging.warning(f"Error hashing {file_path}: {e}")
+        return None
+    
+    return f"{get_hash_algorithm()}:{hasher.hexdigest()}"
+
+def hash_file_edges(file_path, block_size=EDGE_BLOCK_SIZE):
+    """
+    Hash the first and last blocks of a file.
+    
+    Cheap filter for the duplicate pre-pass: files with different edge hashes
+    cannot be identical, so only matching files need a full hash.
+    
+    Returns:
+        Hash string, or None on error
+    """
+    hasher = _new_hasher()
+    try:
+        with open(file_path, 'rb') as f:
+            hasher.update(f.read(block_size))
+            size = os.fstat(f.fileno()).st_size
+            if size > 2 * block_size:
+                f.seek(size - block_size)
+                hasher.update(f.read(block_size))
+            elif size > block_size:
+                hasher.update(f.read())
+    except OSError as e:
+        logging.warning(f"Error hashing {file_path}: {e}")
+        return None
+    
+    return hasher.hexdigest()
+
+def _split_buckets(buckets, key_func):
+    """Split each bucket by a key, dropping sub-buckets with a single file."""
+    result = []
+    for bucket in buckets:
+        sub_buckets = {}
+        for path in bucket:
+            key = key_func(path)
+            if key is not None:
+                sub_buckets.setdefault(key, []).append(path)
+        result.extend(b for b in sub_buckets.values() if len(b) > 1)
+    return result
+
+def find_exact_duplicates(image_paths, logger=None, show_progress=True):
+    """
+    Find byte-identical files among a list of paths.
+    
+    Args:
+        image_paths: List of file paths
+        logger: Logger instance
+        show_progress: Whether to show progress bar
+    
+    Returns:
+        Dictionary mapping a representative path (the first occurrence) to the
+        list of its byte-identical duplicates
+    """
+    if logger is None:
+        logger = logging.getLogger("file_hashing")
+    
+    # Stage 1: bucket by size
+    by_size = {}
+    for path in image_paths:
+        try:
+            by_size.setdefault(os.path.getsize(path), []).append(path)
+        except OSError as e:
+            logger.debug(f"Error getting size of {path}: {e}")
+    buckets = [b for b in by_size.values() if len(b) > 1]
+    
+    # Stage 2: bucket by the first and last blocks
+    buckets = _split_buckets(buckets, hash_file_edges)
+    
+    # Stage 3: confirm with a full content hash
+    if show_progress and TQDM_AVAILABLE:
+        buckets = tqdm(buckets, desc="Hashing duplicate candidates")
+    buckets = _split_buckets(buckets, hash_file)
+    
+    duplicates = {bucket[0]: bucket[1:] for bucket in buckets}
+    logger.info(f"Found {sum(len(d) for d in duplicates.values())} exact duplicates "
+                f"of {len(duplicates)} files")
+    return duplicates
+
+def restore_duplicates(groups, duplicates):
+    """
+    Add collapsed duplicates back into the groups of their representatives.
+    
+    Args:
+        groups: List of sets of image paths
+        duplicates: Dictionary from find_exact_duplicates
+    
+    Returns:
+        The same list of groups, updated in place
+    """
+    if not duplicates:
+        return groups
+    
+    for group in groups:
+        for path in list(group):
+            if path in duplicates:
+                group.update(duplicates[path])
+    return groups
@@ -23,8 +23,9 @@ Part of the refactored common_imagetools functionality.
 
 Updates include:
 - Improved filename collision handling with hierarchical resolution
-- Filename registry to prevent any overwrites
+- Per-output-root collision index to prevent any overwrites
 - Enhanced logging for collision operations
+- Copies through the copy engine (reflink, copy_file_range, sendfile)
 """
 
 import os
@@ -33,10 +34,13 @@ import logging
 import shutil
 import hashlib
 import platform
+import threading
 import subprocess
 from datetime import datetime
 from pathlib import Path
 
+from .copy_engine import copy_file
+
 # Global constants
 MAX_PATH_LENGTH = 250  # Default max path length to avoid OS limits
 
@@ -121,7 +125,7 @@ def create_symlink(source, destination):
                     logging.debug(f"Created hard link: {destination} -> {source}")
                 except OSError:
                     # If hard link also fails, fall back to copying
-                    shutil.copy2(source, destination)
+                    copy_file(source, destination)
                     logging.warning(f"Created copy instead of link for {destination}")
         else:
             # Unix-like systems
@@ -132,100 +136,135 @@ def create_symlink(source, destination):
         logging.error(f"Error creating link from {source} to {destination}: {e}")
         # Fall back to copying
         try:
-            shutil.copy2(source, destination)
+            copy_file(source, destination)
             logging.warning(f"Created copy instead of link for {destination}")
         except Exception as copy_error:
             logging.error(f"Error copying file: {copy_error}")
             raise
 
-# Global registry to track filenames and prevent collisions
-# This is a dictionary mapping directories to sets of filenames
-# Example: { '/path/to/dir': {'file1.jpg', 'file2.png'} }
-_filename_registry = {}
+class CollisionIndex:
+    """
+    Names in use below one output root, for resolving filename collisions.
+    
+    Each directory is read by a single os.scandir the first time a name in it
+    is requested; after that every name handed out is tracked in memory, so
+    no further filesystem checks are needed as long as all files placed below
+    the root get their names from this index. Numeric suffixes continue from
+    a per-name counter instead of probing _col_1, _col_2, ... each time. All
+    methods are safe to call from several threads.
+    """
+    def __init__(self, root=None):
+        self.root = root
+        self._names = {}     # Directory -> set of names in use
+        self._counters = {}  # (directory, stem, extension) -> next numeric suffix to try
+        self._lock = threading.Lock()
+    
+    def _directory_names(self, directory):
+        names = self._names.get(directory)
+        if names is None:
+            names = set()
+            try:
+                with os.scandir(directory) as entries:
+                    names.update(entry.name for entry in entries)
+            except OSError:
+                pass  # Not created yet, so nothing in it can collide
+            self._names[directory] = names
+        return names
+    
+    def reserve(self, path):
+        """Mark a path as taken, e.g. a file placed by an earlier run."""
+        directory, filename = os.path.split(path)
+        with self._lock:
+            self._directory_names(directory).add(filename)
+    
+    def _take(self, names, directory, filename):
+        if filename in names:
+            return None
+        names.add(filename)
+        return os.path.join(directory, filename)
+    
+    def _take_numeric(self, names, directory, name, ext):
+        key = (directory, name, ext)
+        counter = self._counters.get(key, 1)
+        while f"{name}_col_{counter}{ext}" in names:
+            counter += 1
+        self._counters[key] = counter + 1
+        return self._take(names, directory, f"{name}_col_{counter}{ext}")
+    
+    def unique_path(self, dest_path, source_path=None, collision_strategy="hierarchical"):
+        """
+        Generate a unique path that doesn't conflict with existing files.
+        Uses a hierarchical approach to generate meaningful unique names.
+        
+        Args:
+            dest_path: The destination path that might have a collision
+            source_path: Original source path (for context in naming)
+            collision_strategy: Strategy for resolving collisions
+                               "hierarchical" (default): use parent dirs, then hash, then numeric
+                               "hash": use hash of source path
+                               "numeric": use incremental numbers
+                               "parent_only": only use parent directory names
+        
+        Returns:
+            A unique path that won't cause collisions
+        """
+        dest_dir, dest_filename = os.path.split(dest_path)
+        name, ext = os.path.splitext(dest_filename)
+        
+        with self._lock:
+            names = self._directory_names(dest_dir)
+            
+            # Check if the destination filename is already in use
+            unique_path = self._take(names, dest_dir, dest_filename)
+            if unique_path:
+                return unique_path
+            
+            # Need to create a unique name based on collision strategy
+            if collision_strategy == "hierarchical" or collision_strategy == "parent_only":
+                # First try: append parent directory name if source path provided
+                if source_path:
+                    parent_dir = os.path.basename(os.path.dirname(source_path))
+                    unique_path = self._take(names, dest_dir, f"{name}_{parent_dir}{ext}")
+                    if unique_path:
+                        return unique_path
+                
+                # For parent_only strategy, move directly to numeric suffixes
+                if collision_strategy == "parent_only":
+                    return self._take_numeric(names, dest_dir, name, ext)
+            
+            # Second try: use hash of source path or fall back to "hash" strategy
+            if collision_strategy == "hierarchical" or collision_strategy == "hash":
+                if source_path:
+                    # Create a hash of the source path for uniqueness
+                    path_hash = hashlib.md5(source_path.encode()).hexdigest()[:8]
+                    unique_path = self._take(names, dest_dir, f"{name}_{path_hash}{ext}")
+                    if unique_path:
+                        return unique_path
+            
+            # Final fallback: use numeric suffixes for all strategies
+            return self._take_numeric(names, dest_dir, name, ext)
+
+# Index used when callers don't pass their own, e.g. by imgsrch
+_default_index = CollisionIndex()
 
-def get_unique_path(dest_path, source_path=None, collision_strategy="hierarchical"):
+def get_unique_path(dest_path, source_path=None, collision_strategy="hierarchical", collision_index=None):
     """
     Generate a unique path that doesn't conflict with existing files.
-    Uses a hierarchical approach to generate meaningful unique names.
     
     Args:
         dest_path: The destination path that might have a collision
         source_path: Original source path (for context in naming)
-        collision_strategy: Strategy for resolving collisions
-                           "hierarchical" (default): use parent dirs, then hash, then numeric
-                           "hash": use hash of source path
-                           "numeric": use incremental numbers
-                           "parent_only": only use parent directory names
+        collision_strategy: Strategy for resolving collisions (see CollisionIndex.unique_path)
+        collision_index: CollisionIndex of the output root (default: a shared index)
     
     Returns:
         A unique path that won't cause collisions
     """
-    dest_dir, dest_filename = os.path.split(dest_path)
-    name, ext = os.path.splitext(dest_filename)
-    
-    # Initialize the registry for this directory if needed
-    if dest_dir not in _filename_registry:
-        _filename_registry[dest_dir] = set()
-        # If the directory exists, add all existing files to the registry
-        if os.path.exists(dest_dir):
-            for existing_file in os.listdir(dest_dir):
-                if os.path.isfile(os.path.join(dest_dir, existing_file)):
-                    _filename_registry[dest_dir].add(existing_file)
-    
-    # Check if the destination filename is already in use
-    if dest_filename not in _filename_registry[dest_dir] and not os.path.exists(dest_path):
-        # Add to registry and return original path
-        _filename_registry[dest_dir].add(dest_filename)
-        return dest_path
-    
-    # Need to create a unique name based on collision strategy
-    if collision_strategy == "hierarchical" or collision_strategy == "parent_only":
-        # First try: append parent directory name if source path provided
-        if source_path:
-            parent_dir = os.path.basename(os.path.dirname(source_path))
-            parent_name = f"{name}_{parent_dir}{ext}"
-            parent_path = os.path.join(dest_dir, parent_name)
-            
-            if parent_name not in _filename_registry[dest_dir] and not os.path.exists(parent_path):
-                _filename_registry[dest_dir].add(parent_name)
-                return parent_path
-        
-        # For parent_only strategy, move directly to numeric suffixes
-        if collision_strategy == "parent_only":
-            counter = 1
-            while True:
-                numeric_name = f"{name}_col_{counter}{ext}"
-                numeric_path = os.path.join(dest_dir, numeric_name)
-                
-                if numeric_name not in _filename_registry[dest_dir] and not os.path.exists(numeric_path):
-                    _filename_registry[dest_dir].add(numeric_name)
-                    return numeric_path
-                counter += 1
-    
-    # Second try: use hash of source path or fall back to "hash" strategy
-    if collision_strategy == "hierarchical" or collision_strategy == "hash":
-        if source_path:
-            # Create a hash of the source path for uniqueness
-            path_hash = hashlib.md5(source_path.encode()).hexdigest()[:8]
-            hash_name = f"{name}_{path_hash}{ext}"
-            hash_path = os.path.join(dest_dir, hash_name)
-            
-            if hash_name not in _filename_registry[dest_dir] and not os.path.exists(hash_path):
-                _filename_registry[dest_dir].add(hash_name)
-                return hash_path
-    
-    # Final fallback: use numeric suffixes for all strategies
-    counter = 1
-    while True:
-        numeric_name = f"{name}_col_{counter}{ext}"
-        numeric_path = os.path.join(dest_dir, numeric_name)
-        
-        if numeric_name not in _filename_registry[dest_dir] and not os.path.exists(numeric_path):
-            _filename_registry[dest_dir].add(numeric_name)
-            return numeric_path
-        counter += 1
+    index = collision_index if collision_index is not None else _default_index
+    return index.unique_path(dest_path, source_path, collision_strategy)
 
-def handle_duplicate(source_path, dest_path, mode="copy", create_backlink=False, collision_strategy="hierarchical"):
+def handle_duplicate(source_path, dest_path, mode="copy", create_backlink=False, collision_strategy="hierarchical",
+                     collision_index=None):
     """
     Handle a duplicate file by resolving name collisions clearly.
     Uses a hierarchical approach for naming to avoid overwrites.
@@ -236,21 +275,22 @@ def handle_duplicate(source_path, dest_path, mode="copy", create_backlink=False,
         mode: "copy", "symlink", or "move"
         create_backlink: Create a link back to the new location if moving
         collision_strategy: Strategy for resolving name collisions
+        collision_index: CollisionIndex of the output root (default: a shared index)
     """
     try:
         # Create destination directory if needed
         os.makedirs(os.path.dirname(dest_path), exist_ok=True)
 
         # Get a unique destination path that won't cause collisions
-        unique_dest_path = get_unique_path(dest_path, source_path, collision_strategy)
+        unique_dest_path = get_unique_path(dest_path, source_path, collision_strategy, collision_index)
         
         # Log if path was changed due to collision
         if unique_dest_path != dest_path:
             logging.info(f"Filename collision: {os.path.basename(dest_path)} -> {os.path.basename(unique_dest_path)}")
         
         if mode == "copy":
-            shutil.copy2(source_path, unique_dest_path)
-            logging.debug(f"Copied {source_path} to {unique_dest_path}")
+            method = copy_file(source_path, unique_dest_path)
+            logging.debug(f"Copied {source_path} to {unique_dest_path} ({method})")
         elif mode == "symlink":
             create_symlink(source_path, unique_dest_path)
             logging.debug(f"Created symlink at {unique_dest_path} pointing to {source_path}")
@@ -305,6 +345,6 @@ def get_target_of_link(path):
         return None
 
 def reset_filename_registry():
-    """Reset the filename registry, primarily for testing."""
-    global _filename_registry
-    _filename_registry = {}
\ No newline at end of file
+    """Reset the shared collision index, primarily for testing."""
+    global _default_index
+    _default_index = CollisionIndex()
\ No newline at end of file
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2025 Dustin Darcy <ScarcityHypothesis.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+grouping_state.py
+
+Persistent grouping state for incremental updates.
+
+A full run saves its groups as a union-find parent array, together with the
+normalized embedding of every grouped image and the (size, mtime_ns) key of
+each file. An update run compares the discovered files against these keys,
+compares only new and modified images against the saved vectors, and
+regroups only the groups that gained or lost members. Every other group keeps
+its output files untouched.
+
+State layout:
+    state.json  - paths, file keys, settings and the output files of each group
+    parents.npy - union-find parent array, the root index of every path
+    vectors.npy - L2-normalized embeddings, one row per path
+"""
+
+import os
+import json
+import logging
+
+from imagetools import NUMPY_AVAILABLE, np
+from .similarity_tools import (
+    DisjointSet, build_embedding_matrix, iter_similar_pairs, iter_query_pairs, DEFAULT_TILE_SIZE
+)
+from .embedding_store import get_file_key
+
+# Global constants
+STATE_VERSION = 1
+STATE_FILENAME = "state.json"
+PARENTS_FILENAME = "parents.npy"
+VECTORS_FILENAME = "vectors.npy"
+MISSING_FILE_KEY = (-1, -1)  # Never matches a real file, so the image is regrouped
+
+def _normalize_settings(settings):
+    """Round-trip settings through JSON so saved and current settings compare equal."""
+    return json.loads(json.dumps(settings or {}, sort_keys=True))
+
+class GroupingState:
+    """
+    Groups of a previous run, with what is needed to update them.
+
+    Attributes:
+        paths: Image paths; the position of a path is its index
+        keys: (size, mtime_ns) of each image when it was grouped
+        vectors: L2-normalized embedding matrix aligned with paths (memory-mapped after load)
+        disjoint_set: DisjointSet over path indices
+        settings: Options the groups and their outputs depend on
+        outputs: Dictionary mapping the root index of a group to its output paths
+    """
+    def __init__(self, paths, keys, vectors, disjoint_set, settings=None, outputs=None, logger=None):
+        if not NUMPY_AVAILABLE:
+            raise ImportError("numpy is required for the grouping state")
+
+        self.paths = list(paths)
+        self.index = {path: idx for idx, path in enumerate(self.paths)}
+        self.keys = [tuple(key) for key in keys]
+        self.vectors = vectors
+        self.disjoint_set = disjoint_set
+        self.settings = _normalize_settings(settings)
+        self.outputs = outputs or {}
+        self.logger = logger or logging.getLogger("grouping_state")
+
+    def __len__(self):
+        return len(self.paths)
+
+    @classmethod
+    def from_groups(cls, groups, embeddings, settings=None, logger=None):
+        """
+        Build the state of a full run.
+
+        Args:
+            groups: List of sets of image paths, as returned by group_similar_images
+            embeddings: Dictionary mapping every grouped image to its embedding
+            settings: Options the groups and their outputs depend on
+            logger: Logger instance
+        """
+        paths = []
+        parent = []
+        for group in groups:
+            root = len(paths)
+            for path in sorted(group):
+                paths.append(path)
+                parent.append(root)
+
+        missing = [path for path in paths if path not in embeddings]
+        if missing:
+            raise ValueError(f"{len(missing)} grouped images have no embedding, e.g. {missing[0]}")
+
+        keys = []
+        for path in paths:
+            try:
+                keys.append(get_file_key(path))
+            except OSError:
+                keys.append(MISSING_FILE_KEY)
+
+        _, vectors = build_embedding_matrix(embeddings, paths)
+        return cls(paths, keys, vectors, DisjointSet.from_parents(parent), settings=settings, logger=logger)
+
+    @classmethod
+    def load(cls, state_dir, logger=None):
+        """
+        Load a saved state.
+
+        Returns:
+            GroupingState, or None if there is no usable state in state_dir
+        """
+        logger = logger or logging.getLogger("grouping_state")
+        state_path = os.path.join(state_dir, STATE_FILENAME)
+        if not os.path.exists(state_path):
+            return None
+
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get("version") != STATE_VERSION:
+                logger.warning(f"Ignoring grouping state with unsupported version {state.get('version')}")
+                return None
+
+            parents = np.load(os.path.join(state_dir, PARENTS_FILENAME))
+            vectors = np.load(os.path.join(state_dir, VECTORS_FILENAME), mmap_mode='r')
+            if not (len(state["paths"]) == len(state["keys"]) == len(parents) == vectors.shape[0]):
+                logger.warning(f"Ignoring inconsistent grouping state in {state_dir}")
+                return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable grouping state in {state_dir}: {e}")
+            return None
+
+        outputs = {int(root): paths for root, paths in state.get("outputs", {}).items()}
+        logger.info(f"Loaded grouping state with {len(state['paths'])} images from {state_dir}")
+        return cls(state["paths"], state["keys"], vectors, DisjointSet.from_parents(parents),
+                   settings=state.get("settings"), outputs=outputs, logger=logger)
+
+    def save(self, state_dir):
+        """Write the state; each file is replaced atomically, state.json last."""
+        os.makedirs(state_dir, exist_ok=True)
+
+        def replace(filename, write):
+            temp_path = os.path.join(state_dir, filename + ".tmp")
+            with open(temp_path, 'wb') as f:
+                write(f)
+            os.replace(temp_path, os.path.join(state_dir, filename))
+
+        replace(VECTORS_FILENAME, lambda f: np.save(f, np.asarray(self.vectors, dtype=np.float32)))
+        replace(PARENTS_FILENAME, lambda f: np.save(f, np.asarray(self.disjoint_set.parents(), dtype=np.int64)))
+
+        state = {
+            "version": STATE_VERSION,
+            "paths": self.paths,
+            "keys": self.keys,
+            "settings": self.settings,
+            "outputs": {str(root): paths for root, paths in self.outputs.items()}
+        }
+        replace(STATE_FILENAME, lambda f: f.write(json.dumps(state).encode('utf-8')))
+        self.logger.debug(f"Saved grouping state with {len(self.paths)} images to {state_dir}")
+
+    def matches(self, settings):
+        """Check whether the state was saved with the same settings."""
+        return self.settings == _normalize_settings(settings)
+
+    def groups(self):
+        """Return the groups as sets of paths, ordered by their first path."""
+        return [{self.paths[idx] for idx in members} for members in self.disjoint_set.groups()]
+
+    def set_group_outputs(self, group_outputs):
+        """
+        Record the output paths created for groups.
+
+        Args:
+            group_outputs: Dictionary mapping group indices, as positions in
+                groups(), to lists of output paths
+        """
+        members = self.disjoint_set.groups()
+        for group_idx, paths in group_outputs.items():
+            self.outputs[self.disjoint_set.find(members[group_idx][0])] = list(paths)
+
+    def diff(self, image_paths):
+        """
+        Compare discovered images with the saved file keys.
+
+        Args:
+            image_paths: Images found by the current run
+
+        Returns:
+            tuple: (added, removed) where added holds new and modified images
+            and removed holds removed and modified images
+        """
+        current = set(image_paths)
+        removed = [path for path in self.paths if path not in current]
+        added = []
+        for path in image_paths:
+            idx = self.index.get(path)
+            try:
+                key = get_file_key(path)
+            except OSError:
+                if idx is not None:
+                    removed.append(path)
+                continue
+
+            if idx is None:
+                added.append(path)
+            elif key != self.keys[idx]:
+                added.append(path)
+                removed.append(path)
+        return added, removed
+
+    def update(self, added_embeddings, removed, threshold, tile_size=DEFAULT_TILE_SIZE):
+        """
+        Apply a diff to the groups.
+
+        Removed images are dropped and the remaining members of their groups
+        are compared again, since a group can only split when it loses a
+        member. Added images are compared against every kept image and
+        against each other. Groups untouched by either keep their outputs.
+
+        Args:
+            added_embeddings: Dictionary mapping new and modified images to their embeddings
+            removed: Removed and modified images from diff()
+            threshold: Similarity threshold the groups were built with
+            tile_size: Rows per block for the similarity engine
+
+        Returns:
+            tuple: (groups, affected, stale_outputs) with the updated groups as
+            sets of paths, the indices of the groups that changed, and the
+            output paths of the old groups they replace
+        """
+        num_old = len(self.paths)
+        old_parent = np.asarray(self.disjoint_set.parents(), dtype=np.int64)
+        removed_mask = np.zeros(num_old, dtype=bool)
+        removed_mask[[self.index[path] for path in set(removed) if path in self.index]] = True
+        keep = np.flatnonzero(~removed_mask)
+        num_kept = len(keep)
+        new_index = np.full(num_old, -1, dtype=np.int64)
+        new_index[keep] = np.arange(num_kept)
+
+        # A path that is still grouped can't be added twice
+        added_paths = [path for path in added_embeddings
+                       if path not in self.index or removed_mask[self.index[path]]]
+        added_paths, added_matrix = build_embedding_matrix(added_embeddings, added_paths)
+        total = num_kept + len(added_paths)
+
+        # Groups that lost a member are regrouped; all others keep their membership
+        split_mask = np.zeros(num_old, dtype=bool)
+        split_mask[old_parent[removed_mask]] = True
+        parent = np.arange(total, dtype=np.int64)
+        intact = keep[~split_mask[old_parent[keep]]]
+        parent[new_index[intact]] = new_index[old_parent[intact]]
+        disjoint_set = DisjointSet.from_parents(parent)
+
+        split_members = keep[split_mask[old_parent[keep]]]
+        members_by_root = {}
+        for idx in split_members.tolist():
+            members_by_root.setdefault(int(old_parent[idx]), []).append(idx)
+        for members in members_by_root.values():
+            if len(members) > 1:
+                members = np.array(members, dtype=np.int64)
+                matrix = np.asarray(self.vectors[members], dtype=np.float32)
+                for rows, cols, _ in iter_similar_pairs(matrix, threshold, tile_size=tile_size):
+                    disjoint_set.union_pairs(new_index[members[rows]], new_index[members[cols]])
+
+        # Query only the added vectors: against the kept images, then against each other
+        if added_paths:
+            if num_old:
+                for rows, cols, _ in iter_query_pairs(added_matrix, self.vectors, threshold, tile_size=tile_size):
+                    alive = ~removed_mask[cols]
+                    disjoint_set.union_pairs(rows[alive] + num_kept, new_index[cols[alive]])
+            for rows, cols, _ in iter_similar_pairs(added_matrix, threshold, tile_size=tile_size):
+                disjoint_set.union_pairs(rows + num_kept, cols + num_kept)
+
+        # A group changed if it holds an added image or a member of a split group
+        labels = np.asarray(disjoint_set.parents(), dtype=np.int64)
+        touched = np.zeros(total, dtype=bool)
+        touched[labels[num_kept:]] = True
+        touched[labels[new_index[split_members]]] = True
+
+        group_members = disjoint_set.groups()
+        affected = []
+        stale_roots = set(old_parent[removed_mask].tolist())
+        outputs = {}
+        for group_idx, members in enumerate(group_members):
+            root = int(labels[members[0]])
+            if touched[root]:
+                affected.append(group_idx)
+                stale_roots.update(int(old_parent[keep[idx]]) for idx in members if idx < num_kept)
+            elif int(old_parent[keep[members[0]]]) in self.outputs:
+                outputs[root] = self.outputs[int(old_parent[keep[members[0]]])]
+        stale_outputs = [path for root in sorted(stale_roots) for path in self.outputs.get(root, [])]
+
+        self.logger.info(f"Updated groups: {len(added_paths)} images added, {int(removed_mask.sum())} removed, "
+                         f"{len(affected)} of {len(group_members)} groups changed")
+
+        # Replace the state with the updated groups
+        kept_paths = [self.paths[idx] for idx in keep.tolist()]
+        kept_keys = [self.keys[idx] for idx in keep.tolist()]
+        added_keys = []
+        for path in added_paths:
+            try:
+                added_keys.append(get_file_key(path))
+            except OSError:
+                added_keys.append(MISSING_FILE_KEY)
+
+        kept_vectors = np.asarray(self.vectors[keep], dtype=np.float32)
+        if added_paths:
+            vectors = np.concatenate([kept_vectors.reshape(num_kept, added_matrix.shape[1]), added_matrix])
+        else:
+            vectors = kept_vectors
+
+        self.paths = kept_paths + added_paths
+        self.index = {path: idx for idx, path in enumerate(self.paths)}
+        self.keys = kept_keys + added_keys
+        self.vectors = vectors
+        self.disjoint_set = disjoint_set
+        self.outputs = outputs
+
+        groups = [{self.paths[idx] for idx in members} for members in group_members]
+        return groups, affected, stale_outputs
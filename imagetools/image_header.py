@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2025 Dustin Darcy <ScarcityHypothesis.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+image_header.py
+
+Image dimensions read straight from the file header.
+
+PNG, GIF, BMP and WebP store their size in the first few dozen bytes, and
+JPEG in its SOF segment, which is reached by seeking from segment to segment
+without reading the segments in between (EXIF thumbnails, ICC profiles).
+This is much cheaper than Image.open, which builds a Python image object and
+parses every header segment. Other formats fall back to Pillow.
+"""
+
+import struct
+
+from imagetools import PILLOW_AVAILABLE
+
+if PILLOW_AVAILABLE:
+    from PIL import Image
+
+# Global constants
+HEADER_BYTES = 32  # Enough for the PNG, GIF, BMP and WebP size fields
+MAX_JPEG_SEGMENTS = 256  # Give up on a JPEG after this many segments
+
+# Start-of-frame markers carry the image size; C4 (DHT), C8 (JPG) and CC (DAC) do not
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# Markers without a length field
+JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8}
+JPEG_EOI_MARKER = 0xD9  # End of image
+JPEG_SOS_MARKER = 0xDA  # Start of scan; entropy-coded data follows its header
+
+def parse_header(header):
+    """
+    Read the size of a PNG, GIF, BMP or WebP image from its first bytes.
+
+    Returns:
+        tuple: (width, height, format) with Pillow's format names, or None
+        if the header is not one of these formats
+    """
+    if header[:8] == b'\x89PNG\r\n\x1a\n' and header[12:16] == b'IHDR':
+        width, height = struct.unpack(">II", header[16:24])
+        return width, height, "PNG"
+
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        width, height = struct.unpack("<HH", header[6:10])
+        return width, height, "GIF"
+
+    if header[:2] == b'BM' and len(header) >= 26:
+        dib_size = struct.unpack("<I", header[14:18])[0]
+        if dib_size == 12:  # OS/2 BITMAPCOREHEADER
+            width, height = struct.unpack("<HH", header[18:22])
+        else:
+            width, height = struct.unpack("<ii", header[18:26])
+        return abs(width), abs(height), "BMP"  # Negative height means top-down rows
+
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP' and len(header) >= 30:
+        chunk = header[12:16]
+        if chunk == b'VP8 ':
+            width, height = struct.unpack("<HH", header[26:30])
+            return width & 0x3FFF, height & 0x3FFF, "WEBP"
+        if chunk == b'VP8L':
+            bits = struct.unpack("<I", header[21:25])[0]
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1, "WEBP"
+        if chunk == b'VP8X':
+            width = int.from_bytes(header[24:27], "little") + 1
+            height = int.from_bytes(header[27:30], "little") + 1
+            return width, height, "WEBP"
+
+    return None
+
+def iter_jpeg_segments(f):
+    """
+    Walk the segments of an open JPEG file, seeking over their payloads.
+
+    Yields (marker, length) with the file positioned at the start of the
+    segment payload; length excludes the two length bytes. The consumer may
+    read from the payload, and the walk continues at the end of the segment.
+    Standalone markers are skipped. The walk ends at the end of image, after
+    the start of scan (the entropy-coded data is not made of segments), at a
+    truncated segment header, or after MAX_JPEG_SEGMENTS segments.
+    """
+    f.seek(2)
+    for _ in range(MAX_JPEG_SEGMENTS):
+        byte = f.read(1)
+        while byte and byte != b'\xff':  # Skip garbage between segments
+            byte = f.read(1)
+        while byte == b'\xff':  # Skip fill bytes
+            byte = f.read(1)
+        if not byte:
+            return
+
+        marker = byte[0]
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        if marker == JPEG_EOI_MARKER:
+            return
+
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return
+        length = struct.unpack(">H", length_bytes)[0] - 2
+        start = f.tell()
+        yield marker, length
+        if marker == JPEG_SOS_MARKER:
+            return
+        f.seek(start + length)
+
+def _read_jpeg_size(f):
+    """Find the SOF segment of a JPEG, seeking over the other segments."""
+    for marker, _ in iter_jpeg_segments(f):
+        if marker in JPEG_SOF_MARKERS:
+            frame = f.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack(">HH", frame[1:5])
+            return width, height
+    return None
+
+def read_header_size(image_path):
+    """
+    Read an image's size from its header without Pillow.
+
+    Returns:
+        tuple: (width, height, format), or None for other formats and
+        headers that can't be parsed
+    """
+    with open(image_path, 'rb') as f:
+        header = f.read(HEADER_BYTES)
+        if header[:3] == b'\xff\xd8\xff':
+            size = _read_jpeg_size(f)
+            return (size[0], size[1], "JPEG") if size else None
+        return parse_header(header)
+
+def read_image_size(image_path):
+    """
+    Read an image's size from its header, falling back to Pillow.
+
+    Returns:
+        tuple: (width, height, format)
+
+    Raises:
+        OSError: If the file can't be read or isn't an image Pillow can open
+    """
+    size = read_header_size(image_path)
+    if size is not None and size[0] > 0 and size[1] > 0:
+        return size
+
+    if not PILLOW_AVAILABLE:
+        raise OSError(f"Unsupported image header and Pillow is not available: {image_path}")
+    # Image.open only parses the header; pixel data is never decoded
+    with Image.open(image_path) as img:
+        return img.size[0], img.size[1], img.format
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2025 Dustin Darcy <ScarcityHypothesis.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+image_index.py
+
+Persistent SQLite index of image dimensions and selected EXIF tags.
+
+A refresh stats every file it is given and reads only the files whose size or
+modification time changed since they were indexed, so repeated searches over
+the same trees cost a directory walk and a stat per file instead of opening
+every image. Dimension and EXIF filters then become SQL range queries over
+indexed columns.
+
+Database layout:
+    images - path, size, mtime_ns, width, height, format, has_exif; indexed on
+             width and height. has_exif is set for any EXIF, indexed tags or not
+    exif   - path, tag, text and numeric value of each indexed EXIF tag;
+             indexed on (tag, num) and (tag, text)
+"""
+
+import os
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from .image_header import read_image_size
+from .exif_query import read_exif, exif_value
+
+# Global constants
+INDEX_VERSION = 3  # 2: EXIF dates stored as YYYY-MM-DD HH:MM:SS, 3: has_exif column
+DEFAULT_INDEX_WORKERS = min(32, (os.cpu_count() or 1) * 4)  # Reads wait on I/O, not CPU
+WRITE_BATCH_SIZE = 1000  # Rows written per transaction during a refresh
+
+# EXIF tags stored in the index, by their PIL.ExifTags name
+INDEXED_EXIF_TAGS = [
+    "Make", "Model", "LensModel", "Software", "Orientation", "DateTime", "DateTimeOriginal",
+    "ISOSpeedRatings", "FNumber", "ExposureTime", "FocalLength", "Flash"
+]
+
+COMPARISON_OPERATORS = {"gt": ">", "lt": "<", "eq": "=", "gte": ">=", "lte": "<=", "neq": "!="}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    format TEXT,
+    has_exif INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS images_width ON images (width);
+CREATE INDEX IF NOT EXISTS images_height ON images (height);
+CREATE TABLE IF NOT EXISTS exif (
+    path TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    text TEXT,
+    num REAL,
+    PRIMARY KEY (path, tag)
+);
+CREATE INDEX IF NOT EXISTS exif_num ON exif (tag, num);
+CREATE INDEX IF NOT EXISTS exif_text ON exif (tag, text);
+"""
+
+def read_exif_tags(image_path, tags=INDEXED_EXIF_TAGS):
+    """
+    Read selected EXIF tags of an image by name.
+
+    Returns:
+        Dictionary mapping tag names to their raw values
+    """
+    return read_exif(image_path, set(tags))
+
+def read_index_entry(image_path, stat=None):
+    """
+    Read what the index stores about one image. Runs in the refresh pool.
+
+    Returns:
+        tuple: (path, size, mtime_ns, width, height, format, has_exif, exif)
+        where width, height and format are None for unreadable images, has_exif
+        tells whether the image has any EXIF and exif holds its indexed tags
+    """
+    if stat is None:
+        stat = os.stat(image_path)
+    try:
+        width, height, fmt = read_image_size(image_path)
+    except Exception as e:
+        logging.debug(f"Error reading image header for {image_path}: {e}")
+        return image_path, stat.st_size, stat.st_mtime_ns, None, None, None, False, {}
+    try:
+        exif = read_exif(image_path)
+    except Exception as e:
+        logging.debug(f"Error reading EXIF of {image_path}: {e}")
+        exif = {}
+    indexed = {tag: value for tag, value in exif.items() if tag in INDEXED_EXIF_TAGS}
+    return image_path, stat.st_size, stat.st_mtime_ns, width, height, fmt, bool(exif), indexed
+
+class ImageIndex:
+    """
+    SQLite index of image sizes and EXIF tags, refreshed from stat data.
+
+    Attributes:
+        db_path: Path of the database file
+    """
+    def __init__(self, db_path, logger=None):
+        self.db_path = db_path
+        self.logger = logger or logging.getLogger("image_index")
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.executescript(SCHEMA)
+            row = self.connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if row is not None and int(row[0]) != INDEX_VERSION:
+                # Dropped rather than emptied, since the layout may have changed
+                self.logger.warning(f"Rebuilding image index {db_path} with unsupported version {row[0]}")
+                self.connection.execute("DROP TABLE images")
+                self.connection.execute("DROP TABLE exif")
+                self.connection.executescript(SCHEMA)
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(INDEX_VERSION),))
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def _root_clause(self, root):
+        """SQL condition and parameters selecting the paths below a directory."""
+        if root is None:
+            return "1", []
+        # A range over the primary key: every path starting with the prefix sorts between these bounds
+        prefix = os.path.join(os.path.abspath(root), "")
+        return "images.path >= ? AND images.path < ?", [prefix, prefix + "\U0010ffff"]
+
+    def _stored_stats(self, root):
+        clause, params = self._root_clause(root)
+        rows = self.connection.execute(f"SELECT path, size, mtime_ns FROM images WHERE {clause}", params)
+        return {path: (size, mtime_ns) for path, size, mtime_ns in rows}
+
+    def _write(self, entries):
+        with self._lock, self.connection:
+            paths = [(entry[0],) for entry in entries]
+            self.connection.executemany("DELETE FROM exif WHERE path = ?", paths)
+            self.connection.executemany("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                        [entry[:7] for entry in entries])
+            rows = []
+            for entry in entries:
+                for tag, value in entry[7].items():
+                    text, number = exif_value(value)
+                    if text is not None:
+                        rows.append((entry[0], tag, text, number))
+            self.connection.executemany("INSERT INTO exif VALUES (?, ?, ?, ?)", rows)
+
+    def remove(self, paths):
+        """Drop images from the index."""
+        with self._lock, self.connection:
+            rows = [(path,) for path in paths]
+            self.connection.executemany("DELETE FROM images WHERE path = ?", rows)
+            self.connection.executemany("DELETE FROM exif WHERE path = ?", rows)
+
+    def refresh(self, image_paths, root=None, num_workers=DEFAULT_INDEX_WORKERS, prune=True):
+        """
+        Bring the index up to date for a set of images.
+
+        Every path is stat'ed; only new files and files whose size or
+        modification time changed are read. Files are stat'ed and read in a
+        thread pool while image_paths is still being produced.
+
+        Args:
+            image_paths: Iterable of image paths, e.g. a directory walk
+            root: Directory the paths were found in; with prune, indexed
+                images below it that were not seen are removed
+            num_workers: Files stat'ed and read in parallel
+            prune: Whether to remove deleted images below root
+
+        Returns:
+            tuple: (paths, updated) with the absolute paths seen, in the order
+            they were given, and the number of images that were (re)read
+        """
+        stored = self._stored_stats(root)
+
+        def check(path):
+            stat = os.stat(path)
+            if stored.get(path) == (stat.st_size, stat.st_mtime_ns):
+                return None
+            return read_index_entry(path, stat)
+
+        seen = []
+        batch = []
+        updated = 0
+
+        def collect(future):
+            nonlocal updated
+            try:
+                entry = future.result()
+            except OSError as e:
+                self.logger.debug(f"Error indexing image: {e}")
+                return
+            if entry is not None:
+                batch.append(entry)
+                updated += 1
+            if len(batch) >= WRITE_BATCH_SIZE:
+                self._write(batch)
+                batch.clear()
+
+        with ThreadPoolExecutor(max_workers=max(1, num_workers)) as executor:
+            pending = set()
+            for path in image_paths:
+                path = os.path.abspath(path)
+                seen.append(path)
+                pending.add(executor.submit(check, path))
+                if len(pending) >= num_workers * 4:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future)
+            for future in pending:
+                collect(future)
+        if batch:
+            self._write(batch)
+
+        # Unseen files may only have been filtered out; drop the ones that are gone
+        if prune and root is not None:
+            vanished = [path for path in set(stored) - set(seen) if not os.path.exists(path)]
+            if vanished:
+                self.remove(vanished)
+                self.logger.debug(f"Removed {len(vanished)} vanished images from the index")
+        return seen, updated
+
+    def paths(self, root=None):
+        """Return the indexed paths below a directory, sorted."""
+        clause, params = self._root_clause(root)
+        rows = self.connection.execute(f"SELECT path FROM images WHERE {clause} ORDER BY path", params)
+        return [row[0] for row in rows]
+
+    def query(self, root=None, width=None, height=None, both=None, eitheror=None, operation="eq",
+              exif_predicates=None, require_exif=False):
+        """
+        Find indexed images whose dimensions and EXIF tags satisfy the criteria.
+
+        The dimension criteria mean the same as imgsrch's -W, -H, -B and -O
+        options. exif_predicates are ExifPredicate objects on tags in
+        INDEXED_EXIF_TAGS; require_exif keeps only images with any EXIF, as
+        in a scan.
+
+        Returns:
+            List of (path, width, height) tuples sorted by path
+        """
+        op = COMPARISON_OPERATORS[operation]
+        clause, params = self._root_clause(root)
+        conditions = [clause, "images.width IS NOT NULL"]
+        if width:
+            conditions.append(f"images.width {op} ?")
+            params.append(width)
+        if height:
+            conditions.append(f"images.height {op} ?")
+            params.append(height)
+        if both:
+            conditions.append(f"images.width {op} ? AND images.height {op} ?")
+            params.extend([both, both])
+        if eitheror:
+            conditions.append(f"(images.width {op} ? OR images.height {op} ?)")
+            params.extend([eitheror, eitheror])
+        if require_exif:
+            conditions.append("images.has_exif")
+        for predicate in exif_predicates or []:
+            if predicate.tag not in INDEXED_EXIF_TAGS:
+                raise ValueError(f"EXIF tag {predicate.tag} is not indexed")
+            condition, predicate_params = predicate.sql()
+            conditions.append(condition)
+            params.extend(predicate_params)
+
+        sql = f"SELECT path, width, height FROM images WHERE {' AND '.join(conditions)} ORDER BY path"
+        return self.connection.execute(sql, params).fetchall()
+
+    def get_exif(self, image_path):
+        """Return the indexed EXIF tags of an image as a dictionary of text values."""
+        rows = self.connection.execute("SELECT tag, text FROM exif WHERE path = ?", (os.path.abspath(image_path),))
+        return dict(rows)
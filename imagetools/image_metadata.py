@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2025 Dustin Darcy <ScarcityHypothesis.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+image_metadata.py
+
+Single-pass metadata probe and per-run metadata table.
+
+Each image is opened once: one os.stat call and one header read give the
+dimensions, format, mode, EXIF capture time and file times. Results are kept in
+a NumPy structured array indexed by image id, so quality metrics read columns
+instead of reopening files. This matters most on network file systems, where
+every open is a round trip.
+"""
+
+import os
+import logging
+import platform
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from imagetools import (
+    PILLOW_AVAILABLE,
+    Image
+)
+from imagetools import NUMPY_AVAILABLE, np
+from imagetools import TQDM_AVAILABLE, tqdm
+from .core_imagetools import FILE_FORMAT_QUALITY
+
+# Global constants
+EXIF_DATETIME_ORIGINAL = 0x9003  # DateTimeOriginal, in the Exif IFD
+EXIF_DATETIME = 0x0132           # DateTime, in IFD0
+EXIF_IFD_POINTER = 0x8769
+EXIF_DATETIME_FORMAT = "%Y:%m:%d %H:%M:%S"
+
+if NUMPY_AVAILABLE:
+    METADATA_DTYPE = np.dtype([
+        ("width", np.int32),
+        ("height", np.int32),
+        ("format", "U8"),
+        ("mode", "U8"),
+        ("format_quality", np.int16),
+        ("size", np.int64),
+        ("mtime", np.float64),
+        ("created", np.float64),
+        ("exif_time", np.float64),   # NaN when the image has no EXIF timestamp
+        ("valid", np.bool_)
+    ])
+else:
+    METADATA_DTYPE = None
+
+def _parse_exif_datetime(value):
+    """Convert an EXIF date string to a timestamp, or NaN if it can't be parsed."""
+    try:
+        return datetime.strptime(str(value).strip("\x00 "), EXIF_DATETIME_FORMAT).timestamp()
+    except (ValueError, TypeError):
+        return float("nan")
+
+def read_exif_time(img):
+    """EXIF capture time of an open image as a timestamp, or NaN if it has none."""
+    exif = img.getexif()
+    value = exif.get_ifd(EXIF_IFD_POINTER).get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME)
+    return _parse_exif_datetime(value) if value else float("nan")
+
+def get_created_time(stat_result):
+    """Creation time from an os.stat result, the fallback of get_image_created_time."""
+    if platform.system() == "Windows":
+        return stat_result.st_ctime
+    # On Unix, creation time is not always available; use the earlier of mtime and ctime
+    return min(stat_result.st_mtime, stat_result.st_ctime)
+
+def probe_image(image_path):
+    """
+    Read the metadata of one image with a single stat and a single header read.
+
+    Args:
+        image_path: Path to the image
+
+    Returns:
+        Tuple in METADATA_DTYPE field order
+    """
+    ext = os.path.splitext(image_path)[1].lower()
+    format_quality = FILE_FORMAT_QUALITY.get(ext, 0)
+    size = 0
+    mtime = created = 0.0
+    width = height = 0
+    image_format = mode = ""
+    exif_time = float("nan")
+    valid = False
+
+    try:
+        stat_result = os.stat(image_path)
+        size = stat_result.st_size
+        mtime = stat_result.st_mtime
+        created = get_created_time(stat_result)
+    except OSError as e:
+        logging.warning(f"Error reading file information for {image_path}: {e}")
+        return (width, height, image_format, mode, format_quality, size, mtime, created, exif_time, valid)
+
+    if PILLOW_AVAILABLE:
+        try:
+            # Image.open only parses the header; pixel data is never decoded
+            with Image.open(image_path) as img:
+                width, height = img.size
+                image_format = img.format or ""
+                mode = img.mode
+                exif_time = read_exif_time(img)
+                valid = True
+        except Exception as e:
+            logging.warning(f"Error reading image header for {image_path}: {e}")
+
+    return (width, height, image_format, mode, format_quality, size, mtime, created, exif_time, valid)
+
+class MetadataTable:
+    """
+    Columnar metadata for the images of one run, indexed by image id.
+
+    Attributes:
+        paths: List of image paths; the position of a path is its image id
+        data: NumPy structured array with one METADATA_DTYPE row per image
+    """
+    def __init__(self, paths=None, data=None):
+        if not NUMPY_AVAILABLE:
+            raise ImportError("numpy is required for the metadata table")
+
+        self.paths = list(paths or [])
+        self.index = {path: idx for idx, path in enumerate(self.paths)}
+        self.data = data if data is not None else np.zeros(len(self.paths), dtype=METADATA_DTYPE)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __contains__(self, path):
+        return path in self.index
+
+    @classmethod
+    def probe(cls, image_paths, num_workers=1, show_progress=False, skip_report=None):
+        """
+        Probe a list of images into a new table.
+
+        Args:
+            image_paths: Image paths (duplicates are probed once)
+            num_workers: Threads probing in parallel; helps on network file systems
+            show_progress: Whether to show progress bar
+            skip_report: Optional SkipReport recording images whose header can't be read
+        """
+        paths = list(dict.fromkeys(image_paths))
+        num_workers = max(1, min(num_workers or 1, len(paths) or 1))
+
+        if num_workers > 1:
+            executor = ThreadPoolExecutor(max_workers=num_workers)
+            rows = executor.map(probe_image, paths, chunksize=64)
+        else:
+            executor = None
+            rows = map(probe_image, paths)
+
+        if show_progress and TQDM_AVAILABLE:
+            rows = tqdm(rows, total=len(paths), desc="Reading image metadata")
+
+        try:
+            data = np.array(list(rows), dtype=METADATA_DTYPE)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        if skip_report is not None:
+            for idx in np.flatnonzero(~data["valid"]):
+                skip_report.add(paths[idx], "metadata", "could not read image header")
+
+        return cls(paths, data)
+
+    def ids(self, paths):
+        """Return the image ids of a list of paths as an array."""
+        return np.fromiter((self.index[path] for path in paths), dtype=np.int64, count=len(paths))
+
+    def row(self, path):
+        """Return the metadata row of one image."""
+        return self.data[self.index[path]]
+
+    def get_dimensions(self, path):
+        """Return (width, height) of an image."""
+        row = self.row(path)
+        return int(row["width"]), int(row["height"])
+
+    def get_quality_values(self, ids, metric="dimensions", date_preference="newest"):
+        """
+        Quality values for a set of images, matching get_image_quality.
+
+        Args:
+            ids: Array of image ids
+            metric: Quality metric to use
+            date_preference: For date metrics, prefer "newest" or "oldest"
+
+        Returns:
+            float64 array of quality values (higher is better)
+        """
+        rows = self.data[ids]
+        if metric == "filesize":
+            values = rows["size"]
+        elif metric in ("modified_date", "created_date"):
+            if metric == "modified_date":
+                values = rows["mtime"]
+            else:
+                # The EXIF capture time survives copies that reset file times
+                values = np.where(np.isnan(rows["exif_time"]), rows["created"], rows["exif_time"])
+            # Invert value if we prefer oldest files (smaller timestamp = older)
+            if date_preference == "oldest":
+                values = -values
+        elif metric == "format_quality":
+            values = rows["format_quality"]
+        elif metric == "dimensions":
+            # Use the minimum dimension as the quality metric
+            values = np.minimum(rows["width"], rows["height"])
+        else:
+            # Total pixel count (also the default)
+            values = rows["width"].astype(np.int64) * rows["height"]
+        return values.astype(np.float64)
+
+    def get_quality(self, path, metric="dimensions", date_preference="newest"):
+        """Quality value of one image, matching get_image_quality."""
+        return self.get_quality_values(np.array([self.index[path]]), metric, date_preference)[0].item()
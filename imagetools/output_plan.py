@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2025 Dustin Darcy <ScarcityHypothesis.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+output_plan.py
+
+Planner/executor split for writing the output structure.
+
+The planner works in memory: it resolves every destination path and name
+collision against a CollisionIndex of the output root and collects the
+directories to create, without touching the files. The executor then creates
+all directories in one pass and runs the copies, links and moves in a thread
+pool. Operations on the same source file run in plan order in one task, so a
+copy of the best image always happens before a later move of that image.
+
+Every completed operation is written to the output journal. On a resumed run,
+operations that are already in the journal are skipped. A dry run writes the
+planned operations in the same format as its report, and --undo uses the
+journal to reverse a run.
+"""
+
+import os
+import shutil
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from imagetools import TQDM_AVAILABLE, tqdm
+from .copy_engine import copy_file
+from .file_operations import CollisionIndex, create_symlink, write_metadata_file
+
+# Global constants
+DEFAULT_OUTPUT_WORKERS = 8  # File operations in flight; they wait on I/O, not CPU
+FILE_MODES = ["copy", "symlink", "move"]
+
+class OutputPlan:
+    """
+    File operations and directories planned in memory before any of them runs.
+
+    Each operation is a dictionary with the keys "mode" (a FILE_MODES entry
+    or "metadata"), "source", "dest" (the requested destination), "target"
+    (the destination after collision handling), "backlink", "group", "role"
+    and, for metadata files, "info". The executor adds "actual" on success
+    and "error" on failure, and "method" for copies (see copy_engine).
+    """
+    def __init__(self, collision_strategy="hierarchical", journal=None, collision_index=None):
+        self.collision_strategy = collision_strategy
+        self.journal = journal
+        self.collision_index = collision_index if collision_index is not None else CollisionIndex()
+        self.directories = {}  # Insertion-ordered set
+        self.operations = []
+
+    def __len__(self):
+        return len(self.operations)
+
+    def add_directory(self, path):
+        """Plan a directory; parents are created along with it."""
+        self.directories[path] = None
+
+    def add_file(self, source, dest, mode, create_backlink=False, group=None, role=None):
+        """
+        Plan a copy, link or move and resolve its destination name.
+
+        Returns:
+            The operation dictionary
+        """
+        if mode not in FILE_MODES:
+            raise ValueError(f"Unknown duplicate handling mode: {mode}")
+
+        # An operation journaled by an interrupted run keeps the destination it used
+        done = self.journal.get(source, dest) if self.journal is not None else None
+        if done is not None:
+            target = done
+            self.collision_index.reserve(target)
+        else:
+            target = self.collision_index.unique_path(dest, source, self.collision_strategy)
+            if target != dest:
+                logging.info(f"Filename collision: {os.path.basename(dest)} -> {os.path.basename(target)}")
+
+        self.add_directory(os.path.dirname(target))
+        operation = {"mode": mode, "source": source, "dest": dest, "target": target,
+                     "backlink": create_backlink and mode == "move", "group": group, "role": role,
+                     "done": done is not None}
+        self.operations.append(operation)
+        return operation
+
+    def add_metadata(self, metadata_path, original_path, info, group=None):
+        """Plan the metadata file that records the original name of a shortened path."""
+        self.add_directory(os.path.dirname(metadata_path))
+        self.collision_index.reserve(metadata_path)
+        operation = {"mode": "metadata", "source": original_path, "dest": metadata_path, "target": metadata_path,
+                     "backlink": False, "group": group, "role": "metadata", "info": info,
+                     "done": self.journal is not None and self.journal.get(original_path, metadata_path) is not None}
+        self.operations.append(operation)
+        return operation
+
+def _run_operation(operation, journal):
+    """Carry out one planned operation and journal it."""
+    mode = operation["mode"]
+    source = operation["source"]
+    target = operation["target"]
+
+    method = None
+    if mode == "copy":
+        method = copy_file(source, target)
+    elif mode == "symlink":
+        create_symlink(source, target)
+    elif mode == "move":
+        shutil.move(source, target)
+        # Optionally create a link back to the new location
+        if operation["backlink"]:
+            create_symlink(target, source)
+    elif mode == "metadata":
+        if not write_metadata_file(target, source, operation["info"]):
+            raise OSError(f"Could not write metadata file {target}")
+
+    if journal is not None:
+        journal.record(source, operation["dest"], mode, target, method=method)
+    operation["actual"] = target
+    if method is not None:
+        operation["method"] = method
+
+def _run_chain(operations, journal, logger):
+    """Run the operations on one source file in order."""
+    for operation in operations:
+        if operation["done"]:
+            operation["actual"] = operation["target"]
+            continue
+        try:
+            _run_operation(operation, journal)
+            logger.debug(f"{operation['mode']}: {operation['source']} -> {operation['target']}")
+        except Exception as e:
+            operation["error"] = str(e)
+            logger.error(f"Error handling {operation['source']} -> {operation['target']} "
+                         f"(mode={operation['mode']}): {e}")
+    return len(operations)
+
+def execute_plan(plan, dryrun=False, num_workers=DEFAULT_OUTPUT_WORKERS, show_progress=False, logger=None):
+    """
+    Create the planned directories and run the planned operations.
+
+    Args:
+        plan: OutputPlan to execute
+        dryrun: Only write the planned operations to the plan's journal
+        num_workers: File operations run in parallel
+        show_progress: Whether to show progress bar
+        logger: Logger instance
+
+    Returns:
+        Number of operations that failed
+    """
+    if logger is None:
+        logger = logging.getLogger("output_plan")
+    journal = plan.journal
+
+    if dryrun:
+        for operation in plan.operations:
+            operation["actual"] = operation["target"]
+            if journal is not None and not operation["done"]:
+                journal.record(operation["source"], operation["dest"], operation["mode"], operation["target"],
+                               planned=True)
+        logger.info(f"Dry run: planned {len(plan.operations)} file operations in {len(plan.directories)} directories")
+        return 0
+
+    # Create every directory up front, parents before children
+    for directory in sorted(plan.directories):
+        if os.path.isdir(directory):
+            continue
+        try:
+            os.makedirs(directory, exist_ok=True)
+            if journal is not None:
+                journal.record_directory(directory)
+        except OSError as e:
+            logger.error(f"Failed to create directory {directory}: {e}")
+
+    # Operations on the same source run in one task, in plan order
+    chains = {}
+    for idx, operation in enumerate(plan.operations):
+        key = operation["source"] if operation["mode"] in FILE_MODES else ("metadata", idx)
+        chains.setdefault(key, []).append(operation)
+
+    progress = None
+    if show_progress and TQDM_AVAILABLE:
+        progress = tqdm(total=len(plan.operations), desc="Writing output files")
+
+    num_workers = max(1, min(num_workers or 1, len(chains) or 1))
+    if num_workers == 1:
+        for operations in chains.values():
+            count = _run_chain(operations, journal, logger)
+            if progress is not None:
+                progress.update(count)
+    else:
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = [executor.submit(_run_chain, operations, journal, logger) for operations in chains.values()]
+            for future in futures:
+                count = future.result()
+                if progress is not None:
+                    progress.update(count)
+
+    if progress is not None:
+        progress.close()
+
+    failed = sum(1 for operation in plan.operations if "error" in operation)
+    logger.debug(f"Ran {len(plan.operations) - failed} of {len(plan.operations)} file operations")
+    return failed
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2025 Dustin Darcy <ScarcityHypothesis.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+pattern_set.py
+
+Include/exclude filters compiled once per run.
+
+All patterns of a role (directory include, directory exclude, file include,
+file exclude) are translated into one combined regular expression, so
+filtering a name is a single regex call however many patterns were given.
+Globs match the whole name like fnmatch; regexes match anywhere in the name
+like re.search. Excluded directory paths are matched with one regex anchored
+at the start of the path and ending on a path separator.
+
+Used by find_images and by imgsrch.py, so both tools filter the same way.
+"""
+
+import os
+import re
+import fnmatch
+import logging
+
+from .directory_crawler import PathTrie
+
+# Backreferences are numbered per expression, so these patterns can't be combined
+_BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=')
+
+def _compile_patterns(patterns, pattern_mode="glob"):
+    """
+    Compile a list of patterns into one matching function.
+
+    Returns:
+        Function taking a name and returning True if any pattern matches,
+        or None if no patterns were given
+    """
+    if not patterns:
+        return None
+
+    if pattern_mode == "regex":
+        expressions = []
+        separate = []
+        for pattern in patterns:
+            try:
+                compiled = re.compile(pattern)
+            except re.error as e:
+                logging.warning(f"Error matching pattern '{pattern}' with mode '{pattern_mode}': {e}")
+                continue
+            if _BACKREFERENCE.search(pattern):
+                separate.append(compiled)
+            else:
+                expressions.append(f"(?:{pattern})")
+
+        combined = []
+        if expressions:
+            try:
+                combined = [re.compile("|".join(expressions))]
+            except re.error:
+                # Patterns that only compile on their own (e.g. inline global flags)
+                combined = [re.compile(expression) for expression in expressions]
+        searches = [compiled.search for compiled in combined + separate]
+        if not searches:
+            # Patterns were given but none are usable, so nothing matches
+            return lambda name: False
+        if len(searches) == 1:
+            return lambda name: searches[0](name) is not None
+        return lambda name: any(search(name) is not None for search in searches)
+
+    # Glob (also the default); normcase like fnmatch.fnmatch
+    combined = re.compile("|".join(fnmatch.translate(os.path.normcase(pattern)) for pattern in patterns))
+    return lambda name: combined.match(os.path.normcase(name)) is not None
+
+class PatternSet:
+    """
+    Compiled include/exclude filters for directory and file names.
+
+    A directory passes if it matches no directory exclude pattern and, when
+    given, a directory include pattern (or else a general include pattern).
+    A file passes if it matches no file exclude pattern and, when given, a
+    file include pattern and a general include pattern. General exclude
+    patterns apply to both directories and files.
+
+    Attributes:
+        exclude_paths: Absolute directories skipped with everything below them
+    """
+    def __init__(self, include_dirs=None, exclude_dirs=None, include_files=None, exclude_files=None,
+                 include_pattern=None, exclude_pattern=None, exclude_paths=None, pattern_mode="glob"):
+        general_exclude = list(exclude_pattern or [])
+        self.pattern_mode = pattern_mode
+        self._dir_include = _compile_patterns(include_dirs or include_pattern, pattern_mode)
+        self._dir_exclude = _compile_patterns(list(exclude_dirs or []) + general_exclude, pattern_mode)
+        self._file_include = _compile_patterns(include_files, pattern_mode)
+        self._file_general_include = _compile_patterns(include_pattern, pattern_mode)
+        self._file_exclude = _compile_patterns(list(exclude_files or []) + general_exclude, pattern_mode)
+
+        self.exclude_paths = [os.path.normcase(os.path.abspath(path)) for path in exclude_paths or []]
+        self._path_exclude = None
+        if self.exclude_paths:
+            prefixes = "|".join(re.escape(path.rstrip(os.sep)) for path in self.exclude_paths)
+            self._path_exclude = re.compile(f"(?:{prefixes})(?:{re.escape(os.sep)}|$)")
+
+    def match_dir(self, name):
+        """Check whether a directory name passes the filters."""
+        if self._dir_exclude is not None and self._dir_exclude(name):
+            return False
+        return self._dir_include is None or self._dir_include(name)
+
+    def match_file(self, name):
+        """Check whether a file name passes the filters."""
+        if self._file_exclude is not None and self._file_exclude(name):
+            return False
+        if self._file_include is not None and not self._file_include(name):
+            return False
+        return self._file_general_include is None or self._file_general_include(name)
+
+    def is_excluded_path(self, path):
+        """Check whether a directory lies in (or is) one of the excluded paths."""
+        if self._path_exclude is None:
+            return False
+        return self._path_exclude.match(os.path.normcase(os.path.abspath(path))) is not None
+
+    def exclude_trie(self):
+        """Return the excluded paths as a PathTrie for crawl_directory."""
+        return PathTrie(self.exclude_paths)
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2025 Dustin Darcy <ScarcityHypothesis.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+perceptual_hash.py
+
+Perceptual hashes (aHash, dHash, pHash) as a cheap prefilter before CLIP.
+
+Each hash is a 64-bit integer computed from a small grayscale thumbnail, and
+the Hamming distance between two hashes approximates visual difference. Pairs
+that are obviously the same or obviously unrelated can be decided by hash
+alone, leaving only the uncertain band for CLIP similarity. A BK-tree finds
+all pairs within a distance without comparing every pair.
+"""
+
+import logging
+
+from imagetools import (
+    PILLOW_AVAILABLE,
+    Image
+)
+from imagetools import NUMPY_AVAILABLE, np
+from imagetools import TQDM_AVAILABLE, tqdm
+from .decode_pipeline import open_image
+
+# Global constants
+HASH_METHODS = ["ahash", "dhash", "phash"]
+HASH_SIZE = 8                    # Hashes are HASH_SIZE * HASH_SIZE bits
+PHASH_IMAGE_SIZE = 32            # Thumbnail size for the pHash DCT
+HASH_DECODE_SIZE = 64            # Smallest size decoded before the final resize
+DEFAULT_SAME_DISTANCE = 4        # At or below: decided as the same image
+DEFAULT_UNRELATED_DISTANCE = 22  # Above: decided as unrelated images
+
+_dct_matrix = None
+
+def _get_dct_matrix(size=PHASH_IMAGE_SIZE):
+    """Return the orthonormal DCT-II matrix used by pHash."""
+    global _dct_matrix
+    if _dct_matrix is None or _dct_matrix.shape[0] != size:
+        k = np.arange(size)[:, None]
+        n = np.arange(size)[None, :]
+        matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2.0 / size)
+        matrix[0] /= np.sqrt(2.0)
+        _dct_matrix = matrix
+    return _dct_matrix
+
+def _bits_to_int(bits):
+    """Pack a boolean array into an integer, most significant bit first."""
+    return int.from_bytes(np.packbits(bits.reshape(-1)).tobytes(), "big")
+
+def hash_image(img, method="phash"):
+    """
+    Compute a perceptual hash of an already opened PIL image.
+
+    Args:
+        img: PIL Image
+        method: "ahash", "dhash" or "phash"
+
+    Returns:
+        64-bit integer hash
+    """
+    if not NUMPY_AVAILABLE:
+        raise ImportError("numpy is required for perceptual hashing")
+
+    gray = img.convert("L")
+    if method == "ahash":
+        pixels = np.asarray(gray.resize((HASH_SIZE, HASH_SIZE), Image.Resampling.LANCZOS), dtype=np.float32)
+        return _bits_to_int(pixels > pixels.mean())
+    elif method == "dhash":
+        pixels = np.asarray(gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.LANCZOS), dtype=np.float32)
+        return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+    elif method == "phash":
+        pixels = np.asarray(gray.resize((PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE), Image.Resampling.LANCZOS),
+                            dtype=np.float32)
+        dct = _get_dct_matrix()
+        low_freq = (dct @ pixels @ dct.T)[:HASH_SIZE, :HASH_SIZE]
+        return _bits_to_int(low_freq > np.median(low_freq))
+    else:
+        raise ValueError(f"Unknown perceptual hash method: {method}")
+
+def _hash_file(image_path, method, fast_decode):
+    """Compute the perceptual hash of an image file, raising on error."""
+    with open_image(image_path, min_size=HASH_DECODE_SIZE, mode="L", fast_decode=fast_decode) as img:
+        return hash_image(img, method)
+
+def compute_perceptual_hash(image_path, method="phash", fast_decode=True):
+    """Compute the perceptual hash of an image file, or None on error."""
+    if not PILLOW_AVAILABLE:
+        raise ImportError("PIL/Pillow is required for image processing")
+
+    try:
+        return _hash_file(image_path, method, fast_decode)
+    except Exception as e:
+        logging.warning(f"Error computing perceptual hash for {image_path}: {e}")
+        return None
+
+def compute_perceptual_hashes(image_paths, method="phash", show_progress=True, fast_decode=True,
+                              skip_report=None):
+    """
+    Compute perceptual hashes for a list of images.
+
+    Args:
+        skip_report: Optional SkipReport recording images that could not be decoded
+
+    Returns:
+        Dictionary mapping image paths to integer hashes (failed images are skipped)
+    """
+    if not PILLOW_AVAILABLE:
+        raise ImportError("PIL/Pillow is required for image processing")
+
+    if show_progress and TQDM_AVAILABLE:
+        iterator = tqdm(image_paths, desc=f"Computing {method} hashes")
+    else:
+        iterator = image_paths
+
+    hashes = {}
+    for image_path in iterator:
+        try:
+            hashes[image_path] = _hash_file(image_path, method, fast_decode)
+        except Exception as e:
+            logging.warning(f"Error computing perceptual hash for {image_path}: {e}")
+            if skip_report is not None:
+                skip_report.add(image_path, "perceptual_hash", e)
+    return hashes
+
+def hamming_distance(hash_a, hash_b):
+    """Number of differing bits between two integer hashes."""
+    return bin(hash_a ^ hash_b).count("1")
+
+class BKTree:
+    """
+    Burkhard-Keller tree over integer hashes with the Hamming metric.
+
+    Items with identical hashes share a node, so collections with many exact
+    copies stay shallow.
+    """
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, value, item):
+        """Add an item under its hash value."""
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+
+        node = self.root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """
+        Find all items within max_distance of a hash value.
+
+        Returns:
+            List of (item, distance) tuples
+        """
+        if self.root is None:
+            return []
+
+        results = []
+        stack = [self.root]
+        while stack:
+            node_value, items, children = stack.pop()
+            distance = hamming_distance(value, node_value)
+            if distance <= max_distance:
+                results.extend((item, distance) for item in items)
+
+            # Triangle inequality: only children in this band can hold matches
+            low = distance - max_distance
+            high = distance + max_distance
+            for child_distance, child in children.items():
+                if low <= child_distance <= high:
+                    stack.append(child)
+        return results
+
+def _iter_tree_pairs(tree, hashes, paths, max_distance):
+    """Yield (path_a, path_b, distance) for each unordered pair within max_distance."""
+    position = {path: idx for idx, path in enumerate(paths)}
+    for path in paths:
+        for other, distance in tree.search(hashes[path], max_distance):
+            # Report each unordered pair once
+            if position[other] > position[path]:
+                yield path, other, distance
+
+class UncertainPairs:
+    """
+    The uncertain band of classify_hash_pairs, generated on each iteration.
+
+    The pairs are never held in memory: iterating searches the BK-tree again
+    and yields (path_a, path_b) tuples as they are found, so a caller can
+    score them in blocks.
+
+    Attributes:
+        images: Set of paths that take part in at least one uncertain pair
+        count: Number of uncertain pairs
+    """
+    def __init__(self, tree, hashes, paths, same_distance, unrelated_distance, images, count):
+        self._tree = tree
+        self._hashes = hashes
+        self._paths = paths
+        self.same_distance = same_distance
+        self.unrelated_distance = unrelated_distance
+        self.images = images
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for path_a, path_b, distance in _iter_tree_pairs(self._tree, self._hashes, self._paths,
+                                                         self.unrelated_distance):
+            if distance > self.same_distance:
+                yield path_a, path_b
+
+def classify_hash_pairs(hashes, same_distance=DEFAULT_SAME_DISTANCE,
+                        unrelated_distance=DEFAULT_UNRELATED_DISTANCE, logger=None):
+    """
+    Split image pairs into hash-decided and uncertain bands.
+
+    Pairs farther apart than unrelated_distance are never returned; they are
+    decided as unrelated without any further comparison. The BK-tree is
+    searched at radius unrelated_distance, so a same_distance above it has
+    no effect.
+
+    Complexity: building the tree takes about n log n distance computations.
+    The searches prune subtrees by the triangle inequality, which works well
+    for small radii but not for large ones: for unrelated images a search at
+    the default radius of 22 of 64 bits visits nearly every node, so
+    classification costs about n^2 / 2 Hamming distances (one XOR and
+    popcount each). That is quadratic, but far cheaper than the CLIP
+    comparisons it rules out. Memory is O(n) plus the same pairs; the
+    uncertain band is counted here and generated again when iterated, which
+    repeats the searches once.
+
+    Args:
+        hashes: Dictionary mapping image paths to integer hashes
+        same_distance: Pairs at or below this distance are the same image
+        unrelated_distance: Pairs above this distance are unrelated
+        logger: Logger instance
+
+    Returns:
+        tuple: (same_pairs, uncertain_pairs) where same_pairs is a list of
+        (path_a, path_b) and uncertain_pairs is an UncertainPairs iterable
+    """
+    if logger is None:
+        logger = logging.getLogger("perceptual_hash")
+
+    paths = list(hashes.keys())
+    tree = BKTree()
+    for path in paths:
+        tree.add(hashes[path], path)
+
+    same_pairs = []
+    uncertain_images = set()
+    uncertain_count = 0
+    for path, other, distance in _iter_tree_pairs(tree, hashes, paths, unrelated_distance):
+        if distance <= same_distance:
+            same_pairs.append((path, other))
+        else:
+            uncertain_images.update((path, other))
+            uncertain_count += 1
+
+    total_pairs = len(paths) * (len(paths) - 1) // 2
+    logger.info(f"Perceptual hash tier: {len(same_pairs)} same, {uncertain_count} uncertain, "
+                f"{total_pairs - len(same_pairs) - uncertain_count} unrelated pairs")
+    return same_pairs, UncertainPairs(tree, hashes, paths, same_distance, unrelated_distance,
+                                      uncertain_images, uncertain_count)
@@ -25,10 +25,12 @@ Updates include:
 - Hybrid evaluation supporting ordered and weighted metrics
 - Enhanced date-based metric evaluation with configurable preferences
 - Improved metric handling for diverse use cases
+- Vectorized best-image selection for all groups at once
 """
 
 import os
 import sys
+import math
 import logging
 import platform
 import time
@@ -38,6 +40,7 @@ from imagetools import (
     PILLOW_AVAILABLE, 
     Image
 )
+from imagetools import NUMPY_AVAILABLE, np
 
 # Try importing optional dependencies
 # try:
@@ -48,6 +51,7 @@ from imagetools import (
 
 # Import from our modules
 from .core_imagetools import FILE_FORMAT_QUALITY, get_image_dimensions
+from .image_metadata import read_exif_time
 
 # Default weights for metrics
 DEFAULT_METRIC_WEIGHTS = {
@@ -76,7 +80,16 @@ def get_image_modified_time(image_path):
         return 0
 
 def get_image_created_time(image_path):
-    """Get the creation time of an image."""
+    """Get the creation time of an image, preferring its EXIF capture time."""
+    if PILLOW_AVAILABLE:
+        try:
+            with Image.open(image_path) as img:
+                exif_time = read_exif_time(img)
+            if not math.isnan(exif_time):
+                return exif_time
+        except Exception:
+            pass  # Fall back to the file time
+    
     try:
         if platform.system() == "Windows":
             return os.path.getctime(image_path)
@@ -89,7 +102,7 @@ def get_image_created_time(image_path):
         logging.warning(f"Error getting creation time for {image_path}: {e}")
         return 0
 
-def get_image_quality(image_path, metric="dimensions", date_preference="newest"):
+def get_image_quality(image_path, metric="dimensions", date_preference="newest", metadata=None):
     """
     Determine image quality based on a metric.
     
@@ -97,10 +110,14 @@ def get_image_quality(image_path, metric="dimensions", date_preference="newest")
         image_path: Path to the image file
         metric: Quality metric to use
         date_preference: For date metrics, prefer "newest" or "oldest"
+        metadata: Optional MetadataTable; images in it are not reopened
     
     Returns:
         A numeric quality value (higher is better)
     """
+    if metadata is not None and image_path in metadata:
+        return metadata.get_quality(image_path, metric, date_preference)
+
     if not PILLOW_AVAILABLE and metric in ["dimensions", "resolution"]:
         raise ImportError("PIL/Pillow is required for image processing")
         
@@ -162,7 +179,7 @@ def get_metric_overrides(metric_overrides_str):
 
 def find_best_image_hybrid(image_group, primary_metrics=None, secondary_metrics=None, 
                           metric_weights=None, date_preference="newest", 
-                          metric_overrides=None, margin_threshold=0.05, logger=None):
+                          metric_overrides=None, margin_threshold=0.05, logger=None, metadata=None):
     """
     Select the best image using a hybrid approach of ordered primary metrics followed by
     weighted evaluation of secondary metrics for ties.
@@ -176,6 +193,7 @@ def find_best_image_hybrid(image_group, primary_metrics=None, secondary_metrics=
         metric_overrides: Dictionary of per-metric preference overrides
         margin_threshold: Tolerance percentage for considering weighted values equal
         logger: Optional logger for debug output
+        metadata: Optional MetadataTable holding every image of the group
         
     Returns:
         The path to the best image
@@ -184,6 +202,12 @@ def find_best_image_hybrid(image_group, primary_metrics=None, secondary_metrics=
         logger = logging.getLogger("quality_metrics")
         
     candidates = list(image_group)
+
+    def get_qualities(images, metric, metric_date_pref):
+        """Quality values of several images, read from the metadata table when possible."""
+        if metadata is not None and all(img in metadata for img in images):
+            return metadata.get_quality_values(metadata.ids(images), metric, metric_date_pref).tolist()
+        return [get_image_quality(img, metric, metric_date_pref) for img in images]
     
     if not primary_metrics:
         # Default quality metrics in priority order
@@ -210,7 +234,7 @@ def find_best_image_hybrid(image_group, primary_metrics=None, secondary_metrics=
         metric_date_pref = metric_overrides.get(metric, date_preference)
         
         # Get quality values for all remaining candidates
-        qualities = [(img, get_image_quality(img, metric, metric_date_pref)) for img in candidates]
+        qualities = list(zip(candidates, get_qualities(candidates, metric, metric_date_pref)))
         
         if logger and logger.isEnabledFor(logging.DEBUG):
             logger.debug(f"Evaluating metric: {metric} (preference: {metric_date_pref})")
@@ -238,16 +262,12 @@ def find_best_image_hybrid(image_group, primary_metrics=None, secondary_metrics=
         # Calculate weighted scores
         candidate_scores = []
         
-        # Track metric values for normalization
-        metric_values = {metric: [] for metric in secondary_metrics}
-        
-        # First pass: collect all values for normalization
-        for img in candidates:
-            for metric in secondary_metrics:
-                if metric in metric_weights:  # Only consider metrics with weights
-                    metric_date_pref = metric_overrides.get(metric, date_preference)
-                    value = get_image_quality(img, metric, metric_date_pref)
-                    metric_values[metric].append(value)
+        # First pass: collect all values once; they are reused for normalization and scoring
+        metric_values = {}
+        for metric in secondary_metrics:
+            if metric in metric_weights:  # Only consider metrics with weights
+                metric_date_pref = metric_overrides.get(metric, date_preference)
+                metric_values[metric] = get_qualities(candidates, metric, metric_date_pref)
         
         # Calculate min and max for each metric for normalization
         metric_ranges = {}
@@ -260,12 +280,11 @@ def find_best_image_hybrid(image_group, primary_metrics=None, secondary_metrics=
                                         metric_max - metric_min if metric_max > metric_min else 1)
         
         # Second pass: calculate normalized weighted scores
-        for img in candidates:
+        for idx, img in enumerate(candidates):
             total_score = 0
             for metric in secondary_metrics:
                 if metric in metric_weights and metric in metric_ranges:
-                    metric_date_pref = metric_overrides.get(metric, date_preference)
-                    value = get_image_quality(img, metric, metric_date_pref)
+                    value = metric_values[metric][idx]
                     
                     # Normalize to 0-1 range
                     min_val, max_val, range_val = metric_ranges[metric]
@@ -295,6 +314,132 @@ def find_best_image_hybrid(image_group, primary_metrics=None, secondary_metrics=
     # If no secondary metrics or empty candidate list, return the first candidate
     return candidates[0] if candidates else None
 
+def build_metric_matrix(image_paths, metrics, metadata, date_preference="newest", metric_overrides=None):
+    """
+    Quality values of many images as an (n_images x n_metrics) matrix.
+    
+    Args:
+        image_paths: List of image paths, all present in metadata
+        metrics: List of metrics, one column each
+        metadata: MetadataTable holding the images
+        date_preference: Global preference for date metrics ("newest" or "oldest")
+        metric_overrides: Dictionary of per-metric preference overrides
+        
+    Returns:
+        float64 array of shape (len(image_paths), len(metrics))
+    """
+    metric_overrides = metric_overrides or {}
+    ids = metadata.ids(image_paths)
+    matrix = np.empty((len(ids), len(metrics)), dtype=np.float64)
+    for col, metric in enumerate(metrics):
+        matrix[:, col] = metadata.get_quality_values(ids, metric, metric_overrides.get(metric, date_preference))
+    return matrix
+
+def select_best_images(metric_matrix, group_ids, primary_columns=None, secondary_weights=None,
+                       margin_threshold=0.0):
+    """
+    Select the best row of every group at once.
+    
+    Rows are sorted by group (keeping their order within a group) and each
+    step is a segment reduction over the groups, so the cost does not depend
+    on the number of groups. With margin_threshold=0 this picks the same
+    image as find_best_image_hybrid.
+    
+    Args:
+        metric_matrix: (n_images x n_metrics) array of quality values (higher is better)
+        group_ids: Group id of each row
+        primary_columns: Columns used in strict order; rows below the group best are dropped
+        secondary_weights: List of (column, weight) used to score rows still tied
+        margin_threshold: Relative tolerance under the group best that still counts as
+            a tie on a primary metric (0.05 = 5%)
+        
+    Returns:
+        tuple: (groups, rows) with the sorted unique group ids and the winning row of each
+    """
+    matrix = np.asarray(metric_matrix, dtype=np.float64)
+    group_ids = np.asarray(group_ids)
+    count = len(group_ids)
+    if count == 0:
+        return group_ids[:0], np.empty(0, dtype=np.int64)
+
+    order = np.argsort(group_ids, kind="stable")
+    sorted_groups = group_ids[order]
+    starts = np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+    segment = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, count]))
+    values = matrix[order]
+
+    # Step 1: lexicographic primary metrics, keeping rows tied with the group best
+    alive = np.ones(count, dtype=bool)
+    for col in primary_columns or []:
+        column = np.where(alive, values[:, col], -np.inf)
+        best = np.maximum.reduceat(column, starts)[segment]
+        alive &= column >= best - margin_threshold * np.abs(best)
+
+    # Step 2: weighted secondary metrics, min/max normalized over the remaining rows
+    scores = np.zeros(count, dtype=np.float64)
+    for col, weight in secondary_weights or []:
+        column = values[:, col]
+        high = np.maximum.reduceat(np.where(alive, column, -np.inf), starts)[segment]
+        low = np.minimum.reduceat(np.where(alive, column, np.inf), starts)[segment]
+        scores += (column - low) / np.where(high > low, high - low, 1.0) * weight
+    scores = np.where(alive, scores, -np.inf)
+    best = np.maximum.reduceat(scores, starts)[segment]
+
+    # Remaining ties go to the first row of the group
+    positions = np.where(alive & (scores == best), np.arange(count), count)
+    first = np.minimum.reduceat(positions, starts)
+    return sorted_groups[starts], order[first]
+
+def find_best_images_batch(image_groups, primary_metrics=None, secondary_metrics=None,
+                           metric_weights=None, date_preference="newest",
+                           metric_overrides=None, margin_threshold=0.0, metadata=None):
+    """
+    Select the best image of every group with one vectorized pass.
+    
+    Takes the same metric options as find_best_image_hybrid.
+    
+    Args:
+        image_groups: List of image groups (sets or lists of image paths)
+        margin_threshold: Relative tolerance under the group best that still counts as
+            a tie on a primary metric (0.05 = 5%); 0.0 keeps strict ties, as in
+            find_best_image_hybrid
+        metadata: MetadataTable holding every image; probed when None
+        
+    Returns:
+        List with the best image path of each group (None for empty groups)
+    """
+    if not NUMPY_AVAILABLE:
+        raise ImportError("numpy is required for batch best-image selection")
+    
+    if not primary_metrics:
+        # Default quality metrics in priority order
+        primary_metrics = ["dimensions", "format_quality", "filesize", "modified_date"]
+    metric_weights = metric_weights or DEFAULT_METRIC_WEIGHTS
+    secondary_metrics = [m for m in secondary_metrics or [] if m in metric_weights]
+    
+    groups = [list(group) for group in image_groups]
+    paths = [path for group in groups for path in group]
+    if metadata is None:
+        from .image_metadata import MetadataTable
+        metadata = MetadataTable.probe(paths)
+    
+    metrics = list(dict.fromkeys(primary_metrics + secondary_metrics))
+    column = {metric: idx for idx, metric in enumerate(metrics)}
+    matrix = build_metric_matrix(paths, metrics, metadata, date_preference, metric_overrides)
+    group_ids = np.repeat(np.arange(len(groups)), [len(group) for group in groups])
+    
+    group_indices, rows = select_best_images(
+        matrix, group_ids,
+        primary_columns=[column[m] for m in primary_metrics],
+        secondary_weights=[(column[m], metric_weights[m]) for m in secondary_metrics],
+        margin_threshold=margin_threshold
+    )
+    
+    best_images = [None] * len(groups)
+    for group_idx, row in zip(group_indices.tolist(), rows.tolist()):
+        best_images[group_idx] = paths[row]
+    return best_images
+
 # Keep these for backward compatibility
 def find_best_image(image_group, quality_metrics=None, date_preference="newest", metric_overrides=None):
     """
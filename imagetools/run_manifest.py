@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2025 Dustin Darcy <ScarcityHypothesis.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+run_manifest.py
+
+Run manifest and checkpoints for resumable runs.
+
+A run records its progress in the output directory as it goes: the list of
+discovered images once discovery finishes, the groups once grouping
+finishes, and one journal line per completed output operation. Embeddings
+are checkpointed separately by flushing them to the embedding store. An
+interrupted run started again with --resume picks up from the last
+checkpoint: it skips the stages whose results were saved and the output
+operations already in the journal. The journal also records the directories
+a run created, so --undo can reverse the run, and a dry run writes its
+planned operations in the same format.
+
+Run layout:
+    manifest.json - run settings and the last completed stage
+    images.json   - discovered images
+    groups.json   - groups of image paths
+    journal.jsonl - one JSON object per completed output operation
+"""
+
+import os
+import json
+import shutil
+import logging
+import threading
+
+# Global constants
+MANIFEST_VERSION = 1
+MANIFEST_FILENAME = "manifest.json"
+IMAGES_FILENAME = "images.json"
+GROUPS_FILENAME = "groups.json"
+JOURNAL_FILENAME = "journal.jsonl"
+RUN_STAGES = ["started", "discovered", "grouped", "complete"]
+
+def _write_json(path, data):
+    """Write JSON atomically, so a checkpoint is either complete or absent."""
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(temp_path, path)
+
+class OutputJournal:
+    """
+    Append-only record of output operations.
+
+    Each line holds the source, the requested destination, the mode and the
+    destination actually used after collision handling. Directories created
+    by a run are recorded with mode "mkdir", and operations a dry run only
+    planned are marked "planned". Lines are flushed as they are written, so
+    an interrupted run keeps every completed operation.
+    """
+    def __init__(self, journal_path):
+        self.journal_path = journal_path
+        self.done = {}
+        self.entries = []
+        self._file = None
+        self._lock = threading.Lock()
+
+        if os.path.exists(journal_path):
+            with open(journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Partially written line from an interrupted run
+                    self.entries.append(entry)
+                    if entry["mode"] != "mkdir" and not entry.get("planned"):
+                        self.done[(entry["source"], entry["dest"])] = entry["actual"]
+
+    def __len__(self):
+        return len(self.done)
+
+    def get(self, source, dest):
+        """Return the destination used by a completed operation, or None."""
+        return self.done.get((source, dest))
+
+    def _append(self, entry):
+        with self._lock:
+            self.entries.append(entry)
+            if not entry.get("planned") and entry["mode"] != "mkdir":
+                self.done[(entry["source"], entry["dest"])] = entry["actual"]
+            if self._file is None:
+                self._file = open(self.journal_path, 'a', encoding='utf-8')
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+
+    def record(self, source, dest, mode, actual, planned=False, method=None):
+        """Record a completed operation, or one a dry run planned, with the copy method used."""
+        entry = {"source": source, "dest": dest, "mode": mode, "actual": actual}
+        if method is not None:
+            entry["method"] = method
+        if planned:
+            entry["planned"] = True
+        self._append(entry)
+
+    def record_directory(self, path):
+        """Record a directory the run created."""
+        self._append({"source": None, "dest": path, "mode": "mkdir", "actual": path})
+
+    def close(self):
+        """Close the journal file; a later record reopens it."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def undo(self, dryrun=False, logger=None):
+        """
+        Reverse the recorded operations, newest first.
+
+        Copies, links and metadata files are deleted, moved files are moved
+        back (replacing their backlinks), and created directories are removed
+        once empty. Planned operations are ignored.
+
+        Returns:
+            tuple: (undone, failed) operation counts
+        """
+        if logger is None:
+            logger = logging.getLogger("run_manifest")
+
+        undone = failed = 0
+        for entry in reversed(self.entries):
+            if entry.get("planned"):
+                continue
+            mode, source, actual = entry["mode"], entry["source"], entry["actual"]
+            if dryrun:
+                logger.info(f"Would undo {mode}: {actual}")
+                continue
+            try:
+                if mode == "mkdir":
+                    if os.path.isdir(actual) and not os.listdir(actual):
+                        os.rmdir(actual)
+                elif mode == "move":
+                    if os.path.islink(source):
+                        os.remove(source)  # Backlink to the moved file
+                    elif os.path.exists(source):
+                        raise FileExistsError(f"{source} exists again")
+                    os.makedirs(os.path.dirname(source), exist_ok=True)
+                    shutil.move(actual, source)
+                elif os.path.islink(actual) or os.path.isfile(actual):
+                    os.remove(actual)
+                undone += 1
+            except OSError as e:
+                failed += 1
+                logger.error(f"Could not undo {mode} of {source} -> {actual}: {e}")
+        return undone, failed
+
+class RunManifest:
+    """
+    Checkpoints of one run, stored in a directory inside the output directory.
+
+    Attributes:
+        run_dir: Directory holding the checkpoint files
+        settings: Options the checkpoints depend on; a resumed run must match them
+        stage: Last completed stage, one of RUN_STAGES
+    """
+    def __init__(self, run_dir, logger=None):
+        self.run_dir = run_dir
+        self.logger = logger or logging.getLogger("run_manifest")
+        self.settings = {}
+        self.stage = None
+
+    def _path(self, filename):
+        return os.path.join(self.run_dir, filename)
+
+    @classmethod
+    def load(cls, run_dir, logger=None):
+        """
+        Load the manifest of a previous run.
+
+        Returns:
+            RunManifest, or None if there is no usable manifest in run_dir
+        """
+        manifest = cls(run_dir, logger)
+        manifest_path = manifest._path(MANIFEST_FILENAME)
+        if not os.path.exists(manifest_path):
+            return None
+
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            manifest.logger.warning(f"Ignoring unreadable run manifest {manifest_path}: {e}")
+            return None
+
+        if data.get("version") != MANIFEST_VERSION or data.get("stage") not in RUN_STAGES:
+            manifest.logger.warning(f"Ignoring run manifest with unsupported version {data.get('version')}")
+            return None
+
+        manifest.settings = data.get("settings", {})
+        manifest.stage = data["stage"]
+        return manifest
+
+    def matches(self, settings):
+        """Check whether the checkpoints were written with the same settings."""
+        return self.settings == json.loads(json.dumps(settings, sort_keys=True))
+
+    def _write_manifest(self):
+        _write_json(self._path(MANIFEST_FILENAME),
+                    {"version": MANIFEST_VERSION, "stage": self.stage, "settings": self.settings})
+
+    def start(self, settings):
+        """Start a new run, discarding the checkpoints of any previous run."""
+        os.makedirs(self.run_dir, exist_ok=True)
+        for filename in (IMAGES_FILENAME, GROUPS_FILENAME, JOURNAL_FILENAME):
+            if os.path.exists(self._path(filename)):
+                os.remove(self._path(filename))
+        self.settings = json.loads(json.dumps(settings, sort_keys=True))
+        self.stage = "started"
+        self._write_manifest()
+
+    def reached(self, stage):
+        """Check whether the run completed a stage."""
+        return self.stage is not None and RUN_STAGES.index(self.stage) >= RUN_STAGES.index(stage)
+
+    def set_stage(self, stage):
+        """Record that the run completed a stage."""
+        self.stage = stage
+        self._write_manifest()
+
+    def save_images(self, image_paths):
+        """Checkpoint the discovered images."""
+        _write_json(self._path(IMAGES_FILENAME), list(image_paths))
+        self.set_stage("discovered")
+
+    def load_images(self):
+        """Return the checkpointed images, or None if discovery did not finish."""
+        if not self.reached("discovered"):
+            return None
+        with open(self._path(IMAGES_FILENAME), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save_groups(self, groups):
+        """Checkpoint the groups."""
+        _write_json(self._path(GROUPS_FILENAME), [sorted(group) for group in groups])
+        self.set_stage("grouped")
+
+    def load_groups(self):
+        """Return the checkpointed groups as sets, or None if grouping did not finish."""
+        if not self.reached("grouped"):
+            return None
+        with open(self._path(GROUPS_FILENAME), 'r', encoding='utf-8') as f:
+            return [set(group) for group in json.load(f)]
+
+    def journal(self):
+        """Open the journal of completed output operations."""
+        os.makedirs(self.run_dir, exist_ok=True)
+        return OutputJournal(self._path(JOURNAL_FILENAME))
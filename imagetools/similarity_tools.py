@@ -24,13 +24,19 @@ Part of the refactored common_imagetools functionality.
 Updates include:
 - Named presets for similarity thresholds
 - Enhanced region-based similarity calculations
+- Tiled matrix similarity engine for all-pairs comparison
+- Optional approximate nearest-neighbour index for very large collections
+- Candidate-pair mode for the perceptual hash prefilter
+- Multi-process decode pipeline feeding batched inference
+- Region embeddings computed once per image and compared as vectors
+- Periodic flushes of new embeddings to the store, so interrupted runs keep their work
+- float16 and int8 matrices, with near-threshold pairs optionally rescored in float32
 """
 
 import os
 import sys
 import logging
 import pickle
-import tempfile
 import time
 from pathlib import Path
 
@@ -53,9 +59,24 @@ except ImportError:
     TRANSFORMERS_AVAILABLE = False
 
 from imagetools import TQDM_AVAILABLE, tqdm
+from imagetools import NUMPY_AVAILABLE, np
+from .ann_index import IVFIndex, DEFAULT_ANN_PROBES
+from .compact_vectors import CompactMatrix
+from .decode_pipeline import (
+    DEFAULT_REGION_SIZE,
+    get_region_types,
+    crop_image_regions,
+    open_image,
+    get_preprocess_config,
+    iter_preprocessed_batches
+)
 
 # Global constants
 DEFAULT_MODEL_NAME = "openai/clip-vit-base-patch32"
+DEFAULT_TILE_SIZE = 2048  # Rows per block in the matrix similarity engine
+REGION_FULL_WEIGHT = 2.0  # Weight of the whole image relative to each region
+DEFAULT_FLUSH_BATCHES = 50  # Batches of new embeddings kept in memory before they are stored
+CANDIDATE_BLOCK_SIZE = 65536  # Candidate pairs collected before they are scored
 
 # Similarity threshold presets
 SIMILARITY_PRESETS = {
@@ -98,13 +119,14 @@ def load_clip_model(model_name=DEFAULT_MODEL_NAME, device="auto"):
     except Exception as e:
         raise RuntimeError(f"Failed to load CLIP model {model_name}: {e}")
 
-def compute_embedding(image_path, model, processor, device):
+def compute_embedding(image_path, model, processor, device, fast_decode=True):
     """Compute the embedding for a single image."""
     if not TRANSFORMERS_AVAILABLE or not PILLOW_AVAILABLE:
         raise ImportError("Required dependencies missing for embedding computation")
         
     try:
-        image = Image.open(image_path).convert('RGB')
+        config = get_preprocess_config(processor, fast_decode)
+        image = open_image(image_path, min_size=config["shortest_edge"], fast_decode=fast_decode)
         inputs = processor(images=image, return_tensors="pt")
         pixel_values = inputs["pixel_values"].to(device)
         with torch.no_grad():
@@ -114,185 +136,286 @@ def compute_embedding(image_path, model, processor, device):
         logging.warning(f"Error computing embedding for {image_path}: {e}")
         return None
 
-def extract_image_region(image_path, region_type="center", size=512):
-    """Extract a specific region from an image for more detailed comparison."""
+def extract_image_region(image_path, region_type="center", size=DEFAULT_REGION_SIZE, fast_decode=True):
+    """
+    Extract a specific region from an image for more detailed comparison.
+    
+    The region is given in original pixels. With fast_decode, the image is
+    decoded only as large as needed for the region to still cover the model
+    input size, so the returned crop may be smaller than size.
+    """
     if not PILLOW_AVAILABLE:
         raise ImportError("PIL/Pillow is required for image processing")
         
     try:
         with Image.open(image_path) as img:
-            width, height = img.size
-            
-            # Ensure size fits within the image
-            size = min(size, width, height)
-            
-            if region_type == "center":
-                # Extract center region
-                left = (width - size) // 2
-                top = (height - size) // 2
-                right = left + size
-                bottom = top + size
-                return img.crop((left, top, right, bottom))
-            elif region_type == "top_left":
-                return img.crop((0, 0, size, size))
-            elif region_type == "top_right":
-                return img.crop((width - size, 0, width, size))
-            elif region_type == "bottom_left":
-                return img.crop((0, height - size, size, height))
-            elif region_type == "bottom_right":
-                return img.crop((width - size, height - size, width, height))
-            else:
-                # Default to center
-                left = (width - size) // 2
-                top = (height - size) // 2
-                right = left + size
-                bottom = top + size
-                return img.crop((left, top, right, bottom))
+            return crop_image_regions(img, [region_type], size, fast_decode)[0]
     except Exception as e:
         logging.warning(f"Error extracting region from {image_path}: {e}")
         return None
 
-class TemporaryRegionFiles:
-    """Context manager for temporary region files."""
-    def __init__(self):
-        self.temp_dir = tempfile.mkdtemp(prefix="image_regions_")
-        self.files = []
-        
-    def __enter__(self):
-        return self
+def compute_region_similarity(img1_path, img2_path, model, processor, device, regions=1, fast_decode=True):
+    """
+    Compare specific regions of two images for enhanced similarity checking.
+    
+    Convenience wrapper for a single pair; grouping computes region embeddings
+    once per image with compute_region_embeddings_batch instead.
+    """
+    if not TRANSFORMERS_AVAILABLE or not PILLOW_AVAILABLE:
+        raise ImportError("Required dependencies missing for region similarity computation")
+    
+    paths = [img1_path, img2_path]
+    embeddings = compute_embeddings_batch(paths, model, processor, device, show_progress=False,
+                                          fast_decode=fast_decode)
+    if len(embeddings) < 2:
+        return 0.0
+    
+    region_embeddings = compute_region_embeddings_batch(paths, model, processor, device, regions=regions,
+                                                        show_progress=False, fast_decode=fast_decode)
+    _, matrix = build_embedding_matrix(embeddings, paths)
+    region_matrices = [build_region_matrix(region_embeddings.get(region_type, {}), embeddings, paths)
+                       for region_type in get_region_types(regions)]
+    
+    return float(score_pairs(matrix, np.array([0]), np.array([1]), region_matrices=region_matrices)[0])
+
+def _iter_batch_features(image_paths, model, device, config, batch_size, show_progress,
+                         num_workers, prefetch_batches, desc, skip_report=None):
+    """Run the model over preprocessed batches, yielding (paths, features)."""
+    stage = "region_embedding" if config.get("region_types") else "embedding"
+    # Setup progress bar if available and requested
+    total = len(image_paths) if hasattr(image_paths, "__len__") else None
+    progress = tqdm(total=total, desc=desc) if show_progress and TQDM_AVAILABLE else None
+    
+    batches = iter_preprocessed_batches(image_paths, config, batch_size=batch_size,
+                                        num_workers=num_workers, prefetch_batches=prefetch_batches)
+    for paths, pixel_values, failures in batches:
+        for image_path, error in failures:
+            logging.warning(f"Error processing {image_path}: {error}")
+            if skip_report is not None:
+                skip_report.add(image_path, stage, error)
         
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        # Clean up all temporary files
-        for file in self.files:
+        if pixel_values is not None:
             try:
-                if os.path.exists(file):
-                    os.remove(file)
+                pixel_values = torch.from_numpy(pixel_values).to(device)
+                with torch.no_grad():
+                    outputs = model.get_image_features(pixel_values=pixel_values)
+                yield paths, outputs.cpu()
             except Exception as e:
-                logging.warning(f"Error removing temporary file {file}: {e}")
+                logging.warning(f"Error processing batch starting with {paths[0]}: {e}")
+                if skip_report is not None:
+                    for image_path in paths:
+                        skip_report.add(image_path, stage, e)
         
-        # Remove temporary directory
-        try:
-            os.rmdir(self.temp_dir)
-        except Exception as e:
-            logging.warning(f"Error removing temporary directory {self.temp_dir}: {e}")
+        if progress is not None:
+            progress.update(len(paths) + len(failures))
     
-    def create_temp_file(self, suffix=".png"):
-        """Create a temporary file path in the temporary directory."""
-        fd, temp_path = tempfile.mkstemp(suffix=suffix, dir=self.temp_dir)
-        os.close(fd)
-        self.files.append(temp_path)
-        return temp_path
+    if progress is not None:
+        progress.close()
 
-def compute_region_similarity(img1_path, img2_path, model, processor, device, regions=1):
-    """Compare specific regions of two images for enhanced similarity checking."""
-    if not TRANSFORMERS_AVAILABLE or not PILLOW_AVAILABLE:
-        raise ImportError("Required dependencies missing for region similarity computation")
-        
+def _flush_to_store(store, embeddings):
+    """Append embeddings to a store, warning instead of failing the run."""
     try:
-        # First compute whole-image similarity
-        embedding1 = compute_embedding(img1_path, model, processor, device)
-        embedding2 = compute_embedding(img2_path, model, processor, device)
-        
-        if embedding1 is None or embedding2 is None:
-            return 0.0
-            
-        full_sim = cosine_similarity(embedding1, embedding2)
-        
-        if regions <= 1:
-            return full_sim
-            
-        # Create context manager for temporary files
-        with TemporaryRegionFiles() as temp_files:
-            # Calculate similarity for additional regions
-            region_similarities = [full_sim]  # Start with the full image similarity
-            
-            region_types = ["center"]
-            if regions > 1:
-                region_types.extend(["top_left", "top_right", "bottom_left", "bottom_right"])
-            
-            # Limit to requested number of regions
-            region_types = region_types[:regions]
-            
-            for region_type in region_types:
-                region1 = extract_image_region(img1_path, region_type)
-                region2 = extract_image_region(img2_path, region_type)
-                
-                if region1 and region2:
-                    # Save regions temporarily
-                    temp1 = temp_files.create_temp_file(suffix=f"_region1_{region_type}.png")
-                    temp2 = temp_files.create_temp_file(suffix=f"_region2_{region_type}.png")
-                    region1.save(temp1)
-                    region2.save(temp2)
-                    
-                    # Compute embeddings and similarity
-                    r_embedding1 = compute_embedding(temp1, model, processor, device)
-                    r_embedding2 = compute_embedding(temp2, model, processor, device)
-                    
-                    if r_embedding1 is not None and r_embedding2 is not None:
-                        region_sim = cosine_similarity(r_embedding1, r_embedding2)
-                        region_similarities.append(region_sim)
-        
-        # Calculate weighted average, giving more weight to the full image similarity
-        weights = [2.0] + [1.0] * (len(region_similarities) - 1)
-        weighted_sum = sum(w * s for w, s in zip(weights, region_similarities))
-        return weighted_sum / sum(weights)
+        store.append(embeddings)
     except Exception as e:
-        logging.warning(f"Error computing region similarity: {e}")
-        return full_sim  # Fall back to full image similarity if region comparison fails
+        logging.warning(f"Failed to update embedding store: {e}")
 
-def compute_embeddings_batch(image_paths, model, processor, device, batch_size=16, show_progress=True):
-    """Compute embeddings for a list of images in batches."""
+def compute_embeddings_batch(image_paths, model, processor, device, batch_size=16, show_progress=True,
+                             num_workers=1, prefetch_batches=None, fast_decode=True, skip_report=None,
+                             store=None, flush_batches=DEFAULT_FLUSH_BATCHES):
+    """
+    Compute embeddings for a list of images in batches.
+    
+    Decoding and preprocessing run in num_workers worker processes that stay
+    ahead of the model by up to prefetch_batches batches, so inference does
+    not wait on image decoding. With a store, new embeddings are appended
+    every flush_batches batches, so an interrupted run loses at most that many.
+    
+    Args:
+        image_paths: List of image paths
+        model: CLIP model
+        processor: CLIP processor (its preprocessing settings are used)
+        device: Device for model inference
+        batch_size: Images per model call
+        show_progress: Whether to show progress bar
+        num_workers: Number of decode worker processes (1 decodes in-process)
+        prefetch_batches: Maximum preprocessed batches in flight (default: 2 per worker)
+        fast_decode: Decode images at reduced resolution near the model input size
+        skip_report: Optional SkipReport recording images that could not be decoded
+        store: Optional EmbeddingStore the new embeddings are appended to
+        flush_batches: Batches between appends to the store
+    
+    Returns:
+        Dictionary mapping image paths to embeddings
+    """
     if not TRANSFORMERS_AVAILABLE or not PILLOW_AVAILABLE:
         raise ImportError("Required dependencies missing for embedding computation")
     
     embeddings = {}
+    pending = {}
+    flush_batches = max(1, flush_batches or 1)
+    config = get_preprocess_config(processor, fast_decode)
     
-    # Setup progress bar if available and requested
-    if show_progress and TQDM_AVAILABLE:
-        iterator = tqdm(image_paths, desc="Computing embeddings")
-    else:
-        iterator = image_paths
+    batches = _iter_batch_features(image_paths, model, device, config, batch_size, show_progress,
+                                   num_workers, prefetch_batches, "Computing embeddings", skip_report)
+    for batch_idx, (paths, outputs) in enumerate(batches, start=1):
+        for idx, path in enumerate(paths):
+            embeddings[path] = outputs[idx]
+        
+        if store is not None:
+            pending.update((path, outputs[idx]) for idx, path in enumerate(paths))
+            if batch_idx % flush_batches == 0:
+                _flush_to_store(store, pending)
+                pending = {}
+    
+    if store is not None and pending:
+        _flush_to_store(store, pending)
+    
+    return embeddings
 
-    current_batch = []
-    current_paths = []
+def compute_region_embeddings_batch(image_paths, model, processor, device, regions=2, batch_size=16,
+                                    show_progress=True, num_workers=1, prefetch_batches=None, fast_decode=True,
+                                    skip_report=None, stores=None, flush_batches=DEFAULT_FLUSH_BATCHES):
+    """
+    Compute region embeddings for a list of images in batches.
     
-    for image_path in iterator:
-        try:
-            image = Image.open(image_path).convert('RGB')
-            current_batch.append(image)
-            current_paths.append(image_path)
-            
-            if len(current_batch) >= batch_size:
-                inputs = processor(images=current_batch, return_tensors="pt", padding=True)
-                pixel_values = inputs["pixel_values"].to(device)
-                
-                with torch.no_grad():
-                    outputs = model.get_image_features(pixel_values)
-                
-                for idx, path in enumerate(current_paths):
-                    embeddings[path] = outputs[idx].cpu()
-                
-                current_batch, current_paths = [], []
-                
-        except Exception as e:
-            logging.warning(f"Error processing {image_path}: {e}")
+    Each image is decoded once and all of its region crops are embedded from
+    memory in the same model call. Like compute_embeddings_batch, new region
+    embeddings are appended to their stores every flush_batches batches.
     
-    # Process any remaining images
-    if current_batch:
+    Args:
+        image_paths: List of image paths
+        model: CLIP model
+        processor: CLIP processor (its preprocessing settings are used)
+        device: Device for model inference
+        regions: Number of regions to check (see get_region_types)
+        batch_size: Images per model call (each contributes one crop per region)
+        show_progress: Whether to show progress bar
+        num_workers: Number of decode worker processes (1 decodes in-process)
+        prefetch_batches: Maximum preprocessed batches in flight (default: 2 per worker)
+        fast_decode: Decode images at reduced resolution near the model input size
+        skip_report: Optional SkipReport recording images that could not be decoded
+        stores: Optional dictionary mapping region types to the stores their
+            new embeddings are appended to
+        flush_batches: Batches between appends to the stores
+    
+    Returns:
+        Dictionary mapping each region type to a dictionary of image paths to embeddings
+    """
+    if not TRANSFORMERS_AVAILABLE or not PILLOW_AVAILABLE:
+        raise ImportError("Required dependencies missing for embedding computation")
+    
+    region_types = get_region_types(regions)
+    region_embeddings = {region_type: {} for region_type in region_types}
+    if not region_types:
+        return region_embeddings
+    
+    stores = stores or {}
+    pending = {region_type: {} for region_type in stores}
+    flush_batches = max(1, flush_batches or 1)
+    
+    def flush():
+        for region_type, embeddings in pending.items():
+            if embeddings:
+                _flush_to_store(stores[region_type], embeddings)
+                pending[region_type] = {}
+    
+    config = get_preprocess_config(processor, fast_decode, region_types)
+    batches = _iter_batch_features(image_paths, model, device, config, batch_size, show_progress,
+                                   num_workers, prefetch_batches, "Computing region embeddings", skip_report)
+    for batch_idx, (paths, outputs) in enumerate(batches, start=1):
+        # Rows are grouped image by image, one row per region
+        for idx, path in enumerate(paths):
+            for offset, region_type in enumerate(region_types):
+                region_embeddings[region_type][path] = outputs[idx * len(region_types) + offset]
+                if region_type in pending:
+                    pending[region_type][path] = region_embeddings[region_type][path]
+        
+        if batch_idx % flush_batches == 0:
+            flush()
+    
+    flush()
+    return region_embeddings
+
+def stream_embeddings(image_paths, model, processor, device, store=None, update_store=True, batch_size=16,
+                      show_progress=True, num_workers=1, prefetch_batches=None, fast_decode=True,
+                      skip_report=None):
+    """
+    Compute embeddings for images as they arrive from a crawl still in progress.
+    
+    Stored images are looked up one at a time as they arrive; the rest go
+    straight into the decode pipeline, so inference starts with the first
+    batch instead of after discovery. Each batch of new embeddings is appended
+    to the store right away and only its store row is kept, so memory does
+    not grow with the embeddings themselves.
+    
+    Args:
+        image_paths: Iterable of image paths, e.g. from iter_images
+        model: CLIP model
+        processor: CLIP processor (its preprocessing settings are used)
+        device: Device for model inference
+        store: Optional EmbeddingStore for reuse and for the new embeddings
+        update_store: Append new embeddings to the store (False for dry runs)
+        batch_size: Images per model call
+        show_progress: Whether to show progress bar
+        num_workers: Number of decode worker processes (1 decodes in-process)
+        prefetch_batches: Maximum preprocessed batches in flight (default: 2 per worker)
+        fast_decode: Decode images at reduced resolution near the model input size
+        skip_report: Optional SkipReport recording images that could not be decoded
+    
+    Returns:
+        tuple: (paths, embeddings) with every path received, in arrival order,
+        and a dictionary mapping paths to embeddings (rows of the store's
+        memory map for stored images)
+    """
+    if not TRANSFORMERS_AVAILABLE or not PILLOW_AVAILABLE:
+        raise ImportError("Required dependencies missing for embedding computation")
+    
+    received = []
+    rows = {}
+    aliases = []
+    embeddings = {}
+    
+    def uncached_paths():
+        for path in image_paths:
+            received.append(path)
+            row, alias = store.lookup_row(path) if store is not None else (None, None)
+            if row is None:
+                yield path
+            else:
+                rows[path] = row
+                if alias is not None:
+                    aliases.append(alias)
+    
+    config = get_preprocess_config(processor, fast_decode)
+    for paths, outputs in _iter_batch_features(uncached_paths(), model, device, config, batch_size, show_progress,
+                                               num_workers, prefetch_batches, "Computing embeddings",
+                                               skip_report):
+        new_embeddings = {path: outputs[idx] for idx, path in enumerate(paths)}
+        if store is not None and update_store:
+            _flush_to_store(store, new_embeddings)
+            # Keep in memory only what could not be stored
+            for path, embedding in new_embeddings.items():
+                row, _ = store.lookup_row(path)
+                if row is None:
+                    embeddings[path] = embedding
+                else:
+                    rows[path] = row
+        else:
+            embeddings.update(new_embeddings)
+    
+    if aliases and update_store:
         try:
-            inputs = processor(images=current_batch, return_tensors="pt", padding=True)
-            pixel_values = inputs["pixel_values"].to(device)
-            
-            with torch.no_grad():
-                outputs = model.get_image_features(pixel_values)
-            
-            for idx, path in enumerate(current_paths):
-                embeddings[path] = outputs[idx].cpu()
-                
+            store.save_aliases(aliases)
         except Exception as e:
-            logging.warning(f"Error processing final batch: {e}")
+            logging.warning(f"Failed to update embedding store: {e}")
     
-    return embeddings
+    # Map the store once at the end instead of after every append
+    if rows:
+        vectors = store.vectors
+        for path, row in rows.items():
+            embeddings.setdefault(path, vectors[row])
+    
+    return received, embeddings
 
 def cosine_similarity(embedding1, embedding2):
     """Calculate cosine similarity between two embeddings."""
@@ -302,6 +425,215 @@ def cosine_similarity(embedding1, embedding2):
     return torch.nn.functional.cosine_similarity(embedding1.unsqueeze(0),
                                                  embedding2.unsqueeze(0), dim=1).item()
 
+# -----------------------------
+# Matrix Similarity Engine
+# -----------------------------
+def embedding_to_numpy(embedding):
+    """Convert a torch tensor or array-like embedding to a flat float32 numpy vector."""
+    if not NUMPY_AVAILABLE:
+        raise ImportError("numpy is required for the matrix similarity engine")
+        
+    if hasattr(embedding, "detach"):
+        embedding = embedding.detach().cpu().float().numpy()
+    return np.asarray(embedding, dtype=np.float32).reshape(-1)
+
+def build_embedding_matrix(embeddings, paths=None, dtype="float32"):
+    """
+    Stack embeddings into a single L2-normalized matrix.
+    
+    Args:
+        embeddings: Dictionary mapping image paths to their embeddings
+        paths: Optional ordering of paths (default: dictionary order)
+        dtype: "float32" for a numpy array, or "float16"/"int8" for a
+            CompactMatrix at half or a quarter of the memory
+        
+    Returns:
+        tuple: (paths, matrix) where row i of matrix belongs to paths[i]
+    """
+    if not NUMPY_AVAILABLE:
+        raise ImportError("numpy is required for the matrix similarity engine")
+        
+    if paths is None:
+        paths = list(embeddings.keys())
+    else:
+        paths = [path for path in paths if path in embeddings]
+    
+    if not paths:
+        return [], np.zeros((0, 0), dtype=np.float32)
+    
+    dim = embedding_to_numpy(embeddings[paths[0]]).shape[0]
+    if dtype == "float32":
+        matrix = np.empty((len(paths), dim), dtype=np.float32)
+    else:
+        matrix = CompactMatrix.empty(len(paths), dim, dtype)
+    
+    # Fill a tile at a time so a compact matrix never has a full float32 copy
+    for start in range(0, len(paths), DEFAULT_TILE_SIZE):
+        block = np.stack([embedding_to_numpy(embeddings[path]) for path in paths[start:start + DEFAULT_TILE_SIZE]])
+        
+        # Normalize rows so that a dot product is the cosine similarity
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        matrix[start:start + block.shape[0]] = block / norms
+    
+    return paths, matrix
+
+def build_region_matrix(region_embeddings, embeddings, paths, dtype="float32"):
+    """
+    Stack the embeddings of one region type in the row order of paths.
+    
+    Images without a region embedding fall back to their whole-image
+    embedding, so every row of the full matrix has a region counterpart.
+    """
+    rows = {path: region_embeddings.get(path, embeddings[path]) for path in paths}
+    return build_embedding_matrix(rows, paths, dtype=dtype)[1]
+
+def _combine_region_sims(sims, region_sims):
+    """Weighted average of whole-image and region similarities."""
+    if not region_sims:
+        return sims
+    total = REGION_FULL_WEIGHT * sims
+    for region_sim in region_sims:
+        total += region_sim
+    return total / (REGION_FULL_WEIGHT + len(region_sims))
+
+def score_pairs(matrix, rows, cols, chunk_size=DEFAULT_TILE_SIZE, region_matrices=None):
+    """
+    Compute the cosine similarity of selected row pairs of a normalized matrix.
+    
+    Args:
+        matrix: L2-normalized matrix from build_embedding_matrix
+        rows: Array of row indices
+        cols: Array of row indices, paired with rows
+        chunk_size: Pairs scored per block; bounds memory use
+        region_matrices: Optional region matrices aligned with matrix; the
+            result is then the weighted region similarity
+        
+    Returns:
+        Array of similarities, one per pair
+    """
+    sims = np.empty(len(rows), dtype=np.float32)
+    for start in range(0, len(rows), chunk_size):
+        stop = start + chunk_size
+        block_rows = rows[start:stop]
+        block_cols = cols[start:stop]
+        sims[start:stop] = _combine_region_sims(
+            np.einsum("ij,ij->i", matrix[block_rows], matrix[block_cols]),
+            [np.einsum("ij,ij->i", m[block_rows], m[block_cols]) for m in region_matrices or []])
+    return sims
+
+def rescore_pairs(embeddings, paths, rows, cols, chunk_size=DEFAULT_TILE_SIZE, region_embeddings=None,
+                  region_types=()):
+    """
+    Compute float32 similarities of selected pairs straight from the embeddings.
+    
+    Only the images that take part in a pair are stacked, so this is cheap for
+    the candidate band of the perceptual hash prefilter and for near-threshold
+    pairs found in a compact matrix.
+    
+    Args:
+        embeddings: Dictionary mapping image paths to their embeddings
+        paths: Image paths indexed by rows and cols
+        rows: Array of indices into paths
+        cols: Array of indices into paths, paired with rows
+        chunk_size: Pairs scored per block
+        region_embeddings: Optional dictionary mapping region types to region embeddings
+        region_types: Region types to combine with the whole-image similarity
+        
+    Returns:
+        Array of similarities, one per pair
+    """
+    involved = np.unique(np.concatenate([rows, cols]))
+    involved_paths = [paths[i] for i in involved]
+    _, matrix = build_embedding_matrix(embeddings, involved_paths)
+    region_matrices = [build_region_matrix(region_embeddings.get(region_type, {}), embeddings, involved_paths)
+                       for region_type in region_types]
+    return score_pairs(matrix, np.searchsorted(involved, rows), np.searchsorted(involved, cols),
+                       chunk_size=chunk_size, region_matrices=region_matrices)
+
+def iter_similar_pairs(matrix, threshold, tile_size=DEFAULT_TILE_SIZE, show_progress=False,
+                       region_matrices=None):
+    """
+    Find all pairs of rows whose cosine similarity meets a threshold.
+    
+    The upper triangle of the similarity matrix is computed one tile at a time,
+    so memory use is bounded by tile_size * tile_size rather than n * n.
+    
+    Args:
+        matrix: L2-normalized (n x d) matrix from build_embedding_matrix
+        threshold: Minimum similarity for a pair to be reported
+        tile_size: Number of rows per block
+        show_progress: Whether to show progress bar
+        region_matrices: Optional region matrices aligned with matrix; pairs are
+            then thresholded on the weighted region similarity
+        
+    Yields:
+        Tuples of numpy arrays (rows, cols, similarities) with rows < cols
+    """
+    if not NUMPY_AVAILABLE:
+        raise ImportError("numpy is required for the matrix similarity engine")
+        
+    num_rows = matrix.shape[0]
+    tile_size = max(1, int(tile_size))
+    starts = range(0, num_rows, tile_size)
+    
+    tiles = [(i, j) for i in starts for j in starts if j >= i]
+    if show_progress and TQDM_AVAILABLE:
+        iterator = tqdm(tiles, desc="Comparing images")
+    else:
+        iterator = tiles
+    
+    def rows_of(start):
+        # A compact matrix widens the tile to float32 here
+        return [m[start:start + tile_size] for m in [matrix] + list(region_matrices or [])]
+    
+    cached_i = None
+    for start_i, start_j in iterator:
+        if cached_i is None or cached_i[0] != start_i:
+            cached_i = (start_i, rows_of(start_i))
+        blocks_i = cached_i[1]
+        blocks_j = blocks_i if start_j == start_i else rows_of(start_j)
+        sims = _combine_region_sims(
+            blocks_i[0] @ blocks_j[0].T,
+            [block_i @ block_j.T for block_i, block_j in zip(blocks_i[1:], blocks_j[1:])])
+        
+        if start_i == start_j:
+            # Diagonal tile: keep only the strict upper triangle
+            sims[np.tril_indices(sims.shape[0], m=sims.shape[1])] = -np.inf
+        
+        rows, cols = np.nonzero(sims >= threshold)
+        if rows.size:
+            yield rows + start_i, cols + start_j, sims[rows, cols]
+
+def iter_query_pairs(queries, matrix, threshold, tile_size=DEFAULT_TILE_SIZE):
+    """
+    Find all pairs of a query row and a matrix row whose similarity meets a threshold.
+    
+    Compares only the queries against the matrix, one tile at a time, so adding
+    a few images to a large collection costs len(queries) * len(matrix) products
+    instead of a full all-pairs pass.
+    
+    Args:
+        queries: L2-normalized (m x d) float32 matrix of new vectors
+        matrix: L2-normalized (n x d) matrix to search; may be a memory map
+        threshold: Minimum similarity for a pair to be reported
+        tile_size: Number of rows per block
+        
+    Yields:
+        Tuples of numpy arrays (query_rows, matrix_rows, similarities)
+    """
+    if not NUMPY_AVAILABLE:
+        raise ImportError("numpy is required for the matrix similarity engine")
+        
+    tile_size = max(1, int(tile_size))
+    for start_j in range(0, matrix.shape[0], tile_size):
+        block_j = np.asarray(matrix[start_j:start_j + tile_size], dtype=np.float32)
+        for start_i in range(0, queries.shape[0], tile_size):
+            sims = queries[start_i:start_i + tile_size] @ block_j.T
+            rows, cols = np.nonzero(sims >= threshold)
+            if rows.size:
+                yield rows + start_i, cols + start_j, sims[rows, cols]
+
 # -----------------------------
 # Grouping Functions
 # -----------------------------
@@ -324,28 +656,152 @@ def get_similarity_threshold(preset=None, threshold=None):
         # Default to "very_similar" preset
         return SIMILARITY_PRESETS["very_similar"]
 
+class DisjointSet:
+    """
+    Union-find structure over integer image indices.
+    
+    Uses path compression and union by rank so that merging groups costs
+    near-constant time regardless of how many groups exist. Edges can be
+    streamed in from any similarity engine via union() or union_pairs().
+    """
+    def __init__(self, size=0):
+        self.parent = list(range(size))
+        self.rank = [0] * size
+        
+    def __len__(self):
+        return len(self.parent)
+    
+    def add(self):
+        """Add a new singleton element and return its index."""
+        index = len(self.parent)
+        self.parent.append(index)
+        self.rank.append(0)
+        return index
+    
+    def find(self, index):
+        """Return the root of the set containing index."""
+        parent = self.parent
+        root = index
+        while parent[root] != root:
+            root = parent[root]
+        
+        # Path compression: point every node on the path directly at the root
+        while parent[index] != root:
+            parent[index], index = root, parent[index]
+        
+        return root
+    
+    def union(self, index_a, index_b):
+        """Merge the sets containing two indices. Returns True if they were separate."""
+        root_a = self.find(index_a)
+        root_b = self.find(index_b)
+        if root_a == root_b:
+            return False
+        
+        # Union by rank: attach the shallower tree under the deeper one
+        if self.rank[root_a] < self.rank[root_b]:
+            root_a, root_b = root_b, root_a
+        self.parent[root_b] = root_a
+        if self.rank[root_a] == self.rank[root_b]:
+            self.rank[root_a] += 1
+        return True
+    
+    def union_pairs(self, rows, cols):
+        """Merge every (rows[k], cols[k]) pair. Accepts lists or numpy arrays."""
+        if hasattr(rows, "tolist"):
+            rows = rows.tolist()
+        if hasattr(cols, "tolist"):
+            cols = cols.tolist()
+        
+        merged = 0
+        for index_a, index_b in zip(rows, cols):
+            if self.union(index_a, index_b):
+                merged += 1
+        return merged
+    
+    @classmethod
+    def from_parents(cls, parent):
+        """Rebuild a structure from a parent array saved with parents()."""
+        disjoint_set = cls()
+        disjoint_set.parent = [int(index) for index in parent]
+        disjoint_set.rank = [0] * len(disjoint_set.parent)
+        # Saved arrays are fully compressed, so every tree has height at most 1
+        for index, root in enumerate(disjoint_set.parent):
+            if root != index:
+                disjoint_set.rank[root] = 1
+        return disjoint_set
+    
+    def parents(self):
+        """Return the fully compressed parent array: the root of every index."""
+        return [self.find(index) for index in range(len(self.parent))]
+    
+    def connected(self, index_a, index_b):
+        """Check whether two indices are in the same set."""
+        return self.find(index_a) == self.find(index_b)
+    
+    def groups(self):
+        """Return the sets as lists of indices, ordered by their smallest member."""
+        members = {}
+        for index in range(len(self.parent)):
+            members.setdefault(self.find(index), []).append(index)
+        return list(members.values())
+
 def group_similar_images(embeddings, similarity_threshold=0.96, similarity_preset=None,
                         use_regions=0, model=None, processor=None, device=None,
-                        logger=None, show_progress=True):
+                        logger=None, show_progress=True, tile_size=DEFAULT_TILE_SIZE,
+                        index="exact", ann_lists=None, ann_probes=DEFAULT_ANN_PROBES,
+                        image_paths=None, candidate_pairs=None, linked_pairs=None, fast_decode=True,
+                        region_embeddings=None, vector_dtype="float32", rescore=False):
     """
     Group images based on a similarity threshold.
     
+    With region checks, the similarity of a pair is the weighted average of
+    its whole-image and per-region similarities. Region embeddings are
+    computed once per image (or passed in from the embedding store), so pairs
+    are compared as vectors like in the whole-image engine.
+    
+    When candidate_pairs is given, only those pairs are compared and all other
+    pairs are treated as dissimilar. This is how the perceptual hash tier hands
+    its uncertain band to CLIP. The pairs are consumed as they are generated
+    and scored in blocks, so the band never has to fit in memory.
+    
+    With a float16 or int8 vector_dtype the all-pairs and approximate engines
+    compare compact matrices. With rescore, pairs within the quantization
+    error of the threshold are scored again in float32, so the groups are the
+    same as with float32 vectors.
+    
     Args:
         embeddings: Dictionary mapping image paths to their embeddings
         similarity_threshold: Direct threshold value (0-1)
         similarity_preset: Named preset from SIMILARITY_PRESETS
         use_regions: Number of image regions to check for similarity (0-5)
-        model: CLIP model for region comparison (required if use_regions > 0)
-        processor: CLIP processor for region comparison (required if use_regions > 0)
-        device: Device for model inference (required if use_regions > 0)
+        model: CLIP model for region embeddings not given in region_embeddings
+        processor: CLIP processor for region embeddings not given in region_embeddings
+        device: Device for model inference of region embeddings
         logger: Logger instance
         show_progress: Whether to show progress bar
+        tile_size: Rows per block for the matrix similarity engine
+        index: "exact" for all-pairs comparison or "ann" for the approximate index;
+            region checks always compare all pairs, so "ann" is ignored with a warning
+        ann_lists: Number of inverted lists for the approximate index (default: auto)
+        ann_probes: Lists searched per image; higher improves recall but is slower
+        image_paths: Images to group (default: the keys of embeddings)
+        candidate_pairs: Optional iterable of (path_a, path_b) pairs to compare
+        linked_pairs: Optional list of (path_a, path_b) pairs merged without comparison
+        fast_decode: Decode images at reduced resolution for region checks
+        region_embeddings: Optional dictionary mapping region types to dictionaries
+            of image paths to region embeddings, from compute_region_embeddings_batch
+        vector_dtype: "float32", "float16" or "int8" matrices for the similarity engine
+        rescore: Rescore near-threshold pairs of a compact matrix in float32
         
     Returns:
         List of sets, where each set contains paths to similar images
     """
-    if not TRANSFORMERS_AVAILABLE:
-        raise ImportError("torch is required for similarity computation")
+    region_types = get_region_types(use_regions)
+    if region_embeddings is None and not (model and processor and device):
+        region_types = []
+    if candidate_pairs is None and not NUMPY_AVAILABLE:
+        raise ImportError("numpy is required for similarity computation")
         
     if logger is None:
         logger = logging.getLogger("similarity_tools")
@@ -353,50 +809,135 @@ def group_similar_images(embeddings, similarity_threshold=0.96, similarity_prese
     # Get threshold value from preset or direct value
     threshold = get_similarity_threshold(similarity_preset, similarity_threshold)
         
-    image_paths = list(embeddings.keys())
+    if image_paths is None:
+        image_paths = list(embeddings.keys())
+    elif candidate_pairs is None:
+        image_paths = [path for path in image_paths if path in embeddings]
+    else:
+        image_paths = list(image_paths)
     num_images = len(image_paths)
     
     logger.info(f"Grouping {num_images} images with similarity >= {threshold:.4f}" + 
                 (f" (preset: {similarity_preset})" if similarity_preset else ""))
     
-    # Initialize groups with each image in its own group
-    groups = [{path} for path in image_paths]
+    # Each image starts in its own set; matching pairs are merged as they arrive
+    disjoint_set = DisjointSet(num_images)
+    position = {path: idx for idx, path in enumerate(image_paths)}
     
-    # Calculate all pairwise comparisons
-    comparisons = [(i, j) for i in range(num_images) for j in range(i+1, num_images)]
+    for path_a, path_b in linked_pairs or []:
+        if path_a in position and path_b in position:
+            disjoint_set.union(position[path_a], position[path_b])
     
-    # Setup progress bar if available and requested
-    if show_progress and TQDM_AVAILABLE:
-        iterator = tqdm(comparisons, desc="Comparing images", total=len(comparisons))
+    if region_types:
+        # Embed the regions of every image that can take part in a comparison, once
+        if candidate_pairs is not None:
+            region_paths = [path for path in image_paths if path in embeddings]
+        else:
+            region_paths = image_paths
+        
+        if region_embeddings is None:
+            region_embeddings = {region_type: {} for region_type in region_types}
+        missing = [path for path in region_paths
+                   if any(path not in region_embeddings.get(region_type, {}) for region_type in region_types)]
+        if missing and model and processor and device:
+            computed = compute_region_embeddings_batch(missing, model, processor, device, regions=use_regions,
+                                                       show_progress=show_progress, fast_decode=fast_decode)
+            region_embeddings = {region_type: {**region_embeddings.get(region_type, {}), **computed[region_type]}
+                                 for region_type in region_types}
+        
+        logger.info(f"Comparing {len(region_types)} regions per image: {', '.join(region_types)}")
+    
+    if candidate_pairs is not None:
+        # Only pairs with an embedding on both sides can be compared
+        embedded = np.array([idx for idx, path in enumerate(image_paths) if path in embeddings], dtype=np.int64)
+        embedded_paths = [image_paths[idx] for idx in embedded]
+        embedded_row = {path: row for row, path in enumerate(embedded_paths)}
+        _, matrix = build_embedding_matrix(embeddings, embedded_paths)
+        region_matrices = [build_region_matrix(region_embeddings.get(region_type, {}), embeddings, embedded_paths)
+                           for region_type in region_types]
+        
+        compared = 0
+        matched = 0
+        
+        def union_block(block):
+            nonlocal compared, matched
+            rows, cols = np.array(block, dtype=np.int64).T
+            keep = score_pairs(matrix, rows, cols, chunk_size=tile_size,
+                               region_matrices=region_matrices) >= threshold
+            disjoint_set.union_pairs(embedded[rows[keep]], embedded[cols[keep]])
+            compared += len(block)
+            matched += int(keep.sum())
+        
+        block = []
+        for path_a, path_b in candidate_pairs:
+            if path_a in embedded_row and path_b in embedded_row:
+                block.append((embedded_row[path_a], embedded_row[path_b]))
+                if len(block) == CANDIDATE_BLOCK_SIZE:
+                    union_block(block)
+                    block = []
+        if block:
+            union_block(block)
+        logger.info(f"Compared {compared} candidate pairs, {matched} above threshold")
     else:
-        iterator = comparisons
-    
-    for i, j in iterator:
-        path_i = image_paths[i]
-        path_j = image_paths[j]
-        
-        # Skip if embeddings are missing
-        if path_i not in embeddings or path_j not in embeddings:
-            continue
-            
-        # Calculate similarity
-        if use_regions > 0 and model and processor and device:
-            # Use region-based similarity for more accuracy
-            sim = compute_region_similarity(path_i, path_j, model, processor, device, regions=use_regions)
+        image_paths, matrix = build_embedding_matrix(embeddings, image_paths, dtype=vector_dtype)
+        region_matrices = [build_region_matrix(region_embeddings.get(region_type, {}), embeddings, image_paths,
+                                               dtype=vector_dtype)
+                           for region_type in region_types]
+        if vector_dtype != "float32" and num_images:
+            logger.info(f"Comparing {vector_dtype} vectors: {matrix.nbytes / 1e6:.1f} MB instead of "
+                        f"{matrix.shape[0] * matrix.shape[1] * 4 / 1e6:.1f} MB per matrix")
+        
+        # Pairs within the quantization error of the threshold are decided in float32
+        margin = 0.0
+        if rescore and vector_dtype != "float32" and num_images:
+            margin = max(m.rescore_margin() for m in [matrix] + region_matrices)
+            logger.info(f"Rescoring pairs within {margin:.4f} of the threshold in float32")
+        pair_count = 0
+        rescored = 0
+        
+        def union_matches(rows, cols, sims):
+            nonlocal pair_count, rescored
+            if margin:
+                near = sims < threshold + margin
+                if near.any():
+                    exact = rescore_pairs(embeddings, image_paths, rows[near], cols[near], chunk_size=tile_size,
+                                          region_embeddings=region_embeddings, region_types=region_types)
+                    rescored += exact.size
+                    keep = ~near
+                    keep[near] = exact >= threshold
+                    rows, cols = rows[keep], cols[keep]
+            pair_count += rows.size
+            disjoint_set.union_pairs(rows, cols)
+        
+        if index == "ann" and region_types:
+            logger.warning("The approximate index does not support region checks; comparing all pairs")
+        
+        if index == "ann" and not region_types:
+            # Range queries against an approximate index instead of all pairs
+            if num_images > 1:
+                ann_index = IVFIndex(n_lists=ann_lists, n_probe=ann_probes).add(matrix)
+                logger.info(f"Built approximate index with {ann_index.n_lists} lists, "
+                            f"probing {min(ann_probes, ann_index.n_lists)} per image")
+                
+                for rows, cols, sims in ann_index.iter_similar_pairs(threshold - margin, tile_size=tile_size,
+                                                                     show_progress=show_progress):
+                    union_matches(rows, cols, sims)
+                
+                exhaustive = num_images * (num_images - 1) // 2
+                logger.info(f"Approximate index checked {ann_index.candidates_checked} candidate pairs "
+                            f"against the threshold ({100.0 * ann_index.candidates_checked / exhaustive:.2f}% "
+                            f"of {exhaustive} exhaustive pairs)")
         else:
-            # Use standard embedding similarity
-            sim = cosine_similarity(embeddings[path_i], embeddings[path_j])
-        
-        # If similar, merge groups
-        if sim >= threshold:
-            # Find which groups contain these images
-            group_i = next(g for g in groups if path_i in g)
-            group_j = next(g for g in groups if path_j in g)
-            
-            # If they're not already in the same group, merge them
-            if group_i != group_j:
-                group_i.update(group_j)
-                groups.remove(group_j)
+            # Use the tiled matrix engine over normalized embeddings
+            for rows, cols, sims in iter_similar_pairs(matrix, threshold - margin, tile_size=tile_size,
+                                                       show_progress=show_progress, region_matrices=region_matrices):
+                union_matches(rows, cols, sims)
+        
+        logger.debug(f"Matrix engine found {pair_count} pairs above threshold"
+                     + (f" ({rescored} rescored in float32)" if margin else ""))
+    
+    # Materialize the path sets once, at the end
+    groups = [{image_paths[i] for i in members} for members in disjoint_set.groups()]
     
     # Return all groups, including singletons (will be filtered later if needed)
     logger.info(f"Found {len(groups)} total groups ({len([g for g in groups if len(g) > 1])} with multiple images)")
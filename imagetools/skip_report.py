@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2025 Dustin Darcy <ScarcityHypothesis.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+skip_report.py
+
+Structured record of images skipped during a run.
+
+With header-only validation, broken images are no longer rejected during
+discovery; they fail later, when a stage actually decodes them. Each stage
+records such files here with the reason, so the run can report them in one
+place instead of scattering warnings through the log.
+"""
+
+import json
+import logging
+import threading
+from collections import Counter
+
+class SkipReport:
+    """
+    Thread-safe list of skipped images.
+
+    Each entry is a dictionary with "path", "stage" and "reason" keys.
+    """
+    def __init__(self):
+        self.entries = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, path):
+        return any(entry["path"] == path for entry in self.entries)
+
+    def add(self, path, stage, reason):
+        """Record a skipped image."""
+        with self._lock:
+            self.entries.append({"path": path, "stage": stage, "reason": str(reason)})
+
+    def paths(self):
+        """Return the set of skipped image paths."""
+        return {entry["path"] for entry in self.entries}
+
+    def counts(self):
+        """Return the number of skipped images per stage."""
+        return dict(Counter(entry["stage"] for entry in self.entries))
+
+    def log_summary(self, logger=None):
+        """Log the number of skipped images per stage."""
+        if logger is None:
+            logger = logging.getLogger("skip_report")
+        if not self.entries:
+            return
+        by_stage = ", ".join(f"{count} in {stage}" for stage, count in sorted(self.counts().items()))
+        logger.warning(f"Skipped {len(self.paths())} unreadable images ({by_stage})")
+        for entry in self.entries:
+            logger.debug(f"  {entry['stage']}: {entry['path']}: {entry['reason']}")
+
+    def write(self, report_file):
+        """Write the report as JSON."""
+        with open(report_file, "w", encoding="utf-8") as f:
+            json.dump({"counts": self.counts(), "skipped": self.entries}, f, indent=2)
@@ -21,6 +21,7 @@ import argparse
 import subprocess
 import re
 import fnmatch  # For fallback pattern matching
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
 from PIL import Image
 import sys
@@ -39,14 +40,19 @@ try:
         handle_duplicate, create_symlink, 
         reset_filename_registry, get_unique_path
     )
-    from imagetools.core_imagetools import (
-        matches_pattern, check_patterns
-    )
+    from imagetools.pattern_set import PatternSet
+    from imagetools.copy_engine import copy_stats
+    from imagetools.image_header import read_image_size
+    from imagetools.image_index import ImageIndex, INDEXED_EXIF_TAGS
+    from imagetools.exif_query import read_exif, parse_exif_predicates, exif_matches
     IMAGETOOLS_AVAILABLE = True
 except ImportError:
     IMAGETOOLS_AVAILABLE = False
 
 DEFAULT_EXTENSIONS = ['bmp', 'jpg', 'jpeg', 'png', 'webp', 'gif', 'tiff', 'tif', 'jp2', 'heif', 'heic']
+DEFAULT_THREADS = min(32, (os.cpu_count() or 1) * 4)  # Header reads wait on I/O, not CPU
+DEFAULT_INDEX_PATH = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+                                  "imgsrch", "index.sqlite")
 
 def parse_arguments():
     epilog_text = (
@@ -79,6 +85,20 @@ def parse_arguments():
         "\n"
         "  Limit search depth to 2 directory levels:\n"
         "    imgsrch.py -r --max-depth 2 -B 1080 -op gte -o results.txt\n"
+        "\n"
+        "Index examples:\n"
+        "  Build or refresh the index while searching; later runs only reread changed files:\n"
+        "    imgsrch.py -r -I -O 1080 -op gte -o results.txt\n"
+        "\n"
+        "  Query the index without walking the directories:\n"
+        "    imgsrch.py -r -I --index-only -W 3000 -op gte\n"
+        "\n"
+        "EXIF examples:\n"
+        "  Canon photos taken since 2020 at ISO 400 or below:\n"
+        "    imgsrch.py -r -ed \"Model=*Canon*\" -ed \"DateTimeOriginal>=2020-01-01\" -ed \"ISO<=400\"\n"
+        "\n"
+        "  Images with any EXIF data but without a lens model, using the index:\n"
+        "    imgsrch.py -r -I -ex -ed \"LensModel!=*\"\n"
     )
 
     parser = argparse.ArgumentParser(
@@ -98,7 +118,11 @@ def parse_arguments():
     path_group.add_argument("-r", "--recursive", action="store_true", help="Recursively search through directories.")
     path_group.add_argument("-v", "--verbosity", action="count", default=0, help="Increase output verbosity.")
     path_group.add_argument("-ex", "--exif", action="store_true", help="Search for images with EXIF data.")
-    path_group.add_argument("-ed", "--exifdetail", type=str, help="Specific EXIF detail to search for.")
+    path_group.add_argument("-ed", "--exifdetail", action="append", metavar="PREDICATE",
+                            help="EXIF condition such as Model=*Canon*, DateTimeOriginal>2020-01-01 or ISO<=400; "
+                                 "a bare tag name requires the tag (multiple allowed, all must match)")
+    path_group.add_argument("-t", "--threads", type=int, default=DEFAULT_THREADS,
+                            help=f"Number of files read in parallel (default: {DEFAULT_THREADS})")
 
     # Pattern Matching - consolidated all pattern parameters here
     pattern_group.add_argument("-e", "--ext", type=str, help="File extension to filter images.")
@@ -136,6 +160,17 @@ def parse_arguments():
                         default="hierarchical", help="Strategy for handling filename collisions.")
     output_group.add_argument("-d", "--dry-run", action="store_true", help="Preview actions without making changes.")
 
+    # Index Options
+    index_group = parser.add_argument_group('Index Options')
+    index_group.add_argument("-I", "--index", action="store_true",
+                             help="Keep sizes and EXIF tags in an SQLite index and query it; only new and changed "
+                                  "files are read again")
+    index_group.add_argument("--index-path", type=str, default=DEFAULT_INDEX_PATH,
+                             help=f"Index database file (default: {DEFAULT_INDEX_PATH})")
+    index_group.add_argument("--index-only", action="store_true",
+                             help="With --index, query without walking the directories; changes since the last "
+                                  "refresh are not seen, and only file name filters and --max-depth apply")
+
     args = parser.parse_args()
     return parser, args
 
@@ -161,38 +196,72 @@ def compare_dimension(dimension, target, operation):
     elif operation == "neq":
         return dimension != target
 
-def matches_criteria(image_path, args):
+def fallback_read_image_size(image_path):
+    """Read an image's size with Pillow; Image.open only parses the header."""
+    with Image.open(image_path) as img:
+        return img.size[0], img.size[1], img.format
+
+def dimensions_match(width, height, args):
+    # Skip the check if the parameter isn't provided
+    if args.width and not compare_dimension(width, args.width, args.operation):
+        return False
+    if args.height and not compare_dimension(height, args.height, args.operation):
+        return False
+    if args.both and not (compare_dimension(width, args.both, args.operation) and compare_dimension(height, args.both, args.operation)):
+        return False
+    if args.eitheror and not (compare_dimension(width, args.eitheror, args.operation) or compare_dimension(height, args.eitheror, args.operation)):
+        return False
+        
+    # If no dimension criteria were specified, or all were passed, return True
+    return True
+
+def scan_image(image_path, args):
+    """
+    Read one image's size and check it against the criteria. Runs in the scan pool.
+    
+    Returns:
+        tuple: (image_path, width, height, matched, error)
+    """
     try:
-        with Image.open(image_path) as img:
-            width, height = img.size
-            
-            # Skip the check if the parameter isn't provided
-            if args.width and not compare_dimension(width, args.width, args.operation):
-                return False
-            if args.height and not compare_dimension(height, args.height, args.operation):
-                return False
-            if args.both and not (compare_dimension(width, args.both, args.operation) and compare_dimension(height, args.both, args.operation)):
-                return False
-            if args.eitheror and not (compare_dimension(width, args.eitheror, args.operation) or compare_dimension(height, args.eitheror, args.operation)):
-                return False
-                
-            # If no dimension criteria were specified, or all were passed, return True
-            return True
+        if IMAGETOOLS_AVAILABLE:
+            width, height, _ = read_image_size(image_path)
+        else:
+            width, height, _ = fallback_read_image_size(image_path)
     except Exception as e:
-        if args.verbosity > 1:
-            print(f"Error processing {image_path}: {e}")
-        return False
+        return image_path, None, None, False, e
+    matched = dimensions_match(width, height, args)
+    
+    # EXIF is only read for images that passed the cheaper size check
+    predicates = getattr(args, "exif_predicates", None) or []
+    if matched and (args.exif or predicates):
+        try:
+            matched = exif_matches(read_exif(image_path), predicates, require_exif=args.exif)
+        except Exception as e:
+            return image_path, width, height, False, e
+    return image_path, width, height, matched, None
 
-def print_image_info(image_path, args):
+def matches_criteria(image_path, args):
+    _, _, _, matched, error = scan_image(image_path, args)
+    if error is not None and args.verbosity > 1:
+        print(f"Error processing {image_path}: {error}")
+    return matched
+
+def print_image_info(image_path, args, width=None, height=None):
     info = image_path
     if args.verbosity >= 1:
         try:
-            with Image.open(image_path) as img:
-                width, height = img.size
-                print(f"Dimensions: {width}x{height}")
-                if args.verbosity >= 2 and hasattr(img, "_getexif") and img._getexif():
+            if width is None or height is None:
+                width, height = scan_image(image_path, args)[1:3]
+            print(f"Dimensions: {width}x{height}")
+            if args.verbosity >= 2:
+                if IMAGETOOLS_AVAILABLE:
+                    exif = read_exif(image_path)
+                else:
+                    with Image.open(image_path) as img:
+                        exif = img.getexif()
+                if exif:
                     print("EXIF data:")
-                    for tag, value in img._getexif().items():
+                    for tag, value in exif.items():
                         print(f"  {tag}: {value}")
         except Exception as e:
             if args.verbosity > 1:
@@ -200,6 +269,36 @@ def print_image_info(image_path, args):
     
     return info
 
+def iter_scan_results(image_paths, args, num_workers=DEFAULT_THREADS):
+    """
+    Scan images in a thread pool, yielding scan_image results as they complete.
+    
+    Paths are taken from the iterable as slots free up, so the directory walk
+    runs alongside the scan and at most a few batches are in flight.
+    """
+    paths = iter(image_paths)
+    if num_workers is None or num_workers <= 1:
+        for image_path in paths:
+            yield scan_image(image_path, args)
+        return
+    
+    max_pending = num_workers * 4
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        pending = set()
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_pending:
+                image_path = next(paths, None)
+                if image_path is None:
+                    exhausted = True
+                    break
+                pending.add(executor.submit(scan_image, image_path, args))
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
 # Fallback implementations when imagetools is not available
 def fallback_create_symlink(source_path, target_path):
     """Create a symbolic link with fallback for when imagetools is not available."""
@@ -243,30 +342,48 @@ def fallback_handle_duplicate(source_path, target_path, mode="copy", collision_s
     
     return target_path
 
-def fallback_check_patterns(item, include_patterns=None, exclude_patterns=None, pattern_mode="glob"):
-    """Fallback implementation of check_patterns when imagetools is not available."""
-    # If exclude patterns exist, none must match
-    if exclude_patterns:
-        exclude_match = any(fallback_matches_pattern(item, [p], pattern_mode) for p in exclude_patterns)
-        if exclude_match:
-            return False
-            
-    # If include patterns exist, one must match
-    if include_patterns:
-        include_match = any(fallback_matches_pattern(item, [p], pattern_mode) for p in include_patterns)
-        if not include_match:
-            return False
-            
-    return True
 def fallback_matches_pattern(name, patterns, mode="glob"):
     """Fallback implementation when imagetools is not available."""
-    if not patterns:
-        return False
+    for pattern in patterns or []:
+        if mode == "regex":
+            try:
+                if re.search(pattern, name):
+                    return True
+            except re.error:
+                continue  # Invalid patterns never match, as in PatternSet
+        elif fnmatch.fnmatch(name, pattern):
+            return True
+    return False
+
+class FallbackPatternSet:
+    """Fallback implementation of PatternSet, matching each pattern separately."""
+    def __init__(self, include_dirs=None, exclude_dirs=None, include_files=None, exclude_files=None,
+                 include_pattern=None, exclude_pattern=None, exclude_paths=None, pattern_mode="glob"):
+        general_exclude = list(exclude_pattern or [])
+        self.pattern_mode = pattern_mode
+        self.dir_include = include_dirs or include_pattern
+        self.dir_exclude = list(exclude_dirs or []) + general_exclude
+        self.file_include = include_files
+        self.file_general_include = include_pattern
+        self.file_exclude = list(exclude_files or []) + general_exclude
+        self.exclude_paths = [os.path.normcase(os.path.abspath(path)).rstrip(os.sep) for path in exclude_paths or []]
+    
+    def match_dir(self, name):
+        if fallback_matches_pattern(name, self.dir_exclude, self.pattern_mode):
+            return False
+        return not self.dir_include or fallback_matches_pattern(name, self.dir_include, self.pattern_mode)
+    
+    def match_file(self, name):
+        if fallback_matches_pattern(name, self.file_exclude, self.pattern_mode):
+            return False
+        if self.file_include and not fallback_matches_pattern(name, self.file_include, self.pattern_mode):
+            return False
+        return (not self.file_general_include or
+                fallback_matches_pattern(name, self.file_general_include, self.pattern_mode))
     
-    if mode == "glob":
-        return any(fnmatch.fnmatch(name, p) for p in patterns)
-    else:  # regex
-        return any(re.search(p, name) for p in patterns)
+    def is_excluded_path(self, path):
+        path = os.path.normcase(os.path.abspath(path))
+        return any(path == excluded or path.startswith(excluded + os.sep) for excluded in self.exclude_paths)
 
 def process_matching_file(file_path, output_dir, action, structure, base_path, collision_strategy, dry_run=False):
     """
@@ -317,16 +434,22 @@ def process_matching_file(file_path, output_dir, action, structure, base_path, c
     
     return output_path
 
-def search_images(start_path, args):
-    matched_files = []
-    output_file = None
-    
-    # Open output file once if specified
-    if args.output and args.action == "list":
-        output_file = open(args.output, "w", encoding="utf-8")
-    
-    # Get list of files to process
-    all_files = []
+def build_pattern_set(args):
+    """Compile all include/exclude patterns once."""
+    pattern_set = PatternSet if IMAGETOOLS_AVAILABLE else FallbackPatternSet
+    return pattern_set(
+        include_dirs=args.include_dirs,
+        include_files=args.include_files,
+        exclude_files=args.exclude_files,
+        include_pattern=args.include_pattern,
+        exclude_pattern=args.exclude_pattern,
+        exclude_paths=args.exclude,
+        pattern_mode=args.pattern_mode
+    )
+
+def iter_image_files(start_path, args):
+    """Walk the search path and yield the image files that pass the filters."""
+    patterns = build_pattern_set(args)
     
     for root, dirs, files in os.walk(start_path):
         # Calculate current depth for max_depth filtering
@@ -334,122 +457,19 @@ def search_images(start_path, args):
         current_depth = 0 if rel_path == '.' else rel_path.count(os.sep) + 1
         
         # Skip excluded directories (traditional method)
-        if args.exclude is not None and any(os.path.abspath(root).startswith(os.path.abspath(excluded_dir)) 
-                                           for excluded_dir in args.exclude):
+        if patterns.is_excluded_path(root):
             dirs.clear()  # Skip this branch entirely
             continue
-            
-        # Apply directory pattern filtering
-        dir_basename = os.path.basename(root)
-        
-        # Check directory exclusion and inclusion patterns
-        if args.exclude_pattern or args.include_dirs:
-            if IMAGETOOLS_AVAILABLE:
-                dir_pattern_match = check_patterns(
-                    dir_basename, 
-                    include_patterns=args.include_dirs, 
-                    exclude_patterns=args.exclude_pattern, 
-                    pattern_mode=args.pattern_mode
-                )
-            else:
-                dir_pattern_match = fallback_check_patterns(
-                    dir_basename,
-                    include_patterns=args.include_dirs,
-                    exclude_patterns=args.exclude_pattern,
-                    pattern_mode=args.pattern_mode
-                )
-                
-            if not dir_pattern_match and current_depth > 0:  # Don't skip root directory
-                dirs.clear()  # Skip this directory
-                continue
         
         # Filter directories list in-place to prevent descent into excluded dirs
-        i = 0
-        while i < len(dirs):
-            dir_name = dirs[i]
-            
-            # Handle exclusions and inclusions
-            if args.exclude_pattern or args.include_dirs or args.include_pattern:
-                include_match = True
-                exclude_match = False
-                
-                # Check if directory should be excluded
-                if args.exclude_pattern:
-                    if IMAGETOOLS_AVAILABLE:
-                        exclude_match = any(matches_pattern(dir_name, p, args.pattern_mode) for p in args.exclude_pattern)
-                    else:
-                        exclude_match = fallback_matches_pattern(dir_name, args.exclude_pattern, args.pattern_mode)
-                
-                # Traditional exclude by path prefix
-                if args.exclude and any(os.path.abspath(os.path.join(root, dir_name)).startswith(
-                       os.path.abspath(excluded_dir)) for excluded_dir in args.exclude):
-                    exclude_match = True
-                
-                # Check if directory matches include patterns (if specified)
-                if args.include_dirs:
-                    if IMAGETOOLS_AVAILABLE:
-                        include_match = any(matches_pattern(dir_name, p, args.pattern_mode) for p in args.include_dirs)
-                    else:
-                        include_match = fallback_matches_pattern(dir_name, args.include_dirs, args.pattern_mode)
-                
-                # Check general include patterns
-                elif args.include_pattern:
-                    if IMAGETOOLS_AVAILABLE:
-                        include_match = any(matches_pattern(dir_name, p, args.pattern_mode) for p in args.include_pattern)
-                    else:
-                        include_match = fallback_matches_pattern(dir_name, args.include_pattern, args.pattern_mode)
-                
-                # Exclusion takes precedence over inclusion
-                if exclude_match or (not include_match and (args.include_dirs or args.include_pattern)):
-                    del dirs[i]
-                    continue
-            
-            i += 1
+        dirs[:] = [d for d in dirs if patterns.match_dir(d) and
+                   not patterns.is_excluded_path(os.path.join(root, d))]
             
         # Process files in current directory before limiting depth
         for file in files:
-            # Check file exclusion patterns first
-            exclude_file = False
-            include_file = True
-            
-            if args.exclude_files:
-                if IMAGETOOLS_AVAILABLE:
-                    exclude_file = any(matches_pattern(file, p, args.pattern_mode) for p in args.exclude_files)
-                else:
-                    exclude_file = fallback_matches_pattern(file, args.exclude_files, args.pattern_mode)
-            
-            if args.exclude_pattern:
-                if IMAGETOOLS_AVAILABLE:
-                    exclude_file = exclude_file or any(matches_pattern(file, p, args.pattern_mode) for p in args.exclude_pattern)
-                else:
-                    exclude_file = exclude_file or fallback_matches_pattern(file, args.exclude_pattern, args.pattern_mode)
-            
-            if exclude_file:
-                continue
-            
-            # Check file inclusion patterns if specified
-            if args.include_files:
-                if IMAGETOOLS_AVAILABLE:
-                    include_file = any(matches_pattern(file, p, args.pattern_mode) for p in args.include_files)
-                else:
-                    include_file = fallback_matches_pattern(file, args.include_files, args.pattern_mode)
-                
-                if not include_file:
-                    continue
-            
-            if args.include_pattern:
-                if IMAGETOOLS_AVAILABLE:
-                    include_file = include_file and any(matches_pattern(file, p, args.pattern_mode) for p in args.include_pattern)
-                else:
-                    include_file = include_file and fallback_matches_pattern(file, args.include_pattern, args.pattern_mode)
-                
-                if not include_file:
-                    continue
-            
             # If it passes all pattern checks, check if it's an image file
-            if is_image_file(file, args.ext, args.filemask):
-                full_path = os.path.join(root, file)
-                all_files.append(full_path)
+            if patterns.match_file(file) and is_image_file(file, args.ext, args.filemask):
+                yield os.path.join(root, file)
         
         # Now limit directory traversal depth *after* processing files in the current directory
         if args.max_depth is not None and current_depth >= args.max_depth:
@@ -457,12 +477,84 @@ def search_images(start_path, args):
                 
         if not args.recursive:
             break
+
+def exif_selected(image_path, predicates):
+    """Check EXIF predicates the index can't answer against the file itself."""
+    try:
+        return exif_matches(read_exif(image_path), predicates)
+    except Exception:
+        return False
+
+def iter_index_results(start_path, args):
+    """
+    Answer the dimension and EXIF criteria from the image index, refreshing it first.
+    
+    EXIF predicates on tags outside the index are checked by reading the
+    matching files in the scan pool. Yields scan_image-style results for
+    every image considered.
+    """
+    predicates = getattr(args, "exif_predicates", None) or []
+    indexed = [predicate for predicate in predicates if predicate.tag in INDEXED_EXIF_TAGS]
+    remaining = [predicate for predicate in predicates if predicate.tag not in INDEXED_EXIF_TAGS]
+    
+    with ImageIndex(args.index_path) as index:
+        if args.index_only:
+            root = os.path.abspath(start_path)
+            patterns = build_pattern_set(args)
+            paths = [path for path in index.paths(root) if index_path_selected(path, root, args, patterns)]
+        else:
+            paths, updated = index.refresh(iter_image_files(start_path, args), root=start_path,
+                                           num_workers=args.threads)
+            if args.verbosity > 0:
+                print(f"Index: {updated} new or changed images read, {len(paths) - updated} unchanged")
+        
+        matches = {path: (width, height) for path, width, height in index.query(
+            start_path, width=args.width, height=args.height, both=args.both,
+            eitheror=args.eitheror, operation=args.operation,
+            exif_predicates=indexed, require_exif=args.exif)}
+    
+    if remaining:
+        candidates = [path for path in paths if path in matches]
+        with ThreadPoolExecutor(max_workers=max(1, args.threads)) as executor:
+            selected = executor.map(exif_selected, candidates, [remaining] * len(candidates))
+            for path, keep in zip(candidates, selected):
+                if not keep:
+                    del matches[path]
+    
+    for path in paths:
+        width, height = matches.get(path, (None, None))
+        yield path, width, height, path in matches, None
+
+def index_path_selected(path, root, args, patterns=None):
+    """Apply the file name filters and --max-depth to a path from the index."""
+    filename = os.path.basename(path)
+    if (patterns is not None and not patterns.match_file(filename)) or not is_image_file(filename, args.ext, args.filemask):
+        return False
+    rel_dir = os.path.relpath(os.path.dirname(path), root)
+    depth = 0 if rel_dir == '.' else rel_dir.count(os.sep) + 1
+    if not args.recursive and depth > 0:
+        return False
+    return args.max_depth is None or depth <= args.max_depth
+
+def search_images(start_path, args):
+    matched_files = []
+    output_file = None
+    
+    # Open output file once if specified
+    if args.output and args.action == "list":
+        output_file = open(args.output, "w", encoding="utf-8")
+    
+    # Files are read in parallel while the walk is still finding them
+    if args.index:
+        results = iter_index_results(start_path, args)
+    else:
+        results = iter_scan_results(iter_image_files(start_path, args), args, num_workers=args.threads)
     
     # Process files with progress bar if available
-    if TQDM_AVAILABLE and len(all_files) > 10:
-        file_iterator = tqdm(all_files, desc="Processing images")
+    if TQDM_AVAILABLE and sys.stdout.isatty():
+        file_iterator = tqdm(results, desc="Processing images", unit=" files")
     else:
-        file_iterator = all_files
+        file_iterator = results
         
     # Statistics tracking
     stats = {
@@ -472,17 +564,22 @@ def search_images(start_path, args):
         "actions": 0
     }
     
-    for full_path in file_iterator:
+    for full_path, width, height, matched, error in file_iterator:
         stats["processed"] += 1
+        if error is not None:
+            if args.verbosity > 1:
+                print(f"Error processing {full_path}: {error}")
+            continue
         try:
-            if matches_criteria(full_path, args):
+            if matched:
                 matched_files.append(full_path)
                 stats["matched"] += 1
                 
-                # Print or write info
-                info = print_image_info(full_path, args)
+                # Print or write info; results are written as they complete
+                info = print_image_info(full_path, args, width, height)
                 if output_file:
                     output_file.write(info + "\n")
+                    output_file.flush()
                 elif args.action == "list" and not args.verbosity:
                     print(info)
                 
@@ -522,6 +619,8 @@ def search_images(start_path, args):
             print(f"  {args.action.capitalize()} operations that would be performed: {stats['matched']}")
         else:
             print(f"  {args.action.capitalize()} operations performed: {stats['actions']}")
+            if IMAGETOOLS_AVAILABLE and copy_stats:
+                print(f"  Copy methods: {copy_stats.summary()}")
             
     return matched_files
 
@@ -545,6 +644,20 @@ def main():
             # Reset the filename registry to avoid conflicts
             reset_filename_registry()
     
+    if not IMAGETOOLS_AVAILABLE and args.index:
+        print("Error: --index requires the imagetools module")
+        return 1
+    
+    if not IMAGETOOLS_AVAILABLE and (args.exif or args.exifdetail):
+        print("Error: --exif and --exifdetail require the imagetools module")
+        return 1
+    
+    try:
+        args.exif_predicates = parse_exif_predicates(args.exifdetail) if IMAGETOOLS_AVAILABLE else []
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    
     if not IMAGETOOLS_AVAILABLE and args.action != "list" and not args.dry_run:
         print("Warning: imagetools module not available, falling back to basic file operations")
     
@@ -34,7 +34,8 @@ from tests.common import (
     TempTestDir,
     ensure_test_directory,
     TEST_IMAGES_DIR,
-    logger
+    logger,
+    cit
 )
 
 @image_test
@@ -179,6 +180,289 @@ def test_dryrun_mode() -> Tuple[int, str, str, str]:
         
         return returncode, output_dir, stdout, stderr
 
+@image_test
+def test_header_validation() -> bool:
+    """Test that header-only validation defers broken images to the skip report."""
+    import json
+    from PIL import Image
+
+    with TempTestDir(prefix="header_validation_") as temp_test:
+        image_dir = temp_test.create_subdir("images")
+        for idx in range(2):
+            Image.new("RGB", (64, 48), (40 * idx, 90, 30)).save(os.path.join(image_dir, f"good_{idx}.png"))
+        broken = os.path.join(image_dir, "broken.jpg")
+        with open(broken, "wb") as f:
+            f.write(b"\xff\xd8\xff\xe0" + b"\x00" * 200)
+        with open(os.path.join(image_dir, "fake.png"), "w") as f:
+            f.write("not an image")
+
+        full = cit.find_images([image_dir], validation="full")
+        header = cit.find_images([image_dir], validation="header")
+        if broken in full or broken not in header or len(header) != 3:
+            logger.error(f"Unexpected validation results: full={full}, header={header}")
+            return False
+
+        report_file = os.path.join(temp_test.get_path(), "skipped.json")
+        returncode, stdout, stderr = run_find_best_images(
+            image_dir,
+            os.path.join(temp_test.get_path(), "output"),
+            extra_args=["--hash-only", "--dryrun", "--skip-report", report_file]
+        )
+        if returncode != 0 or not os.path.exists(report_file):
+            logger.error(f"Run with skip report failed: {stderr}")
+            return False
+
+        with open(report_file) as f:
+            report = json.load(f)
+        stages = {(os.path.basename(entry["path"]), entry["stage"]) for entry in report["skipped"]}
+        return stages == {("fake.png", "discovery"), ("broken.jpg", "perceptual_hash")}
+
+@image_test
+def test_resume_from_checkpoint() -> bool:
+    """Test that a resumed run reuses the checkpoints and skips journaled output operations."""
+    import json
+    from PIL import Image
+
+    def output_files(output_dir):
+        files = []
+        for root, dirs, names in os.walk(output_dir):
+            dirs[:] = [name for name in dirs if not name.startswith(".")]  # Skip stores and checkpoints
+            files.extend(os.path.join(root, name) for name in names)
+        return sorted(files)
+
+    with TempTestDir(prefix="resume_") as temp_test:
+        image_dir = temp_test.create_subdir("images")
+        for idx in range(2):
+            image = Image.new("RGB", (64, 48), (200 * idx, 60, 30))
+            image.save(os.path.join(image_dir, f"image_{idx}.png"))
+            image.resize((32, 24)).save(os.path.join(image_dir, f"image_{idx}_small.png"))
+        output_dir = os.path.join(temp_test.get_path(), "output")
+
+        returncode, stdout, stderr = run_find_best_images(image_dir, output_dir, extra_args=["--hash-only", "-v"])
+        manifest = cit.RunManifest.load(os.path.join(output_dir, ".run"))
+        if returncode != 0 or manifest is None or not manifest.reached("complete"):
+            logger.error(f"Run did not complete its manifest: {stderr}")
+            return False
+        journal = manifest.journal()
+        files = output_files(output_dir)
+        if len(journal) != len(files):
+            logger.error(f"Journaled {len(journal)} operations for {len(files)} output files")
+            return False
+
+        # Pretend the run was interrupted after grouping
+        manifest.set_stage("grouped")
+        returncode, stdout, stderr = run_find_best_images(image_dir, output_dir,
+                                                          extra_args=["--hash-only", "--resume", "-v"])
+        output = stdout + stderr
+        if returncode != 0 or "Resuming with 2 groups from checkpoint" not in output:
+            logger.error(f"Resumed run did not use the group checkpoint: {output}")
+            return False
+        if f"Skipping {len(files)} output operations" not in output or output_files(output_dir) != files:
+            logger.error("Resumed run repeated journaled output operations")
+            return False
+
+        # Changed options invalidate the checkpoints
+        cit.RunManifest.load(os.path.join(output_dir, ".run")).set_stage("grouped")
+        returncode, stdout, stderr = run_find_best_images(image_dir, output_dir,
+                                                          extra_args=["--hash-only", "--resume", "-v",
+                                                                      "--similarity-threshold", "0.5"])
+        return returncode == 0 and "Options changed since the interrupted run" in stdout + stderr
+
+@image_test
+def test_plan_report_and_undo() -> bool:
+    """Test that a dry run reports its planned operations and --undo reverses a run."""
+    import json
+    from PIL import Image
+
+    with TempTestDir(prefix="undo_") as temp_test:
+        image_dir = temp_test.create_subdir("images")
+        for idx in range(2):
+            image = Image.new("RGB", (64, 48), (200 * idx, 60, 30))
+            image.save(os.path.join(image_dir, f"image_{idx}.png"))
+            image.resize((32, 24)).save(os.path.join(image_dir, f"image_{idx}_small.png"))
+        image_files = sorted(os.listdir(image_dir))
+        output_dir = os.path.join(temp_test.get_path(), "output")
+        report_path = os.path.join(temp_test.get_path(), "plan.jsonl")
+
+        returncode, stdout, stderr = run_find_best_images(image_dir, output_dir,
+                                                          extra_args=["--hash-only", "--dryrun", "--copy-best",
+                                                                      "--plan-report", report_path])
+        with open(report_path, 'r', encoding='utf-8') as f:
+            planned = [json.loads(line) for line in f]
+        # Two groups: a best image and two candidates each
+        if returncode != 0 or os.path.exists(output_dir) or len(planned) != 6:
+            logger.error(f"Dry run planned {len(planned)} operations: {stderr}")
+            return False
+        if not all(entry.get("planned") for entry in planned):
+            logger.error("Dry run report has entries not marked as planned")
+            return False
+
+        returncode, stdout, stderr = run_find_best_images(image_dir, output_dir,
+                                                          extra_args=["--hash-only", "--copy-best"])
+        if returncode != 0 or not os.path.isdir(os.path.join(output_dir, ".run")):
+            logger.error(f"Run failed: {stderr}")
+            return False
+
+        returncode, stdout, stderr = run_find_best_images([], output_dir, extra_args=["--undo", "-v"])
+        leftover = [name for name in os.listdir(output_dir) if name != ".embedding_store"]
+        if returncode != 0 or leftover:
+            logger.error(f"Undo left {leftover}: {stdout + stderr}")
+            return False
+        return sorted(os.listdir(image_dir)) == image_files
+
+@image_test
+def test_header_image_size() -> bool:
+    """Test that header-only sizes match Pillow for every parsed format."""
+    from PIL import Image
+    from imagetools.image_header import read_header_size, read_image_size
+
+    with TempTestDir(prefix="header_size_") as temp_test:
+        for width, height in ((1920, 1080), (37, 5000)):
+            image = Image.new("RGB", (width, height), (10, 20, 30))
+            for fmt, name, options in (("JPEG", "baseline.jpg", {}), ("JPEG", "progressive.jpg", {"progressive": True}),
+                                       ("PNG", "image.png", {}), ("GIF", "image.gif", {}), ("BMP", "image.bmp", {}),
+                                       ("WEBP", "lossy.webp", {}), ("WEBP", "lossless.webp", {"lossless": True})):
+                path = os.path.join(temp_test.get_path(), f"{width}x{height}_{name}")
+                image.save(path, fmt, **options)
+                if read_header_size(path) != (width, height, fmt):
+                    logger.error(f"Header size of {path} is {read_header_size(path)}")
+                    return False
+
+            # Formats without a header parser fall back to Pillow
+            path = os.path.join(temp_test.get_path(), f"{width}x{height}.tif")
+            image.save(path, "TIFF")
+            if read_header_size(path) is not None or read_image_size(path) != (width, height, "TIFF"):
+                logger.error(f"Pillow fallback returned {read_image_size(path)} for {path}")
+                return False
+
+        # One segment walk serves the SOF size read and the EXIF lookup
+        from imagetools.image_header import iter_jpeg_segments
+        exif = Image.Exif()
+        exif[0x0110] = "Walker"
+        path = os.path.join(temp_test.get_path(), "exif.jpg")
+        Image.new("RGB", (300, 200)).save(path, "JPEG", exif=exif, icc_profile=os.urandom(4000))
+        with open(path, 'rb') as f:
+            markers = [marker for marker, _ in iter_jpeg_segments(f)]
+        order = [markers.index(marker) if marker in markers else -1 for marker in (0xE1, 0xE2, 0xC0, 0xDA)]
+        if not 0 <= order[0] < order[1] < order[2] < order[3] == len(markers) - 1:
+            logger.error(f"Unexpected JPEG segments: {[hex(marker) for marker in markers]}")
+            return False
+        return read_header_size(path) == (300, 200, "JPEG") and cit.read_exif(path).get("Model") == "Walker"
+
+@image_test
+def test_image_index() -> bool:
+    """Test that the image index answers size queries and only rereads changed files."""
+    from PIL import Image
+
+    with TempTestDir(prefix="image_index_") as temp_test:
+        image_dir = temp_test.create_subdir("images")
+        sizes = {"wide.png": (2000, 50), "large.jpg": (1920, 1080), "small.gif": (100, 100)}
+        for name, size in sizes.items():
+            Image.new("RGB", size).save(os.path.join(image_dir, name))
+        paths = [os.path.join(image_dir, name) for name in sorted(sizes)]
+
+        with cit.ImageIndex(os.path.join(temp_test.get_path(), "index.sqlite")) as index:
+            seen, updated = index.refresh(paths, root=image_dir)
+            matches = [os.path.basename(row[0]) for row in index.query(image_dir, eitheror=1080, operation="gte")]
+            if updated != 3 or matches != ["large.jpg", "wide.png"]:
+                logger.error(f"First refresh read {updated} images and matched {matches}")
+                return False
+
+            # Only the edited image is read again; the deleted one is pruned
+            Image.new("RGB", (50, 2000)).save(os.path.join(image_dir, "small.gif"))
+            os.remove(os.path.join(image_dir, "wide.png"))
+            seen, updated = index.refresh([path for path in paths if os.path.exists(path)], root=image_dir)
+            matches = [row[1:] for row in index.query(image_dir, height=2000)]
+            return updated == 1 and len(index) == 2 and matches == [(50, 2000)]
+
+@image_test
+def test_exif_query() -> bool:
+    """Test that EXIF predicates select the same images read directly and from the index."""
+    from PIL import Image
+
+    with TempTestDir(prefix="exif_query_") as temp_test:
+        image_dir = temp_test.create_subdir("images")
+        cameras = {"canon.jpg": ("Canon EOS R5", "2021:06:01 10:00:00", 200),
+                   "nikon.jpg": ("NIKON Z 6", "2019:03:15 08:30:00", 3200),
+                   "old_canon.jpg": ("Canon EOS 5D", "2008:01:01 12:00:00", 400)}
+        for name, (model, taken, iso) in cameras.items():
+            exif = Image.Exif()
+            exif[0x0110] = model
+            exif.get_ifd(0x8769)[0x9003] = taken
+            exif.get_ifd(0x8769)[0x8827] = iso
+            Image.new("RGB", (64, 48)).save(os.path.join(image_dir, name), exif=exif)
+        Image.new("RGB", (64, 48)).save(os.path.join(image_dir, "plain.jpg"))
+        # EXIF with no indexed tag still counts as EXIF
+        artist = Image.Exif()
+        artist[0x013B] = "Someone"
+        Image.new("RGB", (64, 48)).save(os.path.join(image_dir, "artist_only.jpg"), exif=artist)
+        paths = sorted(os.path.join(image_dir, name) for name in os.listdir(image_dir))
+
+        predicates = cit.parse_exif_predicates(["Model=*canon*", "Date>=2020-01-01", "ISO<=400"])
+        direct = [os.path.basename(path) for path in paths if cit.exif_matches(cit.read_exif(path), predicates)]
+        negated = cit.parse_exif_predicates(["Model!=*Canon*"])
+        without = [os.path.basename(path) for path in paths
+                   if cit.exif_matches(cit.read_exif(path), negated, require_exif=True)]
+        if direct != ["canon.jpg"] or without != ["artist_only.jpg", "nikon.jpg"]:
+            logger.error(f"Direct EXIF matches: {direct}, without Canon: {without}")
+            return False
+
+        # A date without a time covers the whole day of a timestamp
+        day_cases = {"Date=2008-01-01": ["old_canon.jpg"], "Date<=2008-01-01": ["old_canon.jpg"],
+                     "Date>2008-01-01": ["canon.jpg", "nikon.jpg"]}
+        for text, expected in day_cases.items():
+            day = cit.parse_exif_predicates([text])
+            matched = [os.path.basename(path) for path in paths if cit.exif_matches(cit.read_exif(path), day)]
+            if matched != expected:
+                logger.error(f"Direct {text} matched {matched}, expected {expected}")
+                return False
+
+        with cit.ImageIndex(os.path.join(temp_test.get_path(), "index.sqlite")) as index:
+            index.refresh(paths, root=image_dir)
+            indexed = [os.path.basename(row[0]) for row in index.query(image_dir, exif_predicates=predicates)]
+            indexed_without = [os.path.basename(row[0]) for row in
+                               index.query(image_dir, exif_predicates=negated, require_exif=True)]
+            indexed_days = {text: [os.path.basename(row[0]) for row in
+                                   index.query(image_dir, exif_predicates=cit.parse_exif_predicates([text]))]
+                            for text in day_cases}
+        if indexed != direct or indexed_without != without:
+            logger.error(f"Indexed EXIF matches: {indexed}, without Canon: {indexed_without}")
+            return False
+        if indexed_days != day_cases:
+            logger.error(f"Indexed date matches {indexed_days}, expected {day_cases}")
+            return False
+
+        try:
+            cit.ExifPredicate("Modle=Canon")
+        except ValueError as e:
+            return "Model" in str(e)
+        return False
+
+@image_test
+def test_copy_engine() -> bool:
+    """Test that every copy method produces an identical copy and is counted."""
+    with TempTestDir(prefix="copy_engine_") as temp_test:
+        source = os.path.join(temp_test.get_path(), "source.bin")
+        data = os.urandom(3 * 1024 * 1024 + 17)
+        with open(source, "wb") as f:
+            f.write(data)
+        os.utime(source, (1_600_000_000, 1_600_000_000))
+
+        cit.reset_copy_stats()
+        for method in cit.available_methods():
+            destination = os.path.join(temp_test.get_path(), f"copy_{method}.bin")
+            used = cit.copy_file(source, destination, methods=[method, "buffered"])
+            with open(destination, "rb") as f:
+                copied = f.read()
+            if used not in (method, "buffered") or copied != data:
+                logger.error(f"{method} copy used {used} and copied {len(copied)} of {len(data)} bytes")
+                return False
+            if int(os.path.getmtime(destination)) != 1_600_000_000:
+                logger.error(f"{method} copy did not keep the modification time")
+                return False
+        logger.info(f"Copy methods: {cit.copy_stats.summary()}")
+        return len(cit.copy_stats) == len(cit.available_methods())
+
 if __name__ == "__main__":
     # Run tests when script is executed directly
     results = []
@@ -187,7 +471,14 @@ if __name__ == "__main__":
         test_basic_functionality,
         test_recursive_option,
         test_error_handling,
-        test_dryrun_mode
+        test_dryrun_mode,
+        test_header_validation,
+        test_resume_from_checkpoint,
+        test_plan_report_and_undo,
+        test_header_image_size,
+        test_image_index,
+        test_exif_query,
+        test_copy_engine
     ]
     
     for test_func in tests:
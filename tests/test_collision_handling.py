@@ -336,6 +336,36 @@ def test_multiple_collisions() -> Tuple[int, str, str, str]:
         
         return returncode, output_dir, stdout, stderr
 
+@image_test
+def test_collision_index() -> bool:
+    """Test that the collision index seeds from disk and hands out unique names across threads."""
+    from concurrent.futures import ThreadPoolExecutor
+    from imagetools.file_operations import CollisionIndex
+
+    with TempTestDir(prefix="collision_index_") as temp_test:
+        out_dir = temp_test.create_subdir("out")
+        for name in ("photo.jpg", "photo_col_1.jpg"):
+            open(os.path.join(out_dir, name), "w").close()
+
+        index = CollisionIndex(out_dir)
+        dest = os.path.join(out_dir, "photo.jpg")
+        numeric = [os.path.basename(index.unique_path(dest, collision_strategy="numeric")) for _ in range(2)]
+        if numeric != ["photo_col_2.jpg", "photo_col_3.jpg"]:
+            logger.error(f"Numeric suffixes did not skip existing names: {numeric}")
+            return False
+
+        source = os.path.join(temp_test.get_path(), "album", "photo.jpg")
+        hierarchical = [os.path.basename(index.unique_path(dest, source)) for _ in range(3)]
+        if hierarchical[0] != "photo_album.jpg" or hierarchical[2] != "photo_col_4.jpg":
+            logger.error(f"Unexpected hierarchical names: {hierarchical}")
+            return False
+
+        # Parallel workers asking for the same name all get different ones
+        other = os.path.join(out_dir, "sub", "shared.png")
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            paths = list(executor.map(lambda _: index.unique_path(other, collision_strategy="numeric"), range(200)))
+        return len(set(paths)) == 200 and other in paths
+
 if __name__ == "__main__":
     # Run tests when script is executed directly
     results = []
@@ -345,7 +375,8 @@ if __name__ == "__main__":
         test_hash_strategy,
         test_numeric_strategy,
         test_parent_only_strategy,
-        test_multiple_collisions
+        test_multiple_collisions,
+        test_collision_index
     ]
     
     for test_func in tests:
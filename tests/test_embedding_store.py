@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2025 Dustin Darcy <ScarcityHypothesis.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+tests/test_embedding_store.py
+
+Tests for the persistent embedding store used by find_best_images.py.
+Tests reuse across runs, invalidation of modified files, and compaction,
+the exact-duplicate pre-pass built on the same content hashes, and the
+grouping state used by incremental updates.
+"""
+
+import os
+import sys
+import time
+from typing import Tuple, List, Dict
+
+# Import common utilities
+from tests.common import (
+    image_test,
+    TempTestDir,
+    logger,
+    cit
+)
+
+def create_fake_images(directory: str, count: int) -> List[str]:
+    """Create small placeholder files; the store only needs stat data."""
+    paths = []
+    for idx in range(count):
+        path = os.path.join(directory, f"image_{idx}.jpg")
+        with open(path, 'wb') as f:
+            f.write(b"\0" * (idx + 1))
+        paths.append(path)
+    return paths
+
+@image_test
+def test_store_reuse() -> bool:
+    """Test that stored embeddings are reused by a new store instance."""
+    import numpy as np
+    
+    with TempTestDir(prefix="embedding_store_reuse_") as temp_test:
+        images = create_fake_images(temp_test.create_subdir("images"), 4)
+        store_dir = os.path.join(temp_test.get_path(), "store")
+        
+        store = cit.EmbeddingStore(store_dir)
+        cached, missing = store.get_many(images)
+        if cached or len(missing) != len(images):
+            logger.error("A new store should not contain any embeddings")
+            return False
+        
+        store.append({path: np.full(8, idx, dtype=np.float32) for idx, path in enumerate(images)})
+        
+        reopened = cit.EmbeddingStore(store_dir)
+        cached, missing = reopened.get_many(images)
+        if missing:
+            logger.error(f"Expected all embeddings to be reused, missing {len(missing)}")
+            return False
+        
+        return all(float(cached[path][0]) == idx for idx, path in enumerate(images))
+
+@image_test
+def test_store_detects_modified_files() -> bool:
+    """Test that an edited file is recomputed and compaction drops the stale row."""
+    import numpy as np
+    
+    with TempTestDir(prefix="embedding_store_modified_") as temp_test:
+        images = create_fake_images(temp_test.create_subdir("images"), 3)
+        store_dir = os.path.join(temp_test.get_path(), "store")
+        
+        store = cit.EmbeddingStore(store_dir)
+        store.append({path: np.zeros(8, dtype=np.float32) for path in images})
+        
+        # Change size and modification time of one image
+        time.sleep(0.01)
+        with open(images[1], 'ab') as f:
+            f.write(b"edited")
+        
+        _, missing = store.get_many(images)
+        if missing != [images[1]]:
+            logger.error(f"Expected only the edited file to be missing, got {missing}")
+            return False
+        
+        store.append({images[1]: np.ones(8, dtype=np.float32)})
+        if store.stale_rows != 1 or store.compact() != 1:
+            logger.error("Expected one stale row to be compacted")
+            return False
+        
+        cached, missing = cit.EmbeddingStore(store_dir).get_many(images)
+        return not missing and float(cached[images[1]][0]) == 1.0
+
+@image_test
+def test_store_decode_mode() -> bool:
+    """Test that a store written with one decode mode is not reused with the other."""
+    import numpy as np
+    
+    with TempTestDir(prefix="embedding_store_decode_") as temp_test:
+        images = create_fake_images(temp_test.create_subdir("images"), 2)
+        store_dir = os.path.join(temp_test.get_path(), "store")
+        
+        store = cit.EmbeddingStore(store_dir, fast_decode=True)
+        store.append({path: np.full(8, idx, dtype=np.float32) for idx, path in enumerate(images)})
+        store.append_perceptual_hashes({images[0]: 1}, "phash")
+        
+        full = cit.EmbeddingStore(store_dir, fast_decode=False)
+        cached, missing = full.get_many(images)
+        if cached or len(missing) != 2 or full.get_perceptual_hashes(images, "phash")[0]:
+            logger.error(f"Fast decode embeddings reused for full decoding: {list(cached)}")
+            return False
+        
+        # The first write replaces the old store instead of appending to it
+        full.append({images[0]: np.full(8, 5, dtype=np.float32)})
+        reopened = cit.EmbeddingStore(store_dir, fast_decode=False)
+        cached, missing = reopened.get_many(images)
+        if missing != [images[1]] or reopened.rows != 1:
+            logger.error(f"Unexpected replaced store: {reopened.rows} rows, missing {missing}")
+            return False
+        if os.path.getsize(os.path.join(store_dir, "vectors.bin")) != 8 * 4:
+            logger.error("Old vectors were not truncated")
+            return False
+        return float(cached[images[0]][0]) == 5.0
+
+@image_test
+def test_store_content_hash_reuse() -> bool:
+    """Test that moved and copied files reuse the stored vector by content hash."""
+    import numpy as np
+    import shutil
+    
+    with TempTestDir(prefix="embedding_store_hash_") as temp_test:
+        images = create_fake_images(temp_test.create_subdir("images"), 2)
+        store_dir = os.path.join(temp_test.get_path(), "store")
+        
+        store = cit.EmbeddingStore(store_dir)
+        store.append({path: np.full(8, idx, dtype=np.float32) for idx, path in enumerate(images)})
+        
+        # Move one file and copy the other into a new directory
+        other_dir = temp_test.create_subdir("reorganized")
+        moved = shutil.move(images[0], os.path.join(other_dir, "renamed.jpg"))
+        copied = shutil.copy2(images[1], os.path.join(other_dir, "copy.jpg"))
+        
+        index_path = os.path.join(store_dir, "index.jsonl")
+        with open(index_path, 'rb') as f:
+            index_before = f.read()
+        
+        reopened = cit.EmbeddingStore(store_dir)
+        cached, missing = reopened.get_many([moved, copied, images[1]])
+        if missing or reopened.hash_hits != 2:
+            logger.error(f"Expected two content hash hits, got {reopened.hash_hits} (missing {missing})")
+            return False
+        
+        # Lookups leave the index alone until the caller saves the hits
+        with open(index_path, 'rb') as f:
+            if f.read() != index_before:
+                logger.error("Lookup wrote to the store index")
+                return False
+        if reopened.save_aliases() != 2 or not {moved, copied} <= set(cit.EmbeddingStore(store_dir).entries):
+            logger.error("Saved content hash hits were not found by path")
+            return False
+        
+        # Hash hits share rows instead of storing new vectors
+        return reopened.rows == 2 and float(cached[moved][0]) == 0.0 and float(cached[copied][0]) == 1.0
+
+@image_test
+def test_exact_duplicate_prepass() -> bool:
+    """Test that only byte-identical files collapse and that copies return to their groups."""
+    from imagetools import file_hashing
+    
+    with TempTestDir(prefix="exact_duplicates_") as temp_test:
+        image_dir = temp_test.create_subdir("images")
+        data = bytearray(os.urandom(4 * file_hashing.EDGE_BLOCK_SIZE))
+        files = {"original.jpg": bytes(data), "copy.jpg": bytes(data)}
+        
+        # Same size and the same first and last blocks, but a different middle
+        data[len(data) // 2] ^= 0xFF
+        files["edited_middle.jpg"] = bytes(data)
+        files["unique_size.jpg"] = bytes(data[:-1])
+        
+        paths = {}
+        for name, content in files.items():
+            paths[name] = os.path.join(image_dir, name)
+            with open(paths[name], 'wb') as f:
+                f.write(content)
+        
+        # Record which files reach the edge hash stage
+        edge_hashed = []
+        hash_file_edges = file_hashing.hash_file_edges
+        def recording_hash_file_edges(path, *args, **kwargs):
+            edge_hashed.append(os.path.basename(path))
+            return hash_file_edges(path, *args, **kwargs)
+        
+        file_hashing.hash_file_edges = recording_hash_file_edges
+        try:
+            duplicates = cit.find_exact_duplicates(list(paths.values()), show_progress=False)
+        finally:
+            file_hashing.hash_file_edges = hash_file_edges
+        
+        if duplicates != {paths["original.jpg"]: [paths["copy.jpg"]]}:
+            logger.error(f"Unexpected duplicates: {duplicates}")
+            return False
+        if "unique_size.jpg" in edge_hashed or "edited_middle.jpg" not in edge_hashed:
+            logger.error(f"Unexpected files hashed: {edge_hashed}")
+            return False
+        
+        groups = [{paths["original.jpg"], paths["edited_middle.jpg"]}, {paths["unique_size.jpg"]}]
+        cit.restore_duplicates(groups, duplicates)
+        return groups == [{paths["original.jpg"], paths["copy.jpg"], paths["edited_middle.jpg"]},
+                          {paths["unique_size.jpg"]}]
+
+@image_test
+def test_store_int8_vectors() -> bool:
+    """Test that an int8 store keeps a scale per row and survives compaction."""
+    import numpy as np
+    
+    with TempTestDir(prefix="embedding_store_int8_") as temp_test:
+        images = create_fake_images(temp_test.create_subdir("images"), 3)
+        store_dir = os.path.join(temp_test.get_path(), "store")
+        rng = np.random.default_rng(3)
+        vectors = {path: rng.normal(scale=10.0 ** idx, size=64).astype(np.float32)
+                   for idx, path in enumerate(images)}
+        
+        store = cit.EmbeddingStore(store_dir, dtype="int8")
+        store.append(vectors)
+        
+        # Replace one vector so the store has a stale row to compact
+        time.sleep(0.01)
+        with open(images[0], 'ab') as f:
+            f.write(b"edited")
+        vectors[images[0]] = -vectors[images[0]]
+        store.append({images[0]: vectors[images[0]]})
+        if os.path.getsize(os.path.join(store_dir, "vectors.bin")) != 4 * 64 or store.compact() != 1:
+            logger.error("Expected four one-byte-per-value rows before compaction")
+            return False
+        
+        cached, missing = cit.EmbeddingStore(store_dir).get_many(images)
+        if missing:
+            logger.error(f"Missing int8 embeddings: {missing}")
+            return False
+        
+        # Each row is within half a quantization step of the original, whatever its magnitude
+        for path, vector in vectors.items():
+            step = np.abs(vector).max() / 127
+            if cached[path].dtype != np.float32 or np.abs(cached[path] - vector).max() > step / 2 + 1e-6 * step:
+                logger.error(f"int8 row for {path} is off by {np.abs(cached[path] - vector).max()}")
+                return False
+        return True
+
+@image_test
+def test_grouping_state_update() -> bool:
+    """Test that an update regroups only the groups touched by added, removed and modified images."""
+    import numpy as np
+    
+    def vector(*components):
+        v = np.zeros(8, dtype=np.float32)
+        for axis, value in components:
+            v[axis] = value
+        return v
+    
+    angle = np.radians(20)
+    with TempTestDir(prefix="grouping_state_") as temp_test:
+        a1, a2, b1, b2, b3, d1, d2, c, a3 = create_fake_images(temp_test.create_subdir("images"), 9)
+        os.remove(a3)
+        embeddings = {
+            a1: vector((0, 1.0)), a2: vector((0, 1.0), (7, 0.1)),
+            # b2 links b1 and b3, which are not similar to each other
+            b1: vector((1, 1.0)), b2: vector((1, np.cos(angle)), (2, np.sin(angle))),
+            b3: vector((1, np.cos(2 * angle)), (2, np.sin(2 * angle))),
+            d1: vector((3, 1.0)), d2: vector((3, 1.0), (6, 0.1)),
+            c: vector((4, 1.0))
+        }
+        threshold = 0.9
+        groups = cit.group_similar_images(embeddings, similarity_threshold=threshold, show_progress=False)
+        if sorted(len(group) for group in groups) != [1, 2, 2, 3]:
+            logger.error(f"Unexpected initial groups: {groups}")
+            return False
+        
+        state_dir = os.path.join(temp_test.get_path(), "state")
+        state = cit.GroupingState.from_groups(groups, embeddings, settings={"similarity_threshold": threshold})
+        state.set_group_outputs({idx: [f"out_{idx}"] for idx in range(len(groups))})
+        state.save(state_dir)
+        
+        loaded = cit.GroupingState.load(state_dir)
+        if loaded is None or not loaded.matches({"similarity_threshold": threshold}):
+            logger.error("Saved grouping state could not be loaded")
+            return False
+        if sorted(map(sorted, loaded.groups())) != sorted(map(sorted, groups)):
+            logger.error("Loaded groups differ from the saved groups")
+            return False
+        
+        # Remove the link of the b chain, add an image to the a group and modify c
+        os.remove(b2)
+        with open(a3, 'wb') as f:
+            f.write(b"new")
+        time.sleep(0.01)
+        with open(c, 'wb') as f:
+            f.write(b"modified contents")
+        current = [a1, a2, a3, b1, b3, c, d1, d2]
+        
+        added, removed = loaded.diff(current)
+        if sorted(added) != sorted([a3, c]) or sorted(removed) != sorted([b2, c]):
+            logger.error(f"Unexpected diff: added {added}, removed {removed}")
+            return False
+        
+        d_output = [paths for root, paths in loaded.outputs.items()
+                    if loaded.paths[root] in (d1, d2)][0]
+        new_embeddings = {a3: vector((0, 1.0), (5, 0.2)), c: vector((5, 1.0))}
+        updated, affected, stale = loaded.update(new_embeddings, removed, threshold)
+        
+        expected = sorted(map(sorted, [{a1, a2, a3}, {b1}, {b3}, {c}, {d1, d2}]))
+        if sorted(map(sorted, updated)) != expected:
+            logger.error(f"Unexpected updated groups: {updated}")
+            return False
+        
+        # Only the d group is unchanged; it keeps its outputs and is not rewritten
+        unchanged = [idx for idx in range(len(updated)) if idx not in affected]
+        if [updated[idx] for idx in unchanged] != [{d1, d2}] or d_output[0] in stale:
+            logger.error(f"Wrong groups marked as changed: {affected}")
+            return False
+        if sorted(stale) != sorted(path for path in [f"out_{idx}" for idx in range(4)] if path != d_output[0]):
+            logger.error(f"Unexpected stale outputs: {stale}")
+            return False
+        
+        loaded.set_group_outputs({idx: [f"new_{idx}"] for idx in affected})
+        loaded.save(state_dir)
+        reloaded = cit.GroupingState.load(state_dir)
+        if sorted(map(sorted, reloaded.groups())) != expected:
+            logger.error("Updated groups were not saved")
+            return False
+        return sorted(reloaded.outputs.values()) == sorted([d_output] + [[f"new_{idx}"] for idx in affected])
+
+if __name__ == "__main__":
+    # Run tests when script is executed directly
+    results = []
+    
+    tests = [
+        test_store_reuse,
+        test_store_detects_modified_files,
+        test_store_decode_mode,
+        test_store_content_hash_reuse,
+        test_exact_duplicate_prepass,
+        test_store_int8_vectors,
+        test_grouping_state_update
+    ]
+    
+    for test_func in tests:
+        result = test_func()
+        results.append((test_func.__name__, result))
+        
+        if isinstance(result, tuple):
+            success = result[0] == 0
+        else:
+            success = bool(result)
+        
+        status = "PASSED" if success else "FAILED"
+        print(f"Test {test_func.__name__}: {status}")
+    
+    # Exit with failure if any test failed
+    failed_tests = [name for name, result in results if
+                   (isinstance(result, tuple) and result[0] != 0) or
+                   (not isinstance(result, tuple) and not bool(result))]
+    
+    if failed_tests:
+        print(f"Failed tests: {', '.join(failed_tests)}")
+        sys.exit(1)
+    
+    print("All tests passed!")
+    sys.exit(0)
@@ -34,7 +34,8 @@ from tests.common import (
     TempTestDir,
     create_pattern_matching_test,
     TEST_IMAGES_DIR,
-    logger
+    logger,
+    cit
 )
 
 @image_test
@@ -296,6 +297,80 @@ def test_pattern_precedence() -> Tuple[int, str, str, str]:
                f"{stdout1}\n\n{stdout2}", \
                f"{stderr1}\n\n{stderr2}"
 
+@image_test
+def test_parallel_crawl() -> bool:
+    """Test that the parallel crawler finds the same images in os.walk order."""
+    from PIL import Image
+
+    with TempTestDir(prefix="parallel_crawl_") as temp_test:
+        root = temp_test.get_path()
+        for rel_dir in ["a/b/c", "a/d", "foo", "foobar/deep", "skip_me/inner", "e"]:
+            os.makedirs(os.path.join(root, rel_dir), exist_ok=True)
+        for dirpath, _, _ in os.walk(root):
+            for name in ["one.png", "two.jpg", "skip_me.png", "notes.txt"]:
+                path = os.path.join(dirpath, name)
+                if name.endswith(".txt"):
+                    with open(path, "w") as f:
+                        f.write("not an image")
+                else:
+                    Image.new("RGB", (8, 8)).save(path)
+
+        # Reference: os.walk order with string-prefix exclusion on whole components
+        excluded = os.path.join(root, "foo")
+        expected = []
+        for dirpath, dirs, files in os.walk(root):
+            dirs[:] = [d for d in dirs if os.path.join(dirpath, d) != excluded and d != "skip_me"]
+            expected.extend(os.path.join(dirpath, f) for f in files
+                            if f.endswith((".png", ".jpg")) and f != "skip_me.png")
+
+        for workers in (1, 8):
+            found = cit.find_images([root], exclude_dirs=[excluded], num_workers=workers,
+                                    exclude_dirs_pattern=["skip_me"], exclude_files_pattern=["skip_me*"])
+            if found != expected:
+                logger.error(f"Crawl with {workers} workers differs from os.walk: {found} vs {expected}")
+                return False
+
+        shallow = cit.find_images([root], max_depth=1, num_workers=4)
+        if any(os.path.relpath(path, root).count(os.sep) > 1 for path in shallow):
+            logger.error("max_depth was not respected")
+            return False
+        return True
+
+@image_test
+def test_pattern_set() -> bool:
+    """Test that compiled pattern sets agree with imgsrch's per-pattern fallback."""
+    from imgsrch import FallbackPatternSet
+
+    names = ["include_me", "exclude_this_dir", "img_001.jpg", "IMG_002.PNG", "temp.tmp",
+             "backup_2020", "photo.jpeg", "x", "a.b.c", "test_123"]
+    cases = [
+        ("glob", ["include*", "test_*", "*.jpg"], ["exclude*", "*.tmp", "backup_*"]),
+        ("regex", [r"^img_\d+", r"\.jpe?g$", r"(ab|x)"], [r"temp", r"^backup", r"(.)\1"]),
+        ("glob", None, ["*"]),
+        ("regex", ["["], None)  # Invalid patterns are skipped
+    ]
+    for mode, include, exclude in cases:
+        for options in [dict(include_dirs=include, exclude_dirs=exclude, include_files=include, exclude_files=exclude),
+                        dict(include_pattern=include, exclude_pattern=exclude)]:
+            patterns = cit.PatternSet(pattern_mode=mode, **options)
+            fallback = FallbackPatternSet(pattern_mode=mode, **options)
+            for name in names:
+                if (patterns.match_dir(name) != fallback.match_dir(name) or
+                        patterns.match_file(name) != fallback.match_file(name)):
+                    logger.error(f"Pattern set differs from the fallback for {name!r} in {mode} mode ({options})")
+                    return False
+
+    # Directory prefixes only match whole path components
+    exclude_paths = [os.path.join(os.sep, "data", "foo")]
+    checks = {
+        os.path.join(os.sep, "data", "foo"): True,
+        os.path.join(os.sep, "data", "foo", "bar"): True,
+        os.path.join(os.sep, "data", "foobar"): False,
+        os.path.join(os.sep, "data"): False
+    }
+    return all(pattern_set(exclude_paths=exclude_paths).is_excluded_path(path) == excluded
+               for pattern_set in (cit.PatternSet, FallbackPatternSet) for path, excluded in checks.items())
+
 if __name__ == "__main__":
     # Run tests when script is executed directly
     results = []
@@ -306,7 +381,9 @@ if __name__ == "__main__":
         test_exclude_patterns,
         test_general_include_pattern,
         test_regex_pattern_mode,
-        test_pattern_precedence
+        test_pattern_precedence,
+        test_parallel_crawl,
+        test_pattern_set
     ]
     
     for test_func in tests:
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+# Copyright (C) 2025 Dustin Darcy <ScarcityHypothesis.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+
+"""
+tests/test_perceptual_hash.py
+
+Tests for the perceptual hash prefilter used by find_best_images.py.
+Tests hash distances, BK-tree range search, tiered grouping and hash-only mode.
+"""
+
+import os
+import sys
+from typing import Tuple, List, Dict
+
+# Import common utilities
+from tests.common import (
+    image_test,
+    run_find_best_images,
+    TempTestDir,
+    logger,
+    cit
+)
+
+def create_pattern_images(directory: str, count: int) -> List[Tuple[str, str]]:
+    """Create distinct patterned images, each with a resized JPEG variant."""
+    import numpy as np
+    from PIL import Image
+
+    pairs = []
+    rng = np.random.default_rng(7)
+    for idx in range(count):
+        pixels = (rng.random((12, 16, 3)) * 255).astype(np.uint8)
+        img = Image.fromarray(pixels).resize((320, 240), Image.Resampling.BICUBIC)
+
+        original = os.path.join(directory, f"pattern_{idx}.png")
+        img.save(original, "PNG")
+        variant = os.path.join(directory, f"pattern_{idx}_small.jpg")
+        img.resize((160, 120)).save(variant, "JPEG", quality=85)
+        pairs.append((original, variant))
+    return pairs
+
+@image_test
+def test_perceptual_hash_distances() -> bool:
+    """Test that variants hash close together and BK-tree search matches brute force."""
+    import random
+
+    with TempTestDir(prefix="perceptual_hash_") as temp_test:
+        pairs = create_pattern_images(temp_test.get_path(), 4)
+
+        for method in cit.HASH_METHODS:
+            hashes = cit.compute_perceptual_hashes([p for pair in pairs for p in pair],
+                                                   method=method, show_progress=False)
+            variant_distances = [cit.hamming_distance(hashes[a], hashes[b]) for a, b in pairs]
+            other_distances = [cit.hamming_distance(hashes[pairs[i][0]], hashes[pairs[j][0]])
+                               for i in range(len(pairs)) for j in range(i + 1, len(pairs))]
+            logger.info(f"{method}: variant distances {variant_distances}, "
+                        f"closest unrelated {min(other_distances)}")
+            if max(variant_distances) >= min(other_distances):
+                logger.error(f"{method} does not separate variants from unrelated images")
+                return False
+
+    rng = random.Random(3)
+    values = [rng.getrandbits(64) for _ in range(300)]
+    values += [value ^ (1 << rng.randrange(64)) for value in values[:50]]
+    tree = cit.BKTree()
+    for idx, value in enumerate(values):
+        tree.add(value, idx)
+
+    for query in values[:20]:
+        expected = {idx for idx, value in enumerate(values) if cit.hamming_distance(query, value) <= 20}
+        found = {idx for idx, _ in tree.search(query, 20)}
+        if found != expected:
+            logger.error(f"BK-tree search differs from brute force: {len(found)} vs {len(expected)}")
+            return False
+    return True
+
+@image_test
+def test_hash_tier_grouping() -> bool:
+    """Test that only uncertain pairs are compared with embeddings."""
+    import numpy as np
+
+    hashes = {"a.jpg": 0, "b.jpg": 0b11, "c.jpg": (1 << 10) - 1, "d.jpg": (1 << 64) - 1}
+    same_pairs, uncertain_pairs = cit.classify_hash_pairs(hashes, same_distance=4, unrelated_distance=12)
+    if same_pairs != [("a.jpg", "b.jpg")] or sorted(uncertain_pairs) != [("a.jpg", "c.jpg"), ("b.jpg", "c.jpg")]:
+        logger.error(f"Unexpected hash tiers: {same_pairs} / {list(uncertain_pairs)}")
+        return False
+    if uncertain_pairs.images != {"a.jpg", "b.jpg", "c.jpg"} or len(uncertain_pairs) != 2:
+        logger.error(f"Unexpected uncertain band summary: {uncertain_pairs.images}, {len(uncertain_pairs)}")
+        return False
+
+    # Only images in uncertain pairs carry embeddings; c matches b but not a
+    embeddings = {
+        "a.jpg": np.array([1.0, 0.0], dtype=np.float32),
+        "b.jpg": np.array([0.0, 1.0], dtype=np.float32),
+        "c.jpg": np.array([0.1, 1.0], dtype=np.float32)
+    }
+    # Score the streamed pairs one per block as well as all in one block
+    from imagetools import similarity_tools
+    block_size = similarity_tools.CANDIDATE_BLOCK_SIZE
+    for size in (1, block_size):
+        similarity_tools.CANDIDATE_BLOCK_SIZE = size
+        try:
+            groups = cit.group_similar_images(embeddings, similarity_threshold=0.95, show_progress=False,
+                                              image_paths=list(hashes), candidate_pairs=uncertain_pairs,
+                                              linked_pairs=same_pairs)
+        finally:
+            similarity_tools.CANDIDATE_BLOCK_SIZE = block_size
+        if sorted(sorted(g) for g in groups) != [["a.jpg", "b.jpg", "c.jpg"], ["d.jpg"]]:
+            logger.error(f"Unexpected groups with {size} pairs per block: {groups}")
+            return False
+    return True
+
+@image_test
+def test_hash_only_mode() -> bool:
+    """Test that hash-only mode groups variants without computing embeddings."""
+    with TempTestDir(prefix="hash_only_") as temp_test:
+        create_pattern_images(temp_test.create_subdir("images"), 3)
+        output_dir = os.path.join(temp_test.get_path(), "output")
+
+        returncode, stdout, stderr = run_find_best_images(
+            os.path.join(temp_test.get_path(), "images"),
+            output_dir,
+            extra_args=["--hash-only", "--dryrun", "-v"]
+        )
+        if returncode != 0:
+            logger.error(f"Hash-only run failed: {stderr}")
+            return False
+
+        output = stdout + stderr
+        return "Perceptual hash tier left 0 of 6 images for CLIP" in output and \
+               "Found 3 total groups (3 with multiple images)" in output
+
+if __name__ == "__main__":
+    # Run tests when script is executed directly
+    results = []
+
+    tests = [
+        test_perceptual_hash_distances,
+        test_hash_tier_grouping,
+        test_hash_only_mode
+    ]
+
+    for test_func in tests:
+        result = test_func()
+        results.append((test_func.__name__, result))
+
+        if isinstance(result, tuple):
+            success = result[0] == 0
+        else:
+            success = bool(result)
+
+        status = "PASSED" if success else "FAILED"
+        print(f"Test {test_func.__name__}: {status}")
+
+    # Exit with failure if any test failed
+    failed_tests = [name for name, result in results if
+                   (isinstance(result, tuple) and result[0] != 0) or
+                   (not isinstance(result, tuple) and not bool(result))]
+
+    if failed_tests:
+        print(f"Failed tests: {', '.join(failed_tests)}")
+        sys.exit(1)
+
+    print("All tests passed!")
+    sys.exit(0)
@@ -25,6 +25,7 @@ Tests primary/secondary metrics, date preferences, and hybrid evaluation.
 import os
 import sys
 import tempfile
+from datetime import datetime
 from typing import Tuple, List, Dict
 
 # Import common utilities
@@ -35,7 +36,8 @@ from tests.common import (
     create_test_image_structure,
     create_modified_dates_test,
     TEST_IMAGES_DIR,
-    logger
+    logger,
+    cit
 )
 
 @image_test
@@ -226,6 +228,103 @@ def test_date_metric_override() -> Tuple[int, str, str, str]:
         
         return returncode, override_output, stdout, stderr
 
+@image_test
+def test_metadata_table() -> bool:
+    """Test that the metadata table matches per-file metrics and best-image selection."""
+    from PIL import Image
+
+    with TempTestDir(prefix="metadata_table_") as temp_test:
+        paths = []
+        for name, size, fmt in [("large.jpg", (400, 300), "JPEG"), ("small.png", (200, 150), "PNG"),
+                                ("wide.jpg", (500, 150), "JPEG"), ("same.png", (400, 300), "PNG")]:
+            path = os.path.join(temp_test.get_path(), name)
+            Image.new("RGB", size, (120, 80, 40)).save(path, fmt)
+            paths.append(path)
+
+        # A capture time older than the file takes precedence for created_date
+        dated = os.path.join(temp_test.get_path(), "dated.jpg")
+        exif = Image.Exif()
+        exif[0x0132] = "2001:02:03 04:05:06"
+        Image.new("RGB", (300, 200), (10, 20, 30)).save(dated, "JPEG", exif=exif)
+        paths.append(dated)
+
+        metadata = cit.MetadataTable.probe(paths, num_workers=2)
+        capture_time = datetime(2001, 2, 3, 4, 5, 6).timestamp()
+        if metadata.get_quality(dated, "created_date") != capture_time:
+            logger.error(f"created_date ignores the EXIF capture time of {dated}")
+            return False
+        for path in paths:
+            if metadata.get_dimensions(path) != cit.get_image_dimensions(path):
+                logger.error(f"Dimensions differ for {path}")
+                return False
+            for metric in cit.DEFAULT_METRIC_WEIGHTS:
+                for preference in ("newest", "oldest"):
+                    expected = cit.get_image_quality(path, metric, preference)
+                    if metadata.get_quality(path, metric, preference) != expected:
+                        logger.error(f"{metric} ({preference}) differs for {path}")
+                        return False
+
+        for primary, secondary in [(None, None), (["format_quality"], ["filesize", "dimensions"]),
+                                   ([], ["resolution", "format_quality", "modified_date"])]:
+            expected = cit.find_best_image_hybrid(paths, primary_metrics=primary, secondary_metrics=secondary)
+            found = cit.find_best_image_hybrid(paths, primary_metrics=primary, secondary_metrics=secondary,
+                                               metadata=metadata)
+            if found != expected:
+                logger.error(f"Best image differs with metadata table: {found} vs {expected}")
+                return False
+        return True
+
+@image_test
+def test_batch_best_image_selection() -> bool:
+    """Test that vectorized selection over all groups matches per-group hybrid selection."""
+    import random
+    from PIL import Image
+
+    with TempTestDir(prefix="batch_selection_") as temp_test:
+        rng = random.Random(5)
+        paths = []
+        for idx in range(24):
+            ext, fmt = rng.choice([(".jpg", "JPEG"), (".png", "PNG"), (".bmp", "BMP")])
+            path = os.path.join(temp_test.get_path(), f"image_{idx}{ext}")
+            size = (rng.choice([100, 120, 160]), rng.choice([80, 100, 120]))
+            Image.new("RGB", size, (rng.randrange(256), 90, 30)).save(path, fmt)
+            os.utime(path, (1600000000, 1600000000 + rng.choice([0, 100, 200])))
+            paths.append(path)
+
+        groups = [set(paths[start:start + size]) for start, size in [(0, 1), (1, 4), (5, 6), (11, 2), (13, 11)]]
+        metadata = cit.MetadataTable.probe(paths)
+        for primary, secondary in [(None, None), (["format_quality"], ["filesize", "dimensions"]),
+                                   (["modified_date"], ["resolution", "format_quality", "created_date"])]:
+            expected = [cit.find_best_image_hybrid(group, primary_metrics=primary, secondary_metrics=secondary)
+                        for group in groups]
+            found = cit.find_best_images_batch(groups, primary_metrics=primary, secondary_metrics=secondary,
+                                               metadata=metadata)
+            if found != expected:
+                logger.error(f"Batch selection differs for {primary}/{secondary}: {found} vs {expected}")
+                return False
+
+        # The margin reaches the batch selection through create_output_structure
+        import numpy as np
+        large = os.path.join(temp_test.get_path(), "margin_large.png")
+        noisy = os.path.join(temp_test.get_path(), "margin_noisy.png")
+        Image.new("RGB", (100, 100), (0, 0, 0)).save(large, "PNG")
+        Image.fromarray(np.random.default_rng(0).integers(0, 256, (98, 98, 3), dtype=np.uint8)).save(noisy, "PNG")
+        for margin, expected in ((0.0, large), (0.05, noisy)):
+            results = cit.create_output_structure([{large, noisy}], os.path.join(temp_test.get_path(), "out"),
+                                                  primary_metrics=["dimensions"], secondary_metrics=["filesize"],
+                                                  margin_threshold=margin, dryrun=True, show_progress=False)
+            if results[0]["best_image"] != expected:
+                logger.error(f"Best image with margin {margin} is {results[0]['best_image']}")
+                return False
+
+    # Rows within the margin of the group best stay tied for the weighted metrics
+    matrix = [[100, 1], [98, 5], [50, 9], [10, 0], [10, 2]]
+    groups, rows = cit.select_best_images(matrix, [0, 0, 0, 1, 1], primary_columns=[0],
+                                          secondary_weights=[(1, 1.0)], margin_threshold=0.05)
+    _, exact_rows = cit.select_best_images(matrix, [0, 0, 0, 1, 1], primary_columns=[0],
+                                           secondary_weights=[(1, 1.0)])
+    return groups.tolist() == [0, 1] and rows.tolist() == [1, 4] and exact_rows.tolist() == [0, 4]
+
 if __name__ == "__main__":
     # Run tests when script is executed directly
     results = []
@@ -234,7 +333,9 @@ if __name__ == "__main__":
         test_primary_metrics,
         test_secondary_metrics,
         test_date_preference,
-        test_date_metric_override
+        test_date_metric_override,
+        test_metadata_table,
+        test_batch_best_image_selection
     ]
     
     for test_func in tests:
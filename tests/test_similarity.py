@@ -33,7 +33,8 @@ from tests.common import (
     TempTestDir,
     create_test_image_structure,
     TEST_IMAGES_DIR,
-    logger
+    logger,
+    cit
 )
 
 @image_test
@@ -241,6 +242,291 @@ def test_check_regions() -> Tuple[int, str, str, str]:
                "\n\n".join(f"Regions {regions}:\n{stderr}" 
                          for regions, _, stderr, _ in results)
 
+@image_test
+def test_matrix_similarity_engine() -> bool:
+    """Test that the tiled matrix engine matches a brute-force comparison."""
+    import numpy as np
+    
+    rng = np.random.default_rng(42)
+    base = rng.normal(size=(6, 32)).astype(np.float32)
+    
+    # Build near-duplicates of each base vector so that groups exist
+    vectors = np.concatenate([base + rng.normal(scale=0.05, size=base.shape).astype(np.float32)
+                              for _ in range(4)])
+    embeddings = {f"img_{idx}.jpg": vector for idx, vector in enumerate(vectors)}
+    threshold = 0.95
+    
+    paths, matrix = cit.build_embedding_matrix(embeddings)
+    expected = set()
+    for i in range(len(paths)):
+        for j in range(i + 1, len(paths)):
+            if float(matrix[i] @ matrix[j]) >= threshold:
+                expected.add((i, j))
+    
+    # Use a tile size that doesn't divide the row count to cover ragged tiles
+    found = set()
+    for rows, cols, sims in cit.iter_similar_pairs(matrix, threshold, tile_size=5):
+        if not np.all(sims >= threshold):
+            logger.error("Engine returned a pair below the threshold")
+            return False
+        found.update(zip(rows.tolist(), cols.tolist()))
+    
+    if found != expected:
+        logger.error(f"Engine pairs differ from brute force: {len(found)} vs {len(expected)}")
+        return False
+    
+    groups = cit.group_similar_images(embeddings, similarity_threshold=threshold,
+                                      show_progress=False, tile_size=5)
+    multi_groups = [g for g in groups if len(g) > 1]
+    logger.info(f"Matrix engine formed {len(multi_groups)} multi-image groups")
+    return len(multi_groups) == len(base)
+
+@image_test
+def test_disjoint_set_grouping() -> bool:
+    """Test union-find merging with streamed edges."""
+    disjoint_set = cit.DisjointSet(6)
+    
+    # Chain 0-1-2 through separate edges, plus an isolated pair 4-5
+    disjoint_set.union_pairs([0, 1], [1, 2])
+    disjoint_set.union(4, 5)
+    
+    # Repeated edges should not merge anything new
+    if disjoint_set.union(2, 0):
+        logger.error("Union of already-connected indices reported a merge")
+        return False
+    
+    new_index = disjoint_set.add()
+    disjoint_set.union(new_index, 3)
+    
+    groups = sorted(sorted(g) for g in disjoint_set.groups())
+    logger.info(f"Disjoint set groups: {groups}")
+    return groups == [[0, 1, 2], [3, 6], [4, 5]]
+
+@image_test
+def test_ann_index_recall() -> bool:
+    """Test that the approximate index finds the same groups as exact comparison."""
+    import numpy as np
+    
+    rng = np.random.default_rng(7)
+    base = rng.normal(size=(40, 64)).astype(np.float32)
+    vectors = np.concatenate([base + rng.normal(scale=0.05, size=base.shape).astype(np.float32)
+                              for _ in range(3)])
+    embeddings = {f"img_{idx}.jpg": vector for idx, vector in enumerate(vectors)}
+    
+    exact_groups = cit.group_similar_images(embeddings, similarity_threshold=0.95,
+                                            show_progress=False)
+    ann_groups = cit.group_similar_images(embeddings, similarity_threshold=0.95,
+                                          show_progress=False, index="ann",
+                                          ann_lists=8, ann_probes=3)
+    
+    exact = sorted(sorted(g) for g in exact_groups)
+    approximate = sorted(sorted(g) for g in ann_groups)
+    logger.info(f"Exact: {len(exact)} groups, approximate: {len(approximate)} groups")
+    if exact != approximate:
+        return False
+    
+    # Probing every list checks each pair exactly once
+    _, matrix = cit.build_embedding_matrix(embeddings)
+    index = cit.IVFIndex(n_lists=8, n_probe=8).add(matrix)
+    pairs = [pair for rows, cols, _ in index.iter_similar_pairs(0.95, tile_size=16)
+             for pair in zip(rows.tolist(), cols.tolist())]
+    exhaustive = len(vectors) * (len(vectors) - 1) // 2
+    if index.candidates_checked != exhaustive or len(pairs) != len(set(pairs)):
+        logger.error(f"Checked {index.candidates_checked} of {exhaustive} pairs, "
+                     f"{len(pairs) - len(set(pairs))} reported twice")
+        return False
+    return all(i < j for i, j in pairs)
+
+@image_test
+def test_compact_vector_grouping() -> bool:
+    """Test that float16 and int8 matrices with rescoring form the same groups as float32."""
+    import numpy as np
+    
+    rng = np.random.default_rng(11)
+    base = rng.normal(size=(100, 256)).astype(np.float32)
+    
+    # Spread the noise so that many pairs fall close to the threshold
+    embeddings = {f"img_{idx}.jpg": base[idx % 100] + rng.normal(scale=0.2 + 0.002 * (idx % 50), size=256)
+                  for idx in range(500)}
+    exact = sorted(sorted(g) for g in cit.group_similar_images(embeddings, similarity_threshold=0.96,
+                                                                show_progress=False))
+    
+    for dtype, ratio in (("float16", 0.5), ("int8", 0.25)):
+        _, matrix = cit.build_embedding_matrix(embeddings, dtype=dtype)
+        if matrix.dtype != dtype or matrix.nbytes > ratio * 1.05 * matrix.shape[0] * matrix.shape[1] * 4:
+            logger.error(f"{dtype} matrix uses {matrix.nbytes} bytes")
+            return False
+        for index in ("exact", "ann"):
+            groups = cit.group_similar_images(embeddings, similarity_threshold=0.96, show_progress=False,
+                                              vector_dtype=dtype, rescore=True, index=index,
+                                              ann_lists=1 if index == "ann" else None)
+            if sorted(sorted(g) for g in groups) != exact:
+                logger.error(f"Rescored {dtype} groups with --index {index} differ from float32")
+                return False
+    return True
+
+@image_test
+def test_decode_pipeline() -> bool:
+    """Test that worker processes produce the same batches as in-process decoding."""
+    import numpy as np
+    from PIL import Image
+    
+    with TempTestDir(prefix="decode_pipeline_") as temp_test:
+        rng = np.random.default_rng(1)
+        paths = []
+        for idx in range(7):
+            path = os.path.join(temp_test.get_path(), f"image_{idx}.png")
+            size = (64 + 16 * idx, 48 + 8 * idx)
+            Image.fromarray((rng.random((size[1], size[0], 3)) * 255).astype(np.uint8)).save(path)
+            paths.append(path)
+        
+        # An unreadable file must be reported without stopping the pipeline
+        broken = os.path.join(temp_test.get_path(), "broken.jpg")
+        with open(broken, 'wb') as f:
+            f.write(b"not an image")
+        paths.insert(3, broken)
+        
+        config = cit.get_preprocess_config()
+        serial = list(cit.iter_preprocessed_batches(paths, config, batch_size=3, num_workers=1))
+        parallel = list(cit.iter_preprocessed_batches(paths, config, batch_size=3, num_workers=3,
+                                                      prefetch_batches=2))
+        
+        if [batch[0] for batch in serial] != [batch[0] for batch in parallel]:
+            logger.error("Worker processes returned batches out of order")
+            return False
+        
+        if [path for batch in parallel for path, _ in batch[2]] != [broken]:
+            logger.error("Expected exactly the broken file to be reported as a failure")
+            return False
+        
+        first = parallel[0][1]
+        if first.shape != (3, 3, 224, 224) or first.dtype != np.float32:
+            logger.error(f"Unexpected batch shape {first.shape} / {first.dtype}")
+            return False
+        
+        return all(np.array_equal(a[1], b[1]) for a, b in zip(serial, parallel))
+
+@image_test
+def test_streaming_discovery() -> bool:
+    """Test that streamed discovery finds the same images and feeds the decode pipeline lazily."""
+    import numpy as np
+    from PIL import Image
+    
+    with TempTestDir(prefix="streaming_discovery_") as temp_test:
+        rng = np.random.default_rng(2)
+        for idx in range(9):
+            subdir = temp_test.create_subdir(os.path.join(f"dir{idx % 3}", f"sub{idx % 2}"))
+            pixels = (rng.random((40, 56, 3)) * 255).astype(np.uint8)
+            Image.fromarray(pixels).save(os.path.join(subdir, f"image_{idx}.png"))
+        
+        found = cit.find_images([temp_test.get_path()], logger=logger)
+        streamed = list(cit.iter_images([temp_test.get_path()], logger=logger, num_workers=4, max_queued=2))
+        if sorted(streamed) != sorted(found):
+            logger.error(f"Streamed {len(streamed)} images, find_images found {len(found)}")
+            return False
+        
+        # The pipeline must accept a generator without knowing its length
+        config = cit.get_preprocess_config()
+        stream = cit.iter_images([temp_test.get_path()], logger=logger, max_queued=2)
+        batches = list(cit.iter_preprocessed_batches(stream, config, batch_size=4, num_workers=2))
+        decoded = [path for batch in batches for path in batch[0]]
+        if sorted(decoded) != sorted(found):
+            logger.error("Decode pipeline lost images from a streamed input")
+            return False
+        
+        # Errors in the background producer must reach the consumer
+        def failing():
+            yield "first"
+            raise OSError("listing failed")
+        
+        received = []
+        try:
+            for item in cit.iter_in_background(failing(), max_items=1):
+                received.append(item)
+        except OSError:
+            return received == ["first"]
+        logger.error("Background iterator swallowed the producer error")
+        return False
+
+@image_test
+def test_fast_decode() -> bool:
+    """Test that reduced-resolution decoding stays above the needed size and close to full decoding."""
+    import numpy as np
+    from PIL import Image
+    
+    with TempTestDir(prefix="fast_decode_") as temp_test:
+        rng = np.random.default_rng(5)
+        pixels = (rng.random((30, 40, 3)) * 255).astype(np.uint8)
+        path = os.path.join(temp_test.get_path(), "large.jpg")
+        Image.fromarray(pixels).resize((4000, 3000), Image.Resampling.BICUBIC).save(path, "JPEG", quality=90)
+        
+        fast = cit.open_image(path, min_size=224)
+        full = cit.open_image(path, min_size=224, fast_decode=False)
+        if full.size != (4000, 3000) or min(fast.size) < 224 or fast.width >= 1000:
+            logger.error(f"Unexpected decode sizes: fast {fast.size}, full {full.size}")
+            return False
+        
+        region = cit.extract_image_region(path, "bottom_right", size=512)
+        if not 224 <= min(region.size) < 512:
+            logger.error(f"Unexpected fast region size {region.size}")
+            return False
+        
+        config = cit.get_preprocess_config()
+        fast_pixels = cit.preprocess_image(fast, config)
+        full_pixels = cit.preprocess_image(full, config)
+        difference = float(np.abs(fast_pixels - full_pixels).mean())
+        logger.info(f"Mean normalized pixel difference between fast and full decoding: {difference:.4f}")
+        return difference < 0.2
+
+@image_test
+def test_region_embedding_grouping() -> bool:
+    """Test that region similarity is computed from region embeddings as vectors."""
+    import numpy as np
+    from PIL import Image
+    
+    rng = np.random.default_rng(11)
+    region_types = cit.get_region_types(3)
+    paths = [f"img_{idx}.jpg" for idx in range(9)]
+    embeddings = {path: rng.normal(size=16).astype(np.float32) for path in paths}
+    region_embeddings = {region_type: {path: rng.normal(size=16).astype(np.float32) for path in paths}
+                         for region_type in region_types}
+    
+    # Images 0-2 agree in every region; 3 matches 0 as a whole image only
+    for source in (1, 2):
+        embeddings[paths[source]] = embeddings[paths[0]] + 0.01
+        for region_type in region_types:
+            region_embeddings[region_type][paths[source]] = region_embeddings[region_type][paths[0]] + 0.01
+    embeddings[paths[3]] = embeddings[paths[0]]
+    
+    # Brute-force weighted similarity against the tiled engine
+    _, matrix = cit.build_embedding_matrix(embeddings, paths)
+    region_matrices = [cit.build_region_matrix(region_embeddings[region_type], embeddings, paths)
+                       for region_type in region_types]
+    rows, cols = np.triu_indices(len(paths), k=1)
+    expected = cit.score_pairs(matrix, rows, cols, region_matrices=region_matrices)
+    found = {}
+    for r, c, sims in cit.iter_similar_pairs(matrix, -1.0, tile_size=4, region_matrices=region_matrices):
+        found.update({(int(a), int(b)): float(v) for a, b, v in zip(r, c, sims)})
+    if len(found) != len(expected) or \
+            any(abs(found[(int(a), int(b))] - float(v)) > 1e-5 for a, b, v in zip(rows, cols, expected)):
+        logger.error("Tiled region similarities differ from pairwise scores")
+        return False
+    
+    groups = cit.group_similar_images(embeddings, similarity_threshold=0.95, use_regions=3,
+                                      region_embeddings=region_embeddings, show_progress=False, tile_size=4)
+    multi_groups = [sorted(g) for g in groups if len(g) > 1]
+    if multi_groups != [paths[:3]]:
+        logger.error(f"Unexpected region groups: {multi_groups}")
+        return False
+    
+    # Region crops are preprocessed from one decode of each image
+    with TempTestDir(prefix="region_batch_") as temp_test:
+        path = os.path.join(temp_test.get_path(), "regions.png")
+        Image.fromarray((rng.random((700, 900, 3)) * 255).astype(np.uint8)).save(path)
+        config = cit.get_preprocess_config(region_types=region_types)
+        batch_paths, pixel_values, failures = next(cit.iter_preprocessed_batches([path, path], config))
+        return not failures and pixel_values.shape == (2 * len(region_types), 3, 224, 224)
+
 if __name__ == "__main__":
     # Run tests when script is executed directly
     results = []
@@ -249,7 +535,15 @@ if __name__ == "__main__":
         test_similarity_thresholds,
         test_similarity_presets,
         test_preset_overrides_threshold,
-        test_check_regions
+        test_check_regions,
+        test_matrix_similarity_engine,
+        test_disjoint_set_grouping,
+        test_ann_index_recall,
+        test_compact_vector_grouping,
+        test_decode_pipeline,
+        test_streaming_discovery,
+        test_fast_decode,
+        test_region_embedding_grouping
     ]
     
     for test_func in tests: